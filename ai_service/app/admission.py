@@ -0,0 +1,134 @@
+"""
+Admission control for the inference path (/rag/ask).
+CPU-bound work (encode, FAISS search, hybrid scoring) runs on a dedicated executor sized to the
+cores instead of anyio's default threadpool, and at most `queue_depth` requests wait behind it:
+- queue full    -> Overloaded, raised before anything is queued (HTTP 503/429 + Retry-After)
+- past deadline -> DeadlineExceeded (HTTP 504); queued work whose caller gave up is dropped unrun
+"""
+
+import asyncio
+import contextvars
+import math
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional, TypeVar
+
+from . import metrics
+from .config import settings
+
+T = TypeVar("T")
+
+
+class Overloaded(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"inference queue full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def configure_threads(workers: int) -> int:
+    """
+    Intra-op threads for torch and FAISS (OpenMP). With micro-batching all encodes run on one
+    batcher thread, so it may use every core; otherwise each executor worker gets cores // workers.
+    """
+    cpu = os.cpu_count() or 1
+    n = settings.torch_num_threads or (cpu if settings.embed_batch_enabled else max(1, cpu // workers))
+    try:
+        import torch  # optional here: only present with the sentence-transformers backends
+
+        torch.set_num_threads(n)
+    except ImportError:
+        pass
+    import faiss  # type: ignore
+
+    faiss.omp_set_num_threads(n)
+    return n
+
+
+class AdmissionController:
+    def __init__(self, workers: int, queue_depth: int):
+        self.workers = max(workers, 1)
+        self.queue_depth = max(queue_depth, 0)
+        self.intra_op_threads: Optional[int] = None
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="infer")
+        self._lock = threading.Lock()
+        self._inflight = 0  # admitted and not finished (running + queued)
+        self._running = 0
+        self._service_sec = 0.0  # EWMA of per-request service time, for Retry-After
+        self._stats = {"admitted": 0, "rejected": 0, "expired": 0, "timedOut": 0, "completed": 0, "maxQueued": 0}
+
+    def _retry_after(self) -> int:
+        queued = max(self._inflight - self.workers + 1, 1)
+        return max(1, math.ceil(queued * self._service_sec / self.workers))
+
+    def _admit(self) -> None:
+        with self._lock:
+            if self._inflight >= self.workers + self.queue_depth:
+                self._stats["rejected"] += 1
+                raise Overloaded(self._retry_after())
+            self._inflight += 1
+            self._stats["admitted"] += 1
+            self._stats["maxQueued"] = max(self._stats["maxQueued"], self._inflight - self.workers)
+
+    def _release(self, _: Future) -> None:
+        with self._lock:
+            self._inflight -= 1
+
+    def _run(self, fn: Callable[[], T], deadline: Optional[float], submitted: float) -> T:
+        metrics.add_stage("queue", time.monotonic() - submitted)
+        if deadline is not None and time.monotonic() >= deadline:
+            # 调用方已超时放弃：排队期间过期的请求直接丢弃，不再占用 CPU
+            with self._lock:
+                self._stats["expired"] += 1
+            raise DeadlineExceeded("deadline passed while queued")
+        with self._lock:
+            self._running += 1
+        t0 = time.perf_counter()
+        try:
+            return fn()
+        finally:
+            dt = time.perf_counter() - t0
+            with self._lock:
+                self._running -= 1
+                self._stats["completed"] += 1
+                self._service_sec = dt if not self._service_sec else 0.8 * self._service_sec + 0.2 * dt
+
+    async def run(self, fn: Callable[[], T], timeout_sec: Optional[float] = None) -> T:
+        """Run `fn` on the inference executor; the caller waits at most `timeout_sec`."""
+        self._admit()
+        deadline = time.monotonic() + timeout_sec if timeout_sec else None
+        # 复制 contextvars，使 app/metrics.py 的分阶段计时跟随请求进入推理线程
+        ctx = contextvars.copy_context()
+        fut = self._executor.submit(ctx.run, self._run, fn, deadline, time.monotonic())
+        fut.add_done_callback(self._release)  # capacity frees when the work really ends
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(fut), timeout=timeout_sec or None)
+        except asyncio.TimeoutError:
+            # 仍在排队 -> 取消，不再运行；已在运行 -> 结果被丢弃
+            dropped = fut.cancel()
+            with self._lock:
+                self._stats["timedOut"] += 1
+                self._stats["expired"] += int(dropped)
+            raise DeadlineExceeded(f"no result within {timeout_sec:.3f}s")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            out = dict(self._stats)
+            out["running"] = self._running
+            out["queued"] = max(self._inflight - self._running, 0)
+            out["avgServiceMs"] = round(self._service_sec * 1000.0, 2)
+        out["workers"] = self.workers
+        out["queueDepth"] = self.queue_depth
+        out["intraOpThreads"] = self.intra_op_threads
+        return out
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+controller = AdmissionController(settings.infer_workers or os.cpu_count() or 1, settings.infer_queue_depth)
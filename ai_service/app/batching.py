@@ -0,0 +1,132 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+@dataclass
+class _Pending:
+    query: str
+    topk: int
+    target: Optional[str]  # "chunk" | "drama" | None (embed only)
+    knobs: Tuple[Optional[int], Optional[int]] = (None, None)  # (efSearch, nprobe)
+    future: Future = field(default_factory=Future)
+
+
+class MicroBatcher:
+    """
+    Dynamic micro-batching between request handlers and the embedding model.
+    Queries arriving within `window_ms` (or until `max_batch`) share one encode call
+    and one multi-row FAISS search per target index; each caller gets its own row back.
+    """
+    def __init__(self, store, window_ms: float, max_batch: int, queue_depth: int):
+        self.store = store
+        self.window_sec = max(window_ms, 0.0) / 1000.0
+        self.max_batch = max(max_batch, 1)
+        self._queue: "queue.Queue[Optional[_Pending]]" = queue.Queue(maxsize=max(queue_depth, 1))
+        self._lock = threading.Lock()
+        self._stats = {"batches": 0, "requests": 0, "maxBatch": 0, "inline": 0}
+        self._closed = False
+        self._close_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._loop, name="embed-batcher", daemon=True)
+        self._thread.start()
+
+    def search(self, query: str, topk: int, target: str,
+               knobs: Tuple[Optional[int], Optional[int]] = (None, None)) -> Tuple[np.ndarray, np.ndarray]:
+        """Blocking call; returns (scores, ids) rows for a single query."""
+        req = _Pending(query=query, topk=topk, target=target, knobs=knobs)
+        if not self._submit(req):
+            return self._run_inline(req)
+        return req.future.result()
+
+    def embed(self, query: str) -> np.ndarray:
+        """Blocking call; the query vector only (encoded together with the concurrent searches)."""
+        req = _Pending(query=query, topk=0, target=None)
+        if not self._submit(req):
+            return self.store._embed([query])[0]
+        return req.future.result()
+
+    def _submit(self, req: _Pending) -> bool:
+        with self._close_lock:
+            if not self._closed:
+                try:
+                    self._queue.put_nowait(req)
+                    return True
+                except queue.Full:
+                    pass
+        # 队列满（或已关闭，如热切换后仍在旧索引上的请求）时退化为直接计算，避免调用方无限等待
+        with self._lock:
+            self._stats["inline"] += 1
+        return False
+
+    def close(self) -> None:
+        """Stop the worker after the already-queued requests; later calls run inline."""
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            out = dict(self._stats)
+        out["avgBatch"] = round(out["requests"] / out["batches"], 2) if out["batches"] else 0.0
+        out["queued"] = self._queue.qsize()
+        out["windowMs"] = self.window_sec * 1000.0
+        return out
+
+    # -----------------------------
+    # Worker
+    # -----------------------------
+
+    def _loop(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = time.monotonic() + self.window_sec
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    nxt = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    self._run_batch(batch)
+                    return
+                batch.append(nxt)
+            self._run_batch(batch)
+
+    def _run_batch(self, batch: List[_Pending]) -> None:
+        try:
+            vecs = self.store._embed([r.query for r in batch])
+            for i, r in enumerate(batch):
+                if r.target is None:
+                    r.future.set_result(vecs[i])
+            for target, knobs in {(r.target, r.knobs) for r in batch if r.target is not None}:
+                rows = [i for i, r in enumerate(batch) if r.target == target and r.knobs == knobs]
+                k = max(batch[i].topk for i in rows)
+                params = self.store._search_params(target, *knobs)
+                D, I = self.store._index_for(target).search(vecs[rows], k, params=params)
+                for j, i in enumerate(rows):
+                    tk = batch[i].topk
+                    batch[i].future.set_result((D[j, :tk], I[j, :tk]))
+        except Exception as e:
+            for r in batch:
+                if not r.future.done():
+                    r.future.set_exception(e)
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["requests"] += len(batch)
+            self._stats["maxBatch"] = max(self._stats["maxBatch"], len(batch))
+
+    def _run_inline(self, req: _Pending) -> Tuple[np.ndarray, np.ndarray]:
+        q = self.store._embed([req.query])
+        params = self.store._search_params(req.target, *req.knobs)
+        D, I = self.store._index_for(req.target).search(q, req.topk, params=params)
+        return D[0], I[0]
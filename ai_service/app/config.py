@@ -11,9 +11,102 @@ class Settings:
     embedding_model_name: str = os.getenv("EMBEDDING_MODEL_NAME", "BAAI/bge-small-en-v1.5")
     topk_default: int = int(os.getenv("TOPK_DEFAULT", "6"))
 
+    # Encoder backend: st (fp32) | int8 (torch dynamic quantization) | onnx; must match the build
+    encoder_backend: str = os.getenv("ENCODER_BACKEND", "st").lower()
+    encoder_onnx_file: str = os.getenv("ENCODER_ONNX_FILE", "")
+    # 预导出的本地模型目录（scripts/export_model.py）；设置后不再经 HF hub 解析
+    embedding_model_dir: str = os.getenv("EMBEDDING_MODEL_DIR", "")
+
+    # Multi-worker: mmap FAISS codes / string tables so workers share pages (read-only)
+    index_mmap: bool = os.getenv("INDEX_MMAP", "0") == "1"
+    # Unix socket of a shared encoder process (scripts/encoder_server.py); empty = load the model in-process
+    encoder_socket: str = os.getenv("ENCODER_SOCKET", "")
+
+    # Sharded index (build_index.py --shards): set SHARD_URLS to run as the coordinator, which embeds
+    # once and fans out to the shard nodes (comma-separated base URLs); empty = serve AI_INDEX_DIR locally
+    shard_urls: str = os.getenv("SHARD_URLS", "")
+    shard_timeout_ms: float = float(os.getenv("SHARD_TIMEOUT_MS", "500"))  # shards slower than this are left out
+    shard_startup_wait_sec: float = float(os.getenv("SHARD_STARTUP_WAIT_SEC", "30"))  # for /shard/info at start
+
+    # Personalized recommend (scene=recommend + userId): user taste vectors from scripts/build_user_vectors.py;
+    # the query vector is blended with the user's (weight = share of the taste vector), watched dramas excluded
+    user_store_dir: Path = Path(os.getenv("USER_STORE_DIR", "ai_service/index/users")).resolve()
+    user_taste_weight: float = float(os.getenv("USER_TASTE_WEIGHT", "0.3"))
+    user_store_check_sec: float = float(os.getenv("USER_STORE_CHECK_SEC", "10"))  # how often state.json is polled
+
+    # Synonyms + category boosts used by drama-level hybrid scoring
+    lexicon_path: Path = Path(os.getenv("LEXICON_PATH", str(Path(__file__).with_name("lexicon.json")))).resolve()
+
+    # Retrieval mode per scene: vector | sparse (BM25) | fused (vector + BM25 rank fusion)
+    retrieval_mode_search: str = os.getenv("RETRIEVAL_MODE_SEARCH", "vector").lower()
+    retrieval_mode_recommend: str = os.getenv("RETRIEVAL_MODE_RECOMMEND", "vector").lower()
+    retrieval_mode_qa: str = os.getenv("RETRIEVAL_MODE_QA", "vector").lower()
+    fusion_method: str = os.getenv("FUSION_METHOD", "rrf").lower()  # rrf | weighted
+    rrf_k: int = int(os.getenv("RRF_K", "60"))
+    fusion_vector_weight: float = float(os.getenv("FUSION_VECTOR_WEIGHT", "0.7"))
+
+    # Query embedding cache (LRU by entry count; TTL 0 = never expire; size 0 = disabled)
+    embed_cache_size: int = int(os.getenv("EMBED_CACHE_SIZE", "4096"))
+    embed_cache_ttl_sec: float = float(os.getenv("EMBED_CACHE_TTL_SEC", "0"))
+
+    # FAISS search-time knobs for approximate indexes (0 = use the default stored in the index)
+    faiss_ef_search: int = int(os.getenv("FAISS_EF_SEARCH", "0"))  # HNSW
+    faiss_nprobe: int = int(os.getenv("FAISS_NPROBE", "0"))  # IVF
+
+    # Micro-batching of concurrent queries (one encode + one multi-row search per window)
+    embed_batch_enabled: bool = os.getenv("EMBED_BATCH_ENABLED", "1") == "1"
+    embed_batch_window_ms: float = float(os.getenv("EMBED_BATCH_WINDOW_MS", "3"))
+    embed_batch_max_size: int = int(os.getenv("EMBED_BATCH_MAX_SIZE", "32"))
+    embed_batch_queue_depth: int = int(os.getenv("EMBED_BATCH_QUEUE_DEPTH", "256"))
+
+    # Hot reload: poll CURRENT / manifest.json every N seconds (0 = only via POST /admin/reload)
+    index_watch_interval_sec: float = float(os.getenv("INDEX_WATCH_INTERVAL_SEC", "0"))
+    index_verify_checksum: bool = os.getenv("INDEX_VERIFY_CHECKSUM", "1") == "1"
+    admin_token: str = os.getenv("ADMIN_TOKEN", "")  # empty = admin endpoints unauthenticated (dev)
+
+    # Cold start: blocking = load before accepting traffic; background = serve /healthz while loading
+    startup_mode: str = os.getenv("STARTUP_MODE", "blocking").lower()
+    warmup_queries: int = int(os.getenv("WARMUP_QUERIES", "8"))  # 0 = no warmup before ready
+
+    # Admission control: dedicated inference executor (0 = cpu_count) + bounded wait queue
+    infer_workers: int = int(os.getenv("INFER_WORKERS", "0"))
+    infer_queue_depth: int = int(os.getenv("INFER_QUEUE_DEPTH", "64"))
+    request_timeout_ms: int = int(os.getenv("REQUEST_TIMEOUT_MS", "10000"))  # 0 = no deadline
+    overload_status: int = int(os.getenv("OVERLOAD_STATUS", "503"))  # 503 | 429
+    torch_num_threads: int = int(os.getenv("TORCH_NUM_THREADS", "0"))  # 0 = auto (see app/admission.py)
+    batch_max_items: int = int(os.getenv("BATCH_MAX_ITEMS", "256"))  # POST /rag/ask/batch
+
+    # Semantic response cache: reuse an AskResponse for near-duplicate queries (0 = disabled, the default;
+    # tune the threshold on the /healthz similarity histogram before turning it on)
+    semantic_cache_size: int = int(os.getenv("SEMANTIC_CACHE_SIZE", "0"))
+    semantic_cache_threshold: float = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))  # cosine
+    semantic_cache_ttl_sec: float = float(os.getenv("SEMANTIC_CACHE_TTL_SEC", "600"))
+
+    # Prometheus /metrics for the MCP stdio server (0 = off; the HTTP service always serves /metrics)
+    mcp_metrics_port: int = int(os.getenv("MCP_METRICS_PORT", "0"))
+
     llm_provider: str = os.getenv("LLM_PROVIDER", "NONE").upper()  # NONE or OPENAI
     openai_api_key: str = os.getenv("OPENAI_API_KEY", "")
     openai_base_url: str = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
     openai_model: str = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+    # LLM gateway: pooled keep-alive client, global concurrency cap + wait queue, per-call timeout
+    # (queue wait included) after which the template answer is used
+    llm_timeout_sec: float = float(os.getenv("LLM_TIMEOUT_SEC", "10"))
+    llm_max_concurrency: int = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+    llm_queue_depth: int = int(os.getenv("LLM_QUEUE_DEPTH", "64"))
+    llm_max_tokens: int = int(os.getenv("LLM_MAX_TOKENS", "256"))
+    llm_prompt_items: int = int(os.getenv("LLM_PROMPT_ITEMS", "5"))  # retrieved dramas put in the prompt
+    llm_snippet_chars: int = int(os.getenv("LLM_SNIPPET_CHARS", "160"))
+    llm_cache_size: int = int(os.getenv("LLM_CACHE_SIZE", "1024"))  # (model, question, dramaIds) -> answer
+    llm_cache_ttl_sec: float = float(os.getenv("LLM_CACHE_TTL_SEC", "3600"))
+    # SSE (POST /rag/ask/stream): keep-alive ping interval while waiting for tokens
+    sse_ping_sec: int = int(os.getenv("SSE_PING_SEC", "15"))
+
+    def retrieval_mode(self, scene: str) -> str:
+        return {
+            "search": self.retrieval_mode_search,
+            "recommend": self.retrieval_mode_recommend,
+            "qa": self.retrieval_mode_qa,
+        }.get(scene, "vector")
 
 settings = Settings()
\ No newline at end of file
@@ -0,0 +1,176 @@
+"""
+Shard coordinator (SHARD_URLS set): stands in for IndexStore without loading any index.
+The query side is inherited unchanged (encoder / ENCODER_SOCKET, embedding cache, micro-batcher,
+scene routing in app/rag.py); every FAISS / BM25 lookup becomes one fan-out to the shard nodes
+(app/shards.py). Per-shard top-k lists are merged by score first, then hits_to_drama and hybrid
+scoring run on the merged candidates exactly as on a single index.
+Cosine scores are comparable across shards (same encoder); BM25 scores use per-shard IDF, which
+is close enough for rank fusion on a random dramaId split.
+"""
+
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .config import settings
+from .encoders import Encoder
+from .hybrid import HybridScorer
+from .retriever import IndexStore, drama_items, hybrid_items
+from .shards import (
+    ShardFanout, ShardRow, ShardsUnavailable, encode_vectors, mark_partial, merge_topk, parse_rows, positional,
+)
+from .sparse import fuse
+from .versions import shard_of
+
+Hits = List[Tuple[ShardRow, float]]
+
+
+class _OwnerRouted:
+    """drama_chunks stand-in: every drama may have chunks; the owning shard decides (app/rag.py)."""
+    def __contains__(self, drama_id) -> bool:
+        return True
+
+
+class ShardedStore(IndexStore):
+    def __init__(self, urls: List[str], model: Optional[Encoder] = None):
+        self.index_dir = settings.ai_index_dir
+        self.manifest: Dict = {}
+        self.loaded_at = time.time()
+        self.load_phases: Dict[str, float] = {}
+        t0 = time.perf_counter()
+
+        self.fanout = ShardFanout(urls, settings.shard_timeout_ms / 1000.0)
+        self.fanout.fetch_info(settings.shard_startup_wait_sec)
+        infos = [s.info for s in self.fanout.shards if s.info]
+        if not infos:
+            raise RuntimeError(f"No shard node answered /shard/info: {urls}")
+        models = {i["model"] for i in infos}
+        if len(models) > 1:
+            raise ValueError(f"Shards serve different models: {sorted(models)}")
+        self.model_name = models.pop()
+        self.dim = int(infos[0]["dim"])
+        # dramaId % shards -> 节点；未上报分片号的节点（启动时不可达）按剧内检索时全体扇出处理
+        self.n_shards = int(infos[0].get("shards") or len(self.fanout.shards))
+        self.owners = {int(s.info["shard"]): s for s in self.fanout.shards if s.info.get("shard") is not None}
+        self.load_phases["shards"] = round(time.perf_counter() - t0, 3)
+
+        t0 = time.perf_counter()
+        self._init_query_side(model if model is not None and model.model_name == self.model_name else None)
+        if self.model.dim != self.dim:
+            raise ValueError(f"Encoder dim {self.model.dim} != shard index dim {self.dim}")
+        self.load_phases["model"] = round(time.perf_counter() - t0, 3)
+
+        # BM25 在各分片上执行；app/rag.py 只判断是否可用
+        self.bm25 = dict.fromkeys(("chunk", "drama"), "shards")
+        self.drama_chunks = _OwnerRouted()
+        # 相似剧图不随分片构建（近邻跨分片），GET /rag/similar 在协调节点上不可用
+        self.knn = None
+
+    @property
+    def version(self) -> Optional[str]:
+        # 任一分片热加载后组合版本随之变化，语义缓存据此整体失效
+        return "+".join(s.version or "-" for s in self.fanout.shards)
+
+    def warmup(self, n: int) -> Dict:
+        """Encode once and open a keep-alive connection to every shard."""
+        t0 = time.perf_counter()
+        q = self._encode(["warmup"] * max(min(n, 8), 1))
+        self.search_vectors("drama", q[:1], 10)
+        sec = round(time.perf_counter() - t0, 3)
+        self.load_phases["warmup"] = sec
+        return {"queries": len(q), "sec": sec}
+
+    def info(self) -> Dict:
+        shards = [s.report() for s in self.fanout.shards]
+        return {
+            "version": self.version,
+            "dir": str(self.index_dir),
+            "model": self.model_name,
+            "encoderBackend": self.model.backend,
+            "dim": self.dim,
+            "chunks": sum(s["chunks"] or 0 for s in shards),
+            "dramas": sum(s["dramas"] or 0 for s in shards),
+            "loadedAt": round(self.loaded_at, 3),
+            "loadPhases": self.load_phases,
+            "mmap": False,
+            "encoderSocket": settings.encoder_socket or None,
+            "shards": shards,
+            "shardTimeoutMs": settings.shard_timeout_ms,
+        }
+
+    def _fetch(self, target: str, vecs: Optional[np.ndarray], queries: Sequence[str], topk: int,
+               ef_search: Optional[int] = None, nprobe: Optional[int] = None,
+               drama_id: Optional[int] = None, shards=None) -> Tuple[List[Hits], List[Hits]]:
+        """One fan-out: merged (dense hits per vector row, sparse hits per query)."""
+        payload = {"target": target, "topK": topk, "queries": list(queries), "efSearch": ef_search,
+                   "nprobe": nprobe, "dramaId": drama_id}
+        if vecs is not None:
+            payload.update(vectors=encode_vectors(vecs), dim=int(vecs.shape[1]))
+        replies = self.fanout.scatter(payload, shards)
+        n_dense = 0 if vecs is None else len(vecs)
+        dense = [merge_topk([parse_rows(s.no, r["dense"][i]) for s, r in replies if len(r["dense"]) > i], topk)
+                 for i in range(n_dense)]
+        sparse = [merge_topk([parse_rows(s.no, r["sparse"][i]) for s, r in replies], topk)
+                  for i in range(len(queries))]
+        return dense, sparse
+
+    def _search(self, target: str, query: str, topk: int,
+                ef_search: Optional[int] = None, nprobe: Optional[int] = None) -> Hits:
+        q = self.embed_query(query)[None, :]
+        return self._fetch(target, q, (), topk, ef_search, nprobe)[0][0]
+
+    def search_vectors(self, target: str, vecs: np.ndarray, topk: int,
+                       ef_search: Optional[int] = None, nprobe: Optional[int] = None) -> List[Hits]:
+        return self._fetch(target, np.asarray(vecs, dtype="float32"), (), topk, ef_search, nprobe)[0]
+
+    def search_excluding(self, target: str, vec: np.ndarray, topk: int, exclude: np.ndarray,
+                         ef_search: Optional[int] = None, nprobe: Optional[int] = None) -> Hits:
+        # 分片节点不接收排除列表：多取 len(exclude) 条再按 dramaId 过滤，仍是一次扇出
+        skip = {int(i) for i in exclude}
+        hits = self.search_vectors(target, vec[None, :], min(topk + len(skip), 4096), ef_search, nprobe)[0]
+        return [(r, s) for r, s in hits if r.drama_id not in skip][:topk]
+
+    def sparse_search(self, target: str, query: str, topk: int) -> Hits:
+        return self._fetch(target, None, [query], topk)[1][0]
+
+    def retrieve(self, target: str, query: str, topk: int, mode: str = "vector",
+                 ef_search: Optional[int] = None, nprobe: Optional[int] = None,
+                 vec_hits: Optional[Hits] = None) -> Hits:
+        """Same modes as IndexStore.retrieve; fused asks each shard for both lists in one request."""
+        if mode not in ("sparse", "fused"):
+            return vec_hits if vec_hits is not None else self._search(target, query, topk, ef_search, nprobe)
+        q = self.embed_query(query)[None, :] if mode == "fused" and vec_hits is None else None
+        dense, sparse = self._fetch(target, q, [query], topk, ef_search, nprobe)
+        if mode == "sparse":
+            hits = sparse[0]
+            top = hits[0][1] if hits and hits[0][1] > 0 else 1.0
+            return [(row, score / top) for row, score in hits]
+        return fuse(vec_hits if vec_hits is not None else dense[0], sparse[0], topk, method=settings.fusion_method,
+                    rrf_k=settings.rrf_k, vector_weight=settings.fusion_vector_weight)
+
+    def search_in_drama(self, query: str, drama_id: int, topk: int,
+                        ef_search: Optional[int] = None, nprobe: Optional[int] = None,
+                        qvec: Optional[np.ndarray] = None) -> Hits:
+        """Only the owning shard holds the drama's chunks; [] if it does not (or did not answer)."""
+        q = qvec if qvec is not None else self._embed([query])
+        owner = self.owners.get(shard_of(drama_id, self.n_shards))
+        try:
+            dense, _ = self._fetch("chunk", q[:1], (), topk, ef_search, nprobe, drama_id=int(drama_id),
+                                   shards=[owner] if owner is not None else None)
+        except ShardsUnavailable:
+            # 所属分片不可用：app/rag.py 退回到全体分片上的段落检索
+            mark_partial()
+            return []
+        return dense[0]
+
+    def hits_to_drama(self, hits: Hits, dedup_by_drama: bool = True, limit: Optional[int] = None):
+        table, rows = positional(hits)
+        return drama_items(table, rows, dedup_by_drama, limit)
+
+    def _hybrid_items(self, query: str, vec_hits: Hits, final_topk: int,
+                      alpha: float, min_tag_hits: int) -> List[Dict]:
+        # tag 矩阵只建在合并后的候选集上（几百行），词典已缓存
+        table, rows = positional(vec_hits)
+        return hybrid_items(HybridScorer(table, settings.lexicon_path), table, query, rows,
+                            final_topk, alpha, min_tag_hits)
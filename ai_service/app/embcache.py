@@ -0,0 +1,170 @@
+"""
+Content-addressed on-disk embedding cache for index builds.
+Layout per (model, normalize) namespace, under <cache_dir>/<model-slug>-<norm|raw>/:
+- vectors.f32   append-only float32 matrix (row i), read through np.memmap
+- keys.bin      append-only 16-byte blake2b digests of the texts (row i == vector i)
+- meta.json     {model, normalize, dim, secPerText, generation}
+Keys are written after their vectors, so a crashed append is truncated away on the next open.
+compact() writes the pair as vectors-<n>.f32 / keys-<n>.bin and then switches meta.json to
+generation n (one atomic rename), so a crash never pairs old keys with compacted vectors.
+"""
+
+import hashlib
+import json
+import os
+import re
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Set
+
+import numpy as np
+
+KEY_BYTES = 16
+VECTORS_FILE = "vectors.f32"
+KEYS_FILE = "keys.bin"
+META_FILE = "meta.json"
+
+
+def text_key(text: str) -> bytes:
+    return hashlib.blake2b((text or "").encode("utf-8"), digest_size=KEY_BYTES).digest()
+
+
+def namespace_dir(cache_dir: Path, model_name: str, normalize: bool) -> Path:
+    slug = re.sub(r"[^A-Za-z0-9._-]+", "_", model_name).strip("_") or "model"
+    return cache_dir / f"{slug}-{'norm' if normalize else 'raw'}"
+
+
+def generation_file(name: str, generation: int) -> str:
+    """vectors.f32 -> vectors-<generation>.f32 (generation 0 keeps the plain name)."""
+    if not generation:
+        return name
+    stem, ext = name.rsplit(".", 1)
+    return f"{stem}-{generation}.{ext}"
+
+
+class DiskEmbeddingCache:
+    def __init__(self, cache_dir: Path, model_name: str, normalize: bool = True):
+        self.dir = namespace_dir(cache_dir, model_name, normalize)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.meta: Dict = {"model": model_name, "normalize": normalize, "dim": 0, "secPerText": 0.0}
+        if (self.dir / META_FILE).exists():
+            with (self.dir / META_FILE).open("r", encoding="utf-8") as f:
+                self.meta.update(json.load(f))
+        self.keys: Dict[bytes, int] = {}
+        self.rows = 0
+        self._mm = None
+        self._stats = {"hits": 0, "misses": 0, "encodeSec": 0.0}
+        self._load()
+
+    @property
+    def dim(self) -> int:
+        return int(self.meta.get("dim") or 0)
+
+    @property
+    def vectors_path(self) -> Path:
+        return self.dir / generation_file(VECTORS_FILE, int(self.meta.get("generation") or 0))
+
+    @property
+    def keys_path(self) -> Path:
+        return self.dir / generation_file(KEYS_FILE, int(self.meta.get("generation") or 0))
+
+    def _load(self) -> None:
+        raw = self.keys_path.read_bytes() if self.keys_path.exists() else b""
+        vec_path = self.vectors_path
+        n_vec = vec_path.stat().st_size // (4 * self.dim) if self.dim and vec_path.exists() else 0
+        n = min(len(raw) // KEY_BYTES, n_vec)
+        # 截掉中断写入留下的半行
+        if vec_path.exists() and vec_path.stat().st_size != n * 4 * self.dim:
+            os.truncate(vec_path, n * 4 * self.dim)
+        if len(raw) != n * KEY_BYTES:
+            os.truncate(self.keys_path, n * KEY_BYTES)
+        self.keys = {raw[i * KEY_BYTES:(i + 1) * KEY_BYTES]: i for i in range(n)}
+        self.rows = n
+        self._mm = None
+
+    def _vectors(self) -> np.ndarray:
+        if self._mm is None or len(self._mm) != self.rows:
+            if self.rows == 0:
+                return np.zeros((0, self.dim), dtype="float32")
+            self._mm = np.memmap(self.vectors_path, dtype="float32", mode="r", shape=(self.rows, self.dim))
+        return self._mm
+
+    def _write_meta(self) -> None:
+        tmp = self.dir / (META_FILE + ".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump(self.meta, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.dir / META_FILE)
+
+    def append(self, digests: List[bytes], vecs: np.ndarray) -> None:
+        vecs = np.ascontiguousarray(vecs, dtype="float32")
+        if not self.dim:
+            self.meta["dim"] = int(vecs.shape[1])
+            self._write_meta()
+        if vecs.shape[1] != self.dim:
+            raise ValueError(f"Embedding dim {vecs.shape[1]} != cache dim {self.dim} ({self.dir})")
+        with self.vectors_path.open("ab") as f:
+            f.write(vecs.tobytes())
+        with self.keys_path.open("ab") as f:
+            f.write(b"".join(digests))
+        for i, d in enumerate(digests):
+            self.keys[d] = self.rows + i
+        self.rows += len(digests)
+
+    def embed(self, texts: List[str], encode_fn: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """Vectors for `texts`; only unseen texts go through `encode_fn` (deduplicated)."""
+        digests = [text_key(t) for t in texts]
+        todo: Dict[bytes, str] = {}
+        for d, t in zip(digests, texts):
+            if d not in self.keys and d not in todo:
+                todo[d] = t
+        n_miss = sum(1 for d in digests if d in todo)
+        if todo:
+            t0 = time.perf_counter()
+            vecs = encode_fn(list(todo.values()))
+            dt = time.perf_counter() - t0
+            self.append(list(todo), vecs)
+            self._stats["encodeSec"] += dt
+            # 记录单条编码耗时，供命中时估算节省的时间
+            self.meta["secPerText"] = dt / len(todo)
+            self._write_meta()
+        self._stats["hits"] += len(texts) - n_miss
+        self._stats["misses"] += n_miss
+        if not texts:
+            return np.zeros((0, self.dim), dtype="float32")
+        rows = np.fromiter((self.keys[d] for d in digests), dtype="int64", count=len(digests))
+        return np.asarray(self._vectors()[rows], dtype="float32")
+
+    def report(self) -> Dict:
+        hits, misses = self._stats["hits"], self._stats["misses"]
+        return {
+            "dir": str(self.dir),
+            "entries": self.rows,
+            "hits": hits,
+            "misses": misses,
+            "hitRate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            "encodeSec": round(self._stats["encodeSec"], 3),
+            "secSaved": round(hits * float(self.meta.get("secPerText") or 0.0), 3),
+        }
+
+    def compact(self, live: Set[bytes]) -> Dict:
+        """Rewrite the namespace keeping only digests in `live` (GC of unreferenced entries)."""
+        keep = sorted(r for d, r in self.keys.items() if d in live)
+        by_row = {r: d for d, r in self.keys.items()}
+        before = self.rows
+        vecs = np.asarray(self._vectors()[keep], dtype="float32") if keep else np.zeros((0, self.dim), dtype="float32")
+        self._mm = None
+        old = (self.vectors_path, self.keys_path)
+        gen = int(self.meta.get("generation") or 0) + 1
+        # 新一代的两份文件写完后才切换 meta.json；中途崩溃时旧的一对仍然完整
+        (self.dir / generation_file(VECTORS_FILE, gen)).write_bytes(vecs.tobytes())
+        (self.dir / generation_file(KEYS_FILE, gen)).write_bytes(b"".join(by_row[r] for r in keep))
+        self.meta["generation"] = gen
+        self._write_meta()
+        for path in old:
+            path.unlink(missing_ok=True)
+        self._load()
+        return {"dir": str(self.dir), "before": before, "after": self.rows, "removed": before - self.rows}
+
+
+def live_keys(texts: Iterable[str]) -> Set[bytes]:
+    return {text_key(t) for t in texts}
@@ -0,0 +1,211 @@
+"""
+Shared query encoder for multi-worker deployments: one process holds the model, uvicorn workers
+reach it over a Unix socket instead of each loading their own copy.
+Protocol (per request, on a persistent connection):
+  request  = u32 length + JSON {"op": "encode", "texts": [...], "normalize": true} | {"op": "info"}
+  response = u32 length + JSON header ({"ok": true, "n": n, "dim": d} / info / {"ok": false, "error"})
+             followed, for encode, by n * d little-endian float32
+Requests from all workers are micro-batched into one encode call (same idea as app/batching.py).
+"""
+
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from .encoders import Encoder
+
+_LEN = struct.Struct("!I")
+
+
+def _send(sock: socket.socket, header: Dict, payload: bytes = b"") -> None:
+    body = json.dumps(header).encode("utf-8")
+    sock.sendall(_LEN.pack(len(body)) + body + payload)
+
+
+def _recv_exact(sock: socket.socket, n: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < n:
+        part = sock.recv(n - len(buf))
+        if not part:
+            raise ConnectionError("encoder socket closed")
+        buf += part
+    return bytes(buf)
+
+
+def _recv_json(sock: socket.socket) -> Dict:
+    (n,) = _LEN.unpack(_recv_exact(sock, _LEN.size))
+    return json.loads(_recv_exact(sock, n).decode("utf-8"))
+
+
+# -----------------------------
+# Server
+# -----------------------------
+
+class _BatchingEncoder:
+    def __init__(self, encoder: Encoder, window_ms: float, max_batch: int):
+        self.encoder = encoder
+        self.window_sec = window_ms / 1000.0
+        self.max_batch = max(max_batch, 1)
+        self._queue: "queue.Queue[Tuple[List[str], bool, Future]]" = queue.Queue()
+        self._stats = {"requests": 0, "batches": 0, "texts": 0}
+        self._thread = threading.Thread(target=self._loop, name="encoder-batcher", daemon=True)
+        self._thread.start()
+
+    def encode(self, texts: List[str], normalize: bool) -> np.ndarray:
+        fut: Future = Future()
+        self._queue.put((texts, normalize, fut))
+        return fut.result()
+
+    def _loop(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            n = len(batch[0][0])
+            deadline = time.monotonic() + self.window_sec
+            while n < self.max_batch:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                try:
+                    req = self._queue.get(timeout=left)
+                except queue.Empty:
+                    break
+                batch.append(req)
+                n += len(req[0])
+            for normalize in (True, False):
+                group = [r for r in batch if r[1] == normalize]
+                if group:
+                    self._run(group, normalize)
+
+    def _run(self, group, normalize: bool) -> None:
+        texts = [t for r in group for t in r[0]]
+        try:
+            emb = self.encoder.encode(texts, batch_size=max(len(texts), 1), normalize_embeddings=normalize)
+        except Exception as e:
+            for _, _, fut in group:
+                fut.set_exception(e)
+            return
+        self._stats["requests"] += len(group)
+        self._stats["batches"] += 1
+        self._stats["texts"] += len(texts)
+        pos = 0
+        for req_texts, _, fut in group:
+            fut.set_result(emb[pos:pos + len(req_texts)])
+            pos += len(req_texts)
+
+    def stats(self) -> Dict:
+        out = dict(self._stats)
+        out["avgBatch"] = round(out["texts"] / out["batches"], 2) if out["batches"] else 0.0
+        return out
+
+
+def serve(socket_path: str, encoder: Encoder, window_ms: float = 2.0, max_batch: int = 64) -> None:
+    """Blocking; one thread per worker connection, encodes funnel through one batching thread."""
+    batcher = _BatchingEncoder(encoder, window_ms, max_batch)
+    info = {"ok": True, "model": encoder.model_name, "backend": encoder.backend, "variant": encoder.variant,
+            "key": encoder.key, "dim": encoder.dim, "pid": os.getpid()}
+
+    class _Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            sock = self.request
+            while True:
+                try:
+                    req = _recv_json(sock)
+                except (ConnectionError, OSError):
+                    return
+                try:
+                    if req.get("op") == "info":
+                        _send(sock, {**info, "stats": batcher.stats()})
+                        continue
+                    texts = [str(t) for t in req.get("texts") or []]
+                    emb = batcher.encode(texts, bool(req.get("normalize", True))) if texts else \
+                        np.zeros((0, encoder.dim), dtype="float32")
+                    emb = np.ascontiguousarray(emb, dtype="<f4").reshape(len(texts), -1)
+                    _send(sock, {"ok": True, "n": int(emb.shape[0]), "dim": int(emb.shape[1])}, emb.tobytes())
+                except Exception as e:
+                    _send(sock, {"ok": False, "error": str(e)})
+
+    class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)  # 上次异常退出残留的 socket 文件
+    with _Server(socket_path, _Handler) as server:
+        server.serve_forever()
+
+
+# -----------------------------
+# Client (used by app/retriever.py when ENCODER_SOCKET is set)
+# -----------------------------
+
+class RemoteEncoder:
+    """Encoder interface backed by the shared encoder process; one persistent connection per thread."""
+    def __init__(self, socket_path: str, timeout_sec: float = 30.0):
+        self.socket_path = socket_path
+        self.timeout_sec = timeout_sec
+        self._local = threading.local()
+        info, _ = self._call({"op": "info"})
+        self.model_name: str = info["model"]
+        self.backend: str = info["backend"]
+        self.variant: str = info.get("variant") or ""
+        self._key: str = info["key"]
+        self._dim = int(info["dim"])
+
+    @property
+    def key(self) -> str:
+        return self._key
+
+    @property
+    def dim(self) -> int:
+        return self._dim
+
+    def _conn(self) -> socket.socket:
+        sock: Optional[socket.socket] = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout_sec)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return sock
+
+    def _call(self, req: Dict) -> Tuple[Dict, bytes]:
+        for attempt in (0, 1):
+            try:
+                sock = self._conn()
+                _send(sock, req)
+                header = _recv_json(sock)
+                payload = b""
+                if header.get("ok") and "n" in header:
+                    payload = _recv_exact(sock, int(header["n"]) * int(header["dim"]) * 4)
+                break
+            except (ConnectionError, OSError):
+                # 编码进程重启后旧连接失效：重连一次
+                sock = getattr(self._local, "sock", None)
+                if sock is not None:
+                    sock.close()
+                self._local.sock = None
+                if attempt:
+                    raise
+        if not header.get("ok"):
+            raise RuntimeError(f"encoder service: {header.get('error')}")
+        return header, payload
+
+    def encode(self, texts: Union[str, List[str]], batch_size: int = 32, show_progress_bar: bool = False,
+               convert_to_numpy: bool = True, normalize_embeddings: bool = True) -> np.ndarray:
+        single = isinstance(texts, str)
+        header, payload = self._call({"op": "encode", "texts": [texts] if single else list(texts),
+                                      "normalize": normalize_embeddings})
+        emb = np.frombuffer(payload, dtype="<f4").reshape(int(header["n"]), int(header["dim"]))
+        return emb[0] if single else emb
+
+    def stats(self) -> Dict:
+        info, _ = self._call({"op": "info"})
+        return {"socket": self.socket_path, "pid": info.get("pid"), **(info.get("stats") or {})}
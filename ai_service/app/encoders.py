@@ -0,0 +1,131 @@
+"""
+Text encoder backends shared by the online service and scripts/build_index.py.
+Every backend keeps the SentenceTransformer.encode call signature and returns float32 rows
+(L2-normalized when normalize_embeddings=True), so callers do not care which one is active.
+- st:   sentence-transformers on torch fp32 (reference)
+- int8: same model with torch dynamic int8 quantization of the Linear layers (CPU)
+- onnx: sentence-transformers ONNX backend on onnxruntime CPU
+        (needs `pip install "sentence-transformers[onnx]"`; ENCODER_ONNX_FILE picks e.g. an
+        optimized / quantized export such as onnx/model_qint8_avx512.onnx)
+- hash: deterministic hashed unigram + bigram vectors in numpy, no model download and no torch;
+        a stand-in for benchmarks / offline runs only (lexical, not semantic)
+Vectors from different backends drift slightly, so an index should be queried with the
+backend it was built with (recorded as encoderBackend in manifest.json / stats.json).
+sentence-transformers (and with it torch / transformers) is imported on first load, so modules
+that only need Encoder for typing stay cheap to import.
+"""
+
+import os
+import re
+import zlib
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+ENCODER_BACKENDS = ("st", "int8", "onnx", "hash")
+HASH_DIM = 384  # 与 bge-small 相同，基准测试的索引规模 / 内存与真实模型一致
+
+
+class Encoder:
+    def __init__(self, model_name: str, backend: str, model: "SentenceTransformer", variant: str = ""):
+        self.model_name = model_name
+        self.backend = backend
+        self.model = model
+        self.variant = variant  # ONNX file name, if not the default export
+
+    @property
+    def key(self) -> str:
+        """Identity of the vector space (model + backend), used for cache namespaces and reuse checks."""
+        if self.backend == "st":
+            return self.model_name
+        return f"{self.model_name}@{self.backend}" + (f":{self.variant}" if self.variant else "")
+
+    @property
+    def dim(self) -> int:
+        return int(self.model.get_sentence_embedding_dimension())
+
+    def encode(self, texts: Union[str, List[str]], batch_size: int = 32, show_progress_bar: bool = False,
+               convert_to_numpy: bool = True, normalize_embeddings: bool = True) -> np.ndarray:
+        emb = self.model.encode(
+            texts, batch_size=batch_size, show_progress_bar=show_progress_bar,
+            convert_to_numpy=True, normalize_embeddings=normalize_embeddings,
+        )
+        return np.asarray(emb, dtype="float32")
+
+
+class HashingModel:
+    """SentenceTransformer-compatible stand-in: signed feature hashing of words and word bigrams."""
+    _token_re = re.compile(r"[a-z0-9]+")
+
+    def __init__(self, dim: int = HASH_DIM):
+        self.dim = dim
+        self._slots: Dict[str, Tuple[int, float]] = {}  # feature -> (column, sign)；合成数据词表很小
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def _slot(self, feature: str) -> Tuple[int, float]:
+        slot = self._slots.get(feature)
+        if slot is None:
+            h = zlib.crc32(feature.encode("utf-8"))
+            slot = self._slots[feature] = (h % self.dim, 1.0 if (h >> 31) & 1 else -1.0)
+        return slot
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32, show_progress_bar: bool = False,
+               convert_to_numpy: bool = True, normalize_embeddings: bool = False, **_) -> np.ndarray:
+        if isinstance(sentences, str):
+            sentences = [sentences]
+        out = np.zeros((len(sentences), self.dim), dtype="float32")
+        for i, text in enumerate(sentences):
+            words = self._token_re.findall((text or "").lower())
+            feats = words + [a + " " + b for a, b in zip(words, words[1:])]
+            if not feats:
+                out[i, 0] = 1.0
+                continue
+            cols, signs = zip(*(self._slot(f) for f in feats))
+            np.add.at(out[i], np.asarray(cols), np.asarray(signs, dtype="float32"))
+        if normalize_embeddings:
+            norms = np.linalg.norm(out, axis=1, keepdims=True)
+            out /= np.where(norms > 0, norms, 1.0)
+        return out
+
+
+def _quantize_int8(model: "SentenceTransformer") -> "SentenceTransformer":
+    import torch  # lazy: only this backend needs torch APIs directly
+
+    model.eval()
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def load_encoder(model_name: str, backend: str = "st", onnx_file: Optional[str] = None,
+                 local_dir: Optional[str] = None) -> Encoder:
+    """
+    local_dir: a directory written by scripts/export_model.py; loaded with local_files_only and
+    the hub switched offline, so startup never resolves revisions over the network.
+    The encoder keeps `model_name` as its identity either way.
+    """
+    backend = (backend or "st").lower()
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"encoder backend must be one of: {', '.join(ENCODER_BACKENDS)}")
+    if backend == "hash":
+        return Encoder(model_name, backend, HashingModel())
+    source, kw = model_name, {}
+    if local_dir:
+        if not os.path.isdir(local_dir):
+            raise FileNotFoundError(f"Local model dir not found: {local_dir}")
+        # 必须在导入 transformers / huggingface_hub 之前设置才生效
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+        source, kw = local_dir, {"local_files_only": True}
+    from sentence_transformers import SentenceTransformer  # lazy: pulls in torch / transformers
+
+    if backend == "onnx":
+        kwargs = {"file_name": onnx_file} if onnx_file else {}
+        model = SentenceTransformer(source, device="cpu", backend="onnx", model_kwargs=kwargs, **kw)
+    else:
+        model = SentenceTransformer(source, device="cpu" if backend == "int8" else None, **kw)
+        if backend == "int8":
+            model = _quantize_int8(model)
+    return Encoder(model_name, backend, model, variant=(onnx_file or "") if backend == "onnx" else "")
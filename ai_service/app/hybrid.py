@@ -0,0 +1,89 @@
+import json
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+from scipy import sparse
+
+
+@lru_cache(maxsize=4)
+def load_lexicon(path: Path) -> Dict:
+    # 分片协调节点每个请求都要在候选集上重建 HybridScorer，词典只读一次
+    with Path(path).open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class HybridScorer:
+    """
+    Load-time structures for drama-level hybrid scoring:
+    - tag vocabulary + sparse binary drama x tag matrix (lower-cased tags)
+    - category id per drama + category x boost-word table
+    - reverse synonym map (token -> canonical keys) compiled from the lexicon file
+    Scoring a candidate set is then a handful of numpy ops.
+    """
+    def __init__(self, drama_table, lexicon_path: Path):
+        lexicon = load_lexicon(lexicon_path)
+
+        self.reverse_syn: Dict[str, List[str]] = {}
+        for key, arr in (lexicon.get("synonyms") or {}).items():
+            for t in arr:
+                self.reverse_syn.setdefault(t, []).append(key)
+        boosts = lexicon.get("categoryBoosts") or {}
+        self.boost_words: List[str] = list(boosts.keys())
+        self.boost_values = np.asarray([float(v) for v in boosts.values()], dtype="float64")
+
+        n = len(drama_table)
+        self.tag_vocab: Dict[str, int] = {}
+        rows: List[int] = []
+        cols: List[int] = []
+        categories: Dict[str, int] = {}
+        self.category_ids = np.zeros(n, dtype="int32")
+        for i in range(n):
+            for t in set(t.lower() for t in drama_table.tags(i)):
+                rows.append(i)
+                cols.append(self.tag_vocab.setdefault(t, len(self.tag_vocab)))
+            c = (drama_table.category(i) or "").lower()
+            self.category_ids[i] = categories.setdefault(c, len(categories))
+        self.tag_matrix = sparse.csr_matrix(
+            (np.ones(len(rows), dtype="float32"), (rows, cols)), shape=(n, max(len(self.tag_vocab), 1))
+        )
+        # 每个 category 命中哪些加权词（朴素子串匹配，与原实现一致）
+        self.category_rules = np.zeros((max(len(categories), 1), len(self.boost_words)), dtype="float64")
+        for c, cid in categories.items():
+            for j, w in enumerate(self.boost_words):
+                if w in c:
+                    self.category_rules[cid, j] = 1.0
+
+    def tokenize(self, text: str) -> List[str]:
+        text = (text or "").lower()
+        text = re.sub(r"[^a-z0-9\-\+\s]", " ", text)
+        mapped: List[str] = []
+        for t in text.split():
+            if len(t) <= 1:
+                continue
+            mapped.append(t)
+            mapped.extend(self.reverse_syn.get(t, ()))
+        return list(dict.fromkeys(mapped))  # 去重保序
+
+    def score(self, cand_idx: np.ndarray, vscores: np.ndarray, q_tokens: List[str],
+              alpha: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns (hybrid, tag_hits, cat_bonus) arrays aligned with cand_idx.
+        """
+        q = np.zeros(self.tag_matrix.shape[1], dtype="float32")
+        cols = [self.tag_vocab[t] for t in q_tokens if t in self.tag_vocab]
+        if cols:
+            q[cols] = 1.0
+            tag_hits = np.asarray(self.tag_matrix[cand_idx] @ q).astype("int64")
+        else:
+            tag_hits = np.zeros(len(cand_idx), dtype="int64")
+        tag_score = tag_hits / max(1, len(q_tokens))
+
+        q_set = set(q_tokens)
+        weights = self.boost_values * np.asarray([w in q_set for w in self.boost_words], dtype="float64")
+        cat_bonus = self.category_rules[self.category_ids[cand_idx]] @ weights
+
+        hybrid = alpha * vscores.astype("float64") + (1.0 - alpha) * tag_score + cat_bonus
+        return hybrid, tag_hits, cat_bonus
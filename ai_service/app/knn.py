@@ -0,0 +1,142 @@
+"""
+Precomputed "more like this" graph over drama.faiss (build_index.py --knn-k).
+Files inside the index directory:
+- drama_knn_ids.npy      int64 (n, k) neighbor dramaIds per drama-table row, best first, -1 = none
+- drama_knn_scores.npy   float32 (n, k) inner product (cosine on the normalized drama vectors)
+Rows follow the drama table (drama_ids.npy), so serving is the usual dramaId -> row binary search
+plus one row read of a memory-mapped array; nothing is encoded or searched per request.
+The graph is computed with blocked matrix multiplies (a row block against column tiles of the
+drama vectors) keeping a running top-k per row, so memory is bounded by one tile whatever the
+catalog size. update_knn() patches it after an incremental sync instead of recomputing every row.
+"""
+
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .metastore import rows_for_ids
+
+KNN_IDS_FILE = "drama_knn_ids.npy"
+KNN_SCORES_FILE = "drama_knn_scores.npy"
+# 每块查询行数 / 每个候选列分块大小：一次乘法的临时矩阵为 ROW_BLOCK x COL_TILE 个 float32（64MB）
+ROW_BLOCK = 1024
+COL_TILE = 16384
+
+
+def _merge(best_s: np.ndarray, best_i: np.ndarray, s: np.ndarray, i: np.ndarray,
+           k: int) -> Tuple[np.ndarray, np.ndarray]:
+    s = np.concatenate([best_s, s], axis=1)
+    i = np.concatenate([best_i, i], axis=1)
+    if s.shape[1] > k:
+        top = np.argpartition(-s, k - 1, axis=1)[:, :k]
+        s, i = np.take_along_axis(s, top, axis=1), np.take_along_axis(i, top, axis=1)
+    return s, i
+
+
+def knn_rows(queries: np.ndarray, query_ids: np.ndarray, vecs: np.ndarray, ids: np.ndarray, k: int,
+             col_tile: int = COL_TILE) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (scores, neighbor ids), both (len(queries), k) and sorted best first: top-k of `vecs` by inner
+    product for every query row, never the query's own id. Missing slots are (-inf, -1).
+    """
+    best_s = np.full((len(queries), k), -np.inf, dtype="float32")
+    best_i = np.full((len(queries), k), -1, dtype="int64")
+    query_ids = np.asarray(query_ids, dtype="int64")
+    for c0 in range(0, len(vecs), col_tile):
+        tile_ids = np.asarray(ids[c0:c0 + col_tile], dtype="int64")
+        s = queries @ np.asarray(vecs[c0:c0 + col_tile]).T
+        s[query_ids[:, None] == tile_ids[None, :]] = -np.inf  # 自身
+        kk = min(k, s.shape[1])
+        top = np.argpartition(-s, kk - 1, axis=1)[:, :kk]
+        best_s, best_i = _merge(best_s, best_i, np.take_along_axis(s, top, axis=1), tile_ids[top], k)
+    order = np.argsort(-best_s, axis=1, kind="stable")
+    best_s = np.take_along_axis(best_s, order, axis=1)
+    best_i = np.take_along_axis(best_i, order, axis=1)
+    best_i[~np.isfinite(best_s)] = -1
+    return best_s, best_i
+
+
+def build_knn(vecs: np.ndarray, ids: np.ndarray, k: int, rows: Optional[np.ndarray] = None,
+              row_block: int = ROW_BLOCK) -> Tuple[np.ndarray, np.ndarray]:
+    """Graph rows for `rows` (default all) against every vector; vecs are float32 (n, dim), L2-normalized."""
+    vecs = np.ascontiguousarray(vecs, dtype="float32")
+    ids = np.asarray(ids, dtype="int64")
+    rows = np.arange(len(vecs)) if rows is None else np.asarray(rows, dtype="int64")
+    scores = np.full((len(rows), k), -np.inf, dtype="float32")
+    nbrs = np.full((len(rows), k), -1, dtype="int64")
+    for r0 in range(0, len(rows), row_block):
+        r = rows[r0:r0 + row_block]
+        scores[r0:r0 + len(r)], nbrs[r0:r0 + len(r)] = knn_rows(vecs[r], ids[r], vecs, ids, k)
+    return scores, nbrs
+
+
+def update_knn(prev: "KnnGraph", prev_ids: np.ndarray, vecs: np.ndarray, ids: np.ndarray,
+               changed: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray, int]:
+    """
+    Graph for the synced table (vecs / ids, rows sorted by id) from the previous one.
+    `changed` = dramaIds upserted or removed by the sync. Rows of changed dramas, and rows whose
+    list named one, are recomputed against everything; every other row keeps its list (still the
+    exact top-k of the unchanged dramas) and only merges in candidates from the upserted vectors.
+    Returns (scores, neighbor ids, rows recomputed in full).
+    """
+    vecs = np.ascontiguousarray(vecs, dtype="float32")
+    ids = np.asarray(ids, dtype="int64")
+    changed = np.asarray(changed, dtype="int64")
+    old_rows = rows_for_ids(np.asarray(prev_ids, dtype="int64"), ids)
+    upserted = np.isin(ids, changed)
+    clean = (old_rows >= 0) & ~upserted
+    clean[clean] = ~np.isin(np.asarray(prev.ids)[old_rows[clean]], changed).any(axis=1)
+
+    scores = np.empty((len(ids), k), dtype="float32")
+    nbrs = np.empty((len(ids), k), dtype="int64")
+    dirty = np.flatnonzero(~clean)
+    scores[dirty], nbrs[dirty] = build_knn(vecs, ids, k, rows=dirty)
+
+    keep = np.flatnonzero(clean)
+    up = np.flatnonzero(upserted)
+    for r0 in range(0, len(keep), ROW_BLOCK):
+        r = keep[r0:r0 + ROW_BLOCK]
+        old_s = np.asarray(prev.scores)[old_rows[r]].astype("float32")
+        old_i = np.asarray(prev.ids)[old_rows[r]]
+        old_s = np.where(old_i >= 0, old_s, -np.inf).astype("float32")
+        if len(up):
+            new_s, new_i = knn_rows(vecs[r], ids[r], vecs[up], ids[up], k)
+            old_s, old_i = _merge(old_s, old_i, new_s, new_i, k)
+        order = np.argsort(-old_s, axis=1, kind="stable")
+        scores[r] = np.take_along_axis(old_s, order, axis=1)
+        nbrs[r] = np.take_along_axis(old_i, order, axis=1)
+    nbrs[~np.isfinite(scores)] = -1
+    return scores, nbrs, len(dirty)
+
+
+def write_knn(out_dir: Path, scores: np.ndarray, nbrs: np.ndarray) -> None:
+    np.save(out_dir / KNN_IDS_FILE, np.ascontiguousarray(nbrs, dtype="int64"))
+    np.save(out_dir / KNN_SCORES_FILE, np.ascontiguousarray(np.where(nbrs >= 0, scores, 0.0), dtype="float32"))
+
+
+class KnnGraph:
+    def __init__(self, ids: np.ndarray, scores: np.ndarray):
+        self.ids = ids
+        self.scores = scores
+
+    @classmethod
+    def load(cls, index_dir: Path) -> Optional["KnnGraph"]:
+        """Memory-mapped graph of `index_dir`, or None if the index was built without one."""
+        if not (index_dir / KNN_IDS_FILE).exists() or not (index_dir / KNN_SCORES_FILE).exists():
+            return None
+        return cls(np.load(index_dir / KNN_IDS_FILE, mmap_mode="r"),
+                   np.load(index_dir / KNN_SCORES_FILE, mmap_mode="r"))
+
+    @property
+    def k(self) -> int:
+        return int(self.ids.shape[1])
+
+    def __len__(self) -> int:
+        return int(self.ids.shape[0])
+
+    def neighbors(self, row: int, topk: int) -> List[Tuple[int, float]]:
+        """(dramaId, score) of drama-table row `row`, best first."""
+        ids = np.asarray(self.ids[row, :topk])
+        scores = np.asarray(self.scores[row, :topk])
+        return [(int(i), float(s)) for i, s in zip(ids, scores) if i >= 0]
@@ -1,4 +1,23 @@
-from typing import List, Dict, Optional
+"""
+Answer generation: template answer, or an OpenAI-compatible chat completion via LLMGateway.
+The gateway owns one event loop thread with a persistent keep-alive httpx client, so callers on
+any thread (FastAPI handlers, inference workers, the MCP server) share one connection pool:
+- global concurrency cap + bounded wait queue (full -> immediate template fallback)
+- per-call timeout covering queue wait + upstream call; on timeout / error -> template answer
+- LRU response cache keyed by (model, scene, question, retrieved dramaIds)
+- compact prompts: top LLM_PROMPT_ITEMS dramas, snippets clipped to LLM_SNIPPET_CHARS
+"""
+
+import asyncio
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Hashable, List, Optional, Tuple
+
+from . import metrics
 from .config import settings
 
 def build_template_answer(question: str, items: List[Dict]) -> str:
@@ -16,12 +35,360 @@ def build_template_answer(question: str, items: List[Dict]) -> str:
         f"Tap a card to view details and start watching."
     )
 
+def iter_template_tokens(question: str, items: List[Dict]) -> List[str]:
+    # 模板答案按词切分（保留空白），流式接口与 LLM 输出同样逐段下发
+    return re.findall(r"\S+\s*", build_template_answer(question, items))
+
+def llm_enabled() -> bool:
+    return settings.llm_provider == "OPENAI" and bool(settings.openai_api_key)
+
+def _clip(text: str, width: int) -> str:
+    text = " ".join((text or "").split())
+    if len(text) <= width:
+        return text
+    cut = text.rfind(" ", 0, width)
+    return text[:cut if cut > width // 2 else width] + "…"
+
+def build_messages(question: str, items: List[Dict], scene: str, drama_id: Optional[int]) -> List[Dict]:
+    """Compact chat messages: numbered top dramas (title, category, clipped snippet) as context."""
+    lines = []
+    for n, it in enumerate(items[:settings.llm_prompt_items], 1):
+        cat = f" ({it['category']})" if it.get("category") else ""
+        lines.append(f"[{n}] {it.get('title') or ''}{cat}: {_clip(it.get('snippet') or '', settings.llm_snippet_chars)}")
+    task = "Answer about this drama" if scene == "qa" and drama_id else "Recommend from these dramas"
+    return [
+        {"role": "system", "content": "Short-drama assistant. Use only the listed dramas; 2-4 sentences; cite titles."},
+        {"role": "user", "content": f"{task}: {question}\n" + "\n".join(lines)},
+    ]
+
+
+class GatewayBusy(Exception):
+    pass
+
+
+class LLMGateway:
+    def __init__(self, base_url: str, api_key: str, model: str, max_concurrency: int, queue_depth: int,
+                 timeout_sec: float, cache_size: int, cache_ttl_sec: float):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.model = model
+        self.max_concurrency = max(max_concurrency, 1)
+        self.queue_depth = max(queue_depth, 0)
+        self.timeout_sec = timeout_sec
+        self.cache_size = cache_size
+        self.cache_ttl_sec = cache_ttl_sec
+        self._cache: "OrderedDict[Hashable, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._client = None  # httpx.AsyncClient, created on the gateway loop
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._active = 0
+        self._waiting = 0
+        self._stats = {"calls": 0, "cacheHits": 0, "busy": 0, "timeouts": 0, "errors": 0, "cancelled": 0}
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    # -----------------------------
+    # Gateway loop
+    # -----------------------------
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def _run():
+                    asyncio.set_event_loop(loop)
+                    self._sem = asyncio.Semaphore(self.max_concurrency)
+                    loop.call_soon(ready.set)
+                    loop.run_forever()
+
+                self._thread = threading.Thread(target=_run, name="llm-gateway", daemon=True)
+                self._thread.start()
+                ready.wait()
+                self._loop = loop
+            return self._loop
+
+    def _http(self):
+        if self._client is None:
+            import httpx
+
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=httpx.Timeout(self.timeout_sec, connect=min(self.timeout_sec, 5.0)),
+                limits=httpx.Limits(max_connections=self.max_concurrency,
+                                    max_keepalive_connections=self.max_concurrency, keepalive_expiry=60.0),
+            )
+        return self._client
+
+    @asynccontextmanager
+    async def _slot(self):
+        # 运行在网关线程：计数无需加锁
+        if self._sem.locked() and self._waiting >= self.queue_depth:
+            self._count("busy")
+            raise GatewayBusy(f"{self._active} calls in flight, {self._waiting} waiting")
+        self._waiting += 1
+        try:
+            await self._sem.acquire()
+        finally:
+            self._waiting -= 1
+        self._active += 1
+        try:
+            yield
+        finally:
+            self._active -= 1
+            self._sem.release()
+
+    def _body(self, messages: List[Dict], stream: bool) -> Dict:
+        body = {"model": self.model, "messages": messages, "max_tokens": settings.llm_max_tokens,
+                "temperature": 0.3, "stream": stream}
+        if stream:
+            body["stream_options"] = {"include_usage": True}
+        return body
+
+    @staticmethod
+    def _count_usage(usage: Optional[Dict]) -> None:
+        if usage:
+            metrics.LLM_TOKENS.inc("prompt", n=float(usage.get("prompt_tokens") or 0))
+            metrics.LLM_TOKENS.inc("completion", n=float(usage.get("completion_tokens") or 0))
+
+    async def _complete(self, messages: List[Dict]) -> str:
+        async with self._slot():
+            t0 = time.perf_counter()
+            resp = await self._http().post("/chat/completions", json=self._body(messages, stream=False))
+            resp.raise_for_status()
+            data = resp.json()
+            metrics.LLM_SECONDS.observe(time.perf_counter() - t0, "complete", "total")
+        self._count_usage(data.get("usage"))
+        return data["choices"][0]["message"]["content"] or ""
+
+    async def _stream(self, messages: List[Dict], push) -> None:
+        try:
+            async with self._slot():
+                t0 = time.perf_counter()
+                first = True
+                body = self._body(messages, stream=True)
+                async with self._http().stream("POST", "/chat/completions", json=body) as resp:
+                    resp.raise_for_status()
+                    async for line in resp.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == "[DONE]":
+                            break
+                        chunk = json.loads(data)
+                        self._count_usage(chunk.get("usage"))
+                        choices = chunk.get("choices") or [{}]
+                        piece = (choices[0].get("delta") or {}).get("content")
+                        if piece:
+                            if first:
+                                metrics.LLM_SECONDS.observe(time.perf_counter() - t0, "stream", "first_token")
+                                first = False
+                            push(("piece", piece))
+                metrics.LLM_SECONDS.observe(time.perf_counter() - t0, "stream", "total")
+            push(("end", None))
+        except asyncio.CancelledError:
+            self._count("cancelled")
+            metrics.LLM_CALLS.inc("stream", "cancelled")
+            raise
+        except Exception as e:
+            push(("error", e))
+
+    # -----------------------------
+    # Response cache
+    # -----------------------------
+
+    def _key(self, question: str, items: List[Dict], scene: str) -> Hashable:
+        ids = tuple(int(it["dramaId"]) for it in items[:settings.llm_prompt_items])
+        return self.model, scene, " ".join(question.lower().split()), ids
+
+    def _cache_get(self, key: Hashable) -> Optional[str]:
+        if self.cache_size <= 0:
+            return None
+        with self._lock:
+            hit = self._cache.get(key)
+            if hit is None:
+                return None
+            if self.cache_ttl_sec > 0 and time.time() - hit[0] > self.cache_ttl_sec:
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            self._stats["cacheHits"] += 1
+            return hit[1]
+
+    def _cache_put(self, key: Hashable, answer: str) -> None:
+        if self.cache_size <= 0 or not answer:
+            return
+        with self._lock:
+            self._cache[key] = (time.time(), answer)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    # -----------------------------
+    # Public API
+    # -----------------------------
+
+    def _fallback(self, kind: str, e: BaseException, question: str, items: List[Dict]) -> str:
+        outcome = "busy" if isinstance(e, GatewayBusy) else \
+            "timeout" if isinstance(e, (asyncio.TimeoutError, TimeoutError)) else "error"
+        if outcome != "busy":
+            self._count("timeouts" if outcome == "timeout" else "errors")
+        metrics.LLM_CALLS.inc(kind, outcome)
+        metrics.fallback(f"llm_{outcome}")
+        return build_template_answer(question, items)
+
+    def complete(self, question: str, items: List[Dict], scene: str, drama_id: Optional[int]) -> str:
+        """Blocking call for worker threads / sync tools (not for a thread running the gateway loop)."""
+        key = self._key(question, items, scene)
+        cached = self._cache_get(key)
+        if cached is not None:
+            metrics.LLM_CALLS.inc("complete", "cache_hit")
+            return cached
+        self._count("calls")
+        coro = asyncio.wait_for(self._complete(build_messages(question, items, scene, drama_id)), self.timeout_sec)
+        fut = asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+        try:
+            answer = fut.result()
+        except Exception as e:
+            return self._fallback("complete", e, question, items)
+        metrics.LLM_CALLS.inc("complete", "ok")
+        self._cache_put(key, answer)
+        return answer
+
+    async def acomplete(self, question: str, items: List[Dict], scene: str,
+                        drama_id: Optional[int]) -> Tuple[str, bool]:
+        """
+        Awaitable from any other event loop; the upstream call runs on the gateway loop.
+        Returns (answer, fallback): fallback is True when the template answer stands in for a failed call.
+        """
+        key = self._key(question, items, scene)
+        cached = self._cache_get(key)
+        if cached is not None:
+            metrics.LLM_CALLS.inc("complete", "cache_hit")
+            return cached, False
+        self._count("calls")
+        coro = asyncio.wait_for(self._complete(build_messages(question, items, scene, drama_id)), self.timeout_sec)
+        fut = asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+        try:
+            answer = await asyncio.wrap_future(fut)
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as e:
+            return self._fallback("complete", e, question, items), True
+        metrics.LLM_CALLS.inc("complete", "ok")
+        self._cache_put(key, answer)
+        return answer, False
+
+    async def astream(self, question: str, items: List[Dict], scene: str, drama_id: Optional[int]) -> AsyncIterator[str]:
+        """
+        Answer pieces as they arrive. Errors (busy / upstream failure) are raised to the caller;
+        closing the generator cancels the upstream request on the gateway loop.
+        """
+        key = self._key(question, items, scene)
+        cached = self._cache_get(key)
+        if cached is not None:
+            metrics.LLM_CALLS.inc("stream", "cache_hit")
+            yield cached
+            return
+        self._count("calls")
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+
+        def push(item) -> None:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+
+        fut = asyncio.run_coroutine_threadsafe(self._stream(build_messages(question, items, scene, drama_id), push),
+                                               self._ensure_loop())
+        pieces: List[str] = []
+        try:
+            while True:
+                # 首 token 与 token 间隔都受 timeout 约束（httpx 读超时之外再兜底一次）
+                kind, val = await asyncio.wait_for(queue.get(), self.timeout_sec)
+                if kind == "piece":
+                    pieces.append(val)
+                    yield val
+                elif kind == "error":
+                    self._count("errors")
+                    metrics.LLM_CALLS.inc("stream", "busy" if isinstance(val, GatewayBusy) else "error")
+                    raise val
+                else:
+                    metrics.LLM_CALLS.inc("stream", "ok")
+                    self._cache_put(key, "".join(pieces))
+                    return
+        except asyncio.TimeoutError:
+            self._count("timeouts")
+            metrics.LLM_CALLS.inc("stream", "timeout")
+            raise
+        finally:
+            fut.cancel()  # 已结束则无操作；否则取消网关线程上的上游读取
+
+    def stats(self) -> Dict:
+        with self._lock:
+            size = len(self._cache)
+            out: Dict = dict(self._stats)
+        out.update({"active": self._active, "waiting": self._waiting, "maxConcurrency": self.max_concurrency,
+                    "queueDepth": self.queue_depth, "cacheSize": size, "model": self.model,
+                    "enabled": llm_enabled()})
+        return out
+
+    def close(self) -> None:
+        loop = self._loop
+        if loop is None:
+            return
+
+        async def _shutdown():
+            if self._client is not None:
+                await self._client.aclose()
+
+        try:
+            asyncio.run_coroutine_threadsafe(_shutdown(), loop).result(timeout=5)
+        except Exception:
+            pass
+        loop.call_soon_threadsafe(loop.stop)
+
+
+gateway = LLMGateway(settings.openai_base_url, settings.openai_api_key, settings.openai_model,
+                     settings.llm_max_concurrency, settings.llm_queue_depth, settings.llm_timeout_sec,
+                     settings.llm_cache_size, settings.llm_cache_ttl_sec)
+
 def generate_answer(question: str, items: List[Dict], scene: str, drama_id: Optional[int]) -> str:
     """
-    LLM gateway (currently template-only unless OPENAI is configured).
+    LLM gateway (template-only unless OPENAI is configured). Blocking; see agenerate_answer.
+    """
+    if llm_enabled():
+        return gateway.complete(question, items, scene, drama_id)
+    return build_template_answer(question, items)
+
+async def agenerate_answer(question: str, items: List[Dict], scene: str,
+                           drama_id: Optional[int]) -> Tuple[str, bool]:
+    """
+    (answer, fallback). fallback: the LLM is configured but the call was busy / timed out / failed and the
+    template answer was returned instead; callers must not cache it as an LLM answer.
+    """
+    if llm_enabled():
+        return await gateway.acomplete(question, items, scene, drama_id)
+    return build_template_answer(question, items), False
+
+async def stream_answer(question: str, items: List[Dict], scene: str, drama_id: Optional[int]) -> AsyncIterator[str]:
+    """
+    Yield answer text pieces as they arrive. OPENAI: streamed chat completion through the gateway;
+    otherwise the template answer word by word. Closing the generator closes the upstream stream.
     """
-    if settings.llm_provider == "OPENAI" and settings.openai_api_key:
-        # Optional: integrate OpenAI here if needed (requires 'openai' package)
-        # Keep template to avoid extra dependency by default.
-        pass
-    return build_template_answer(question, items)
\ No newline at end of file
+    if not llm_enabled():
+        for tok in iter_template_tokens(question, items):
+            yield tok
+        return
+    source = gateway.astream(question, items, scene, drama_id)
+    try:
+        async for piece in source:
+            yield piece
+    finally:
+        await source.aclose()
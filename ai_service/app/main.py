@@ -1,23 +1,51 @@
-import logging
+import asyncio
+import json
+import os
+import time
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, HTTPException
+from typing import AsyncIterator, Dict, Hashable, List, Optional
+
+from fastapi import FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from pydantic import BaseModel
+from sse_starlette.sse import EventSourceResponse
+from starlette.background import BackgroundTask
 
+from . import metrics, startup
+from .admission import DeadlineExceeded, Overloaded, controller as admission
 from .config import settings
-from .llm import generate_answer
-from .models import AskRequest, AskResponse, DramaHit
-from .retriever import get_index_store
+from .llm import (
+    agenerate_answer, build_template_answer, gateway as llm_gateway, iter_template_tokens, llm_enabled, stream_answer,
+)
+from .models import (
+    AskBatchRequest, AskBatchResponse, AskRequest, AskResponse, DramaHit, ShardSearchRequest, SimilarResponse,
+)
+from .rag import Query, retrieve_items, retrieve_items_batch
+from .semcache import SemanticCache
+from .shards import ShardsUnavailable, decode_vectors, search_local
+from .userstore import get_user_store
+
+
+# 语义结果缓存：近似重复（改写）的查询直接复用最近的 AskResponse
+_semantic_cache = SemanticCache(settings.semantic_cache_size, settings.semantic_cache_threshold,
+                                settings.semantic_cache_ttl_sec)
+
+
+def _retriever():
+    # 延迟导入：faiss / torch 在启动阶段（可为后台线程）加载，而不是 import app.main 时
+    from . import retriever
+    return retriever
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     try:
-        _ = get_index_store()
-        logging.getLogger("uvicorn").info("AI index/model preloaded.")
+        startup.start(background=settings.startup_mode == "background")
         yield
-    except Exception as e:
-        logging.getLogger("uvicorn").warning(f"AI preloaded failed: {e}")
+    finally:
+        startup.shutdown()
 
 app = FastAPI(title="Short Drama AI Service", version="1.0.0", lifespan=lifespan)
 
@@ -32,47 +60,390 @@ app.add_middleware(
 
 @app.get("/healthz")
 def healthz():
+    # Liveness: never blocks on (or triggers) the index load; details appear once ready
+    st = startup.state
+    if not st.ready:
+        return {"ok": st.error is None, "error": st.error, "indexDir": str(settings.ai_index_dir),
+                "startup": st.report(), "process": _process_report()}
+    retriever = _retriever()
+    store = retriever.get_index_store()
+    return {
+        "ok": True,
+        "indexDir": str(settings.ai_index_dir),
+        "startup": st.report(),
+        "index": store.info(),
+        "reload": retriever.reload_stats(),
+        "embedCache": store.embed_cache.stats(),
+        "batcher": store.batcher.stats() if store.batcher else None,
+        "admission": admission.stats(),
+        "semanticCache": _semantic_cache.stats(),
+        "llm": llm_gateway.stats(),
+        "encoderService": store.model.stats() if hasattr(store.model, "stats") else None,
+        "userStore": _user_store_report(),
+        "process": _process_report(),
+    }
+
+def _user_store_report() -> Optional[Dict]:
+    users = get_user_store()
+    return users.stats() if users is not None else None
+
+def _process_report() -> Dict:
+    # 每个 worker 单独上报；pss 把共享页（mmap 索引）按映射进程数分摊，可直接跨 worker 求和
+    mem = metrics.process_memory()
+    return {"pid": os.getpid(), **{f"{k}Mb": round(v / 2 ** 20, 1) for k, v in mem.items()}}
+
+@app.get("/readyz")
+def readyz():
+    # Readiness: 200 only after index + model are loaded and warmed up
+    st = startup.state
+    if not st.ready:
+        return JSONResponse(status_code=503, content={"ready": False, "error": st.error,
+                                                      "phases": st.phases})
+    return {"ready": True, "totalSec": st.report()["totalSec"]}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    # Prometheus text format; gauges are read from live stats only when scraped
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def _service_gauges() -> List[str]:
+    lines = metrics.gauge_lines("rag_ready", "1 once index + model are loaded and warmed up",
+                                [({}, 1.0 if startup.state.ready else 0.0)])
+    pid = str(os.getpid())
+    lines += metrics.gauge_lines("rag_process_memory_bytes", "Memory of this worker process (rss/anon/file/pss/uss)",
+                                 [({"pid": pid, "kind": k}, v) for k, v in metrics.process_memory().items()])
+    adm = admission.stats()
+    lines += metrics.gauge_lines("rag_admission_queued", "Requests waiting for an inference worker",
+                                 [({}, adm["queued"])])
+    lines += metrics.gauge_lines("rag_admission_running", "Requests on an inference worker", [({}, adm["running"])])
+    lines += metrics.gauge_lines("rag_admission_events", "Admission events since start (counter semantics)",
+                                 [({"event": k}, adm[k]) for k in ("admitted", "rejected", "expired", "timedOut")])
+    sem = _semantic_cache.stats()
+    lines += metrics.gauge_lines("rag_semantic_cache_events", "Semantic cache lookups since start",
+                                 [({"result": "hit"}, sem["hits"]), ({"result": "miss"}, sem["misses"])])
+    lines += metrics.gauge_lines("rag_semantic_cache_entries", "Cached responses", [({}, sem["size"])])
+    llm = llm_gateway.stats()
+    lines += metrics.gauge_lines("rag_llm_inflight", "LLM gateway calls by state",
+                                 [({"state": "active"}, llm["active"]), ({"state": "waiting"}, llm["waiting"])])
+    if not startup.state.ready:
+        return lines  # 不在抓取时触发索引加载
+    retriever = _retriever()
+    store = retriever.get_index_store()
+    info = store.info()
+    lines += metrics.gauge_lines("rag_index_vectors", "Vectors in the loaded FAISS indexes",
+                                 [({"index": "chunk"}, info["chunks"]), ({"index": "drama"}, info["dramas"])])
+    lines += metrics.gauge_lines("rag_index_info", "Loaded index version (value is always 1)",
+                                 [({"version": info["version"] or "", "model": info["model"],
+                                    "backend": info["encoderBackend"]}, 1.0)])
+    lines += metrics.gauge_lines("rag_index_loaded_timestamp_seconds", "When the serving index was loaded",
+                                 [({}, info["loadedAt"])])
+    reload = retriever.reload_stats()
+    lines += metrics.gauge_lines("rag_index_reloads", "Hot reloads since start",
+                                 [({"result": "ok"}, reload["reloads"]), ({"result": "failed"}, reload["failures"])])
+    emb = store.embed_cache.stats()
+    lines += metrics.gauge_lines("rag_embed_cache_events", "Query embedding cache lookups since start",
+                                 [({"result": "hit"}, emb["hits"]), ({"result": "miss"}, emb["misses"])])
+    users = _user_store_report()
+    if users is not None:
+        lines += metrics.gauge_lines("rag_user_store_users", "Users with a taste vector in the loaded user store",
+                                     [({"version": users["version"]}, users["users"])])
+    return lines
+
+metrics.register_collector(_service_gauges)
+
+@app.post("/admin/reload")
+def admin_reload(force: bool = False, x_admin_token: Optional[str] = Header(default=None)):
+    # 在线程池中加载新版本并原子切换；加载失败时旧版本继续服务
+    if settings.admin_token and x_admin_token != settings.admin_token:
+        raise HTTPException(status_code=401, detail="invalid admin token")
     try:
-        _ = get_index_store()  # ensure index load OK
-        return {"ok": True, "indexDir": str(settings.ai_index_dir)}
+        return _retriever().reload_index_store(force=force)
     except Exception as e:
-        return {"ok": False, "error": str(e)}
+        raise HTTPException(status_code=500, detail=f"reload failed: {e}")
 
-@app.post("/rag/ask", response_model=AskResponse)
-def rag_ask(req: AskRequest):
+def _parse_query(req: AskRequest) -> Query:
     # Validate scene
     scene = (req.scene or "search").lower()
     if scene not in {"search", "recommend", "qa"}:
-        raise HTTPException(status_code=400, detail="scene must be one of: search, recommend, qa")
+        raise ValueError("scene must be one of: search, recommend, qa")
 
     topk = req.topK or settings.topk_default
     if topk <= 0 or topk > 50:
+        raise ValueError("topK must be in 1..50")
+
+    mode = (req.retrievalMode or settings.retrieval_mode(scene)).lower()
+    if mode not in {"vector", "sparse", "fused"}:
+        raise ValueError("retrievalMode must be one of: vector, sparse, fused")
+    return Query(question=req.question, scene=scene, topk=topk, mode=mode, drama_id=req.dramaId,
+                 ef_search=req.efSearch, nprobe=req.nprobe, user_id=req.userId)
+
+async def _admitted(fn, x_request_timeout_ms: Optional[int]):
+    # 推理在独立的有界线程池中执行；队列满时快速拒绝，调用方超时后丢弃仍在排队的请求
+    timeout_ms = x_request_timeout_ms or settings.request_timeout_ms
+    t = metrics.current()
+    try:
+        return await admission.run(fn, timeout_sec=timeout_ms / 1000.0 if timeout_ms > 0 else None)
+    except Overloaded as e:
+        t.outcome = "rejected"
+        raise HTTPException(status_code=settings.overload_status, detail=str(e),
+                            headers={"Retry-After": str(e.retry_after)})
+    except DeadlineExceeded as e:
+        t.outcome = "timeout"
+        raise HTTPException(status_code=504, detail=f"request deadline exceeded: {e}")
+    except ShardsUnavailable as e:
+        t.outcome = "unavailable"
+        raise HTTPException(status_code=503, detail=str(e))
+
+def _json(resp: BaseModel, t: metrics.Timing, x_timing: Optional[str]) -> Response:
+    # 自行序列化以便计时；请求头 X-Timing: 1 时附带分阶段耗时（Server-Timing，毫秒）
+    with metrics.stage("serialize"):
+        body = resp.model_dump_json()
+    headers = {"Server-Timing": t.server_timing()} if x_timing == "1" else {}
+    if t.outcome == "partial":
+        headers["X-Partial-Results"] = "1"  # 分片协调：至少一个分片超时 / 出错，结果不完整
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.post("/rag/ask", response_model=AskResponse)
+async def rag_ask(req: AskRequest, x_request_timeout_ms: Optional[int] = Header(default=None),
+                  x_timing: Optional[str] = Header(default=None)):
+    try:
+        q = _parse_query(req)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    with metrics.track("/rag/ask", q.scene) as t:
+        items, cached, cache_slot = await _admitted(lambda: _retrieve_cached(q), x_request_timeout_ms)
+        if cached is not None:
+            return _json(_from_cache(q, items, cached), t, x_timing)
+        # 检索在推理线程完成；LLM 调用在事件循环上等待网关，不占推理线程
+        with metrics.stage("answer"):
+            answer, fallback = await agenerate_answer(q.question, items, scene=q.scene, drama_id=q.drama_id)
+        resp = AskResponse(answer=answer, relatedDramas=_to_hits(items))
+        if not fallback:
+            _cache_store(cache_slot, items, resp)
+        return _json(resp, t, x_timing)
+
+def _retrieve_cached(q: Query):
+    """Runs on an inference worker: (items, cached AskResponse or None, (partition, vec, bound) to store under)."""
+    store = _retriever().get_index_store()
+    part = _cache_partition(q)
+    if part is None:
+        return retrieve_items(store, q), None, None
+    bound = _bind_cache(store)
+    vec = store.embed_query(q.question)
+    with metrics.stage("semantic_cache"):
+        cached = _semantic_cache.get(part, vec)
+    if cached is not None:
+        metrics.current().outcome = "cache_hit"
+        return cached[0], cached[1], None
+    # 向量已进入查询向量缓存，检索阶段不会重复编码
+    items = retrieve_items(store, q)
+    if metrics.current().outcome == "partial":
+        return items, None, None  # 缺分片的结果不缓存
+    return items, None, (part, vec, bound)
+
+@app.post("/rag/ask/stream")
+async def rag_ask_stream(req: AskRequest, x_request_timeout_ms: Optional[int] = Header(default=None)):
+    """
+    Server-sent events. `hits` ({"relatedDramas": [...]}) is sent as soon as retrieval finishes,
+    then one `token` ({"text": ...}) per answer piece, then `done` ({"answer": ...}) or `error`.
+    Retrieval goes through admission control like /rag/ask (503 / 504 before the stream opens);
+    a client disconnect cancels the stream and closes the upstream LLM request.
+    """
+    try:
+        q = _parse_query(req)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    with metrics.track("/rag/ask/stream", q.scene) as t:
+        items, cached, cache_slot = await _admitted(lambda: _retrieve_cached(q), x_request_timeout_ms)
+        hits = _to_hits(items)
+        partial = t.outcome == "partial"
+    # 模板答案引用问题原文需重新生成；缓存的 LLM 答案直接回放
+    cached_answer = cached.answer if cached is not None and llm_enabled() else None
+
+    gen = _answer_events(q, items, hits, cached_answer, cache_slot, partial)
+    # 断开时 sse-starlette 取消发送任务；background 再显式 aclose，确保上游 LLM 流被关闭
+    return EventSourceResponse(gen, ping=settings.sse_ping_sec or None, background=BackgroundTask(gen.aclose))
+
+async def _answer_events(q: Query, items: List[Dict], hits: List[DramaHit], cached_answer: Optional[str],
+                         cache_slot, partial: bool = False) -> AsyncIterator[Dict]:
+    payload: Dict = {"relatedDramas": [h.model_dump() for h in hits]}
+    if partial:
+        payload["partial"] = True
+    yield {"event": "hits", "data": json.dumps(payload)}
+    t0 = time.perf_counter()
+    outcome = "cancelled"  # 未走到 done / error 即为客户端断开
+    pieces: List[str] = []
+    source = stream_answer(q.question, items, scene=q.scene, drama_id=q.drama_id)
+    try:
+        if cached_answer is not None:
+            pieces.append(cached_answer)
+            yield {"event": "token", "data": json.dumps({"text": cached_answer})}
+        else:
+            try:
+                async for piece in source:
+                    if not pieces:
+                        metrics.STREAM_SECONDS.observe(time.perf_counter() - t0, q.scene, "first_token")
+                    pieces.append(piece)
+                    yield {"event": "token", "data": json.dumps({"text": piece})}
+            except Exception as e:
+                if pieces:
+                    outcome = "error"
+                    yield {"event": "error", "data": json.dumps({"detail": f"answer stream failed: {e}"})}
+                    return
+                # 首 token 之前 LLM 就失败：退回模板答案，前端仍然拿到完整回答（不写入语义缓存）
+                metrics.fallback("llm_stream")
+                cache_slot = None
+                for piece in iter_template_tokens(q.question, items):
+                    pieces.append(piece)
+                    yield {"event": "token", "data": json.dumps({"text": piece})}
+        answer = "".join(pieces)
+        outcome = "completed"
+        yield {"event": "done", "data": json.dumps({"answer": answer})}
+        _cache_store(cache_slot, items, AskResponse(answer=answer, relatedDramas=hits))
+    finally:
+        metrics.STREAMS.inc(q.scene, outcome)
+        metrics.STREAM_SECONDS.observe(time.perf_counter() - t0, q.scene, "total")
+        await source.aclose()
+
+@app.post("/rag/ask/batch", response_model=AskBatchResponse)
+async def rag_ask_batch(req: AskBatchRequest, x_request_timeout_ms: Optional[int] = Header(default=None),
+                        x_timing: Optional[str] = Header(default=None)):
+    # 一次 encode + 每个索引一次多行 FAISS 检索，逐行再做混合打分 / 剧内 QA
+    if len(req.items) > settings.batch_max_items:
+        raise HTTPException(status_code=400, detail=f"at most {settings.batch_max_items} items per batch")
+    queries = []
+    for i, item in enumerate(req.items):
+        try:
+            queries.append(_parse_query(item))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"items[{i}]: {e}")
+
+    def run():
+        store = _retriever().get_index_store()
+        parts = [_cache_partition(q) for q in queries]
+        cached: List[Optional[AskResponse]] = [None] * len(queries)
+        items: List[Optional[List[Dict]]] = [None] * len(queries)
+        vecs, bound = None, None
+        if any(p is not None for p in parts):
+            bound = _bind_cache(store)
+            vecs = store._embed([q.question for q in queries])
+            with metrics.stage("semantic_cache"):
+                hits = [_semantic_cache.get(p, v) if p is not None else None for p, v in zip(parts, vecs)]
+            for i, h in enumerate(hits):
+                if h is not None:
+                    items[i], cached[i] = h
+        todo = [i for i, c in enumerate(cached) if c is None]
+        for i, found in zip(todo, retrieve_items_batch(store, [queries[i] for i in todo])):
+            items[i] = found
+        partial = metrics.current().outcome == "partial"
+        slots = [(parts[i], vecs[i], bound) if parts[i] is not None and cached[i] is None and not partial else None
+                 for i in range(len(queries))]
+        return items, cached, slots
+
+    scenes = {q.scene for q in queries}
+    with metrics.track("/rag/ask/batch", scenes.pop() if len(scenes) == 1 else "mixed") as t:
+        items, cached, slots = await _admitted(run, x_request_timeout_ms)
+        todo = [i for i, c in enumerate(cached) if c is None]
+        # 未命中的行并发生成答案（LLM 网关统一限流）
+        with metrics.stage("answer"):
+            answers = await asyncio.gather(*[agenerate_answer(queries[i].question, items[i], scene=queries[i].scene,
+                                                              drama_id=queries[i].drama_id) for i in todo])
+        out = [_from_cache(q, it, c) if c is not None else None for q, it, c in zip(queries, items, cached)]
+        for i, (answer, fallback) in zip(todo, answers):
+            out[i] = AskResponse(answer=answer, relatedDramas=_to_hits(items[i]))
+            if not fallback:
+                _cache_store(slots[i], items[i], out[i])
+        return _json(AskBatchResponse(results=out), t, x_timing)
+
+@app.get("/rag/similar/{drama_id}", response_model=SimilarResponse)
+def rag_similar(drama_id: int, topK: int = 10, x_timing: Optional[str] = Header(default=None)):
+    """
+    "More like this": neighbors of a drama from the graph precomputed by build_index.py (--knn-k).
+    A row lookup on mmap'd arrays, so it runs inline instead of on the inference executor.
+    """
+    if topK <= 0 or topK > 50:
         raise HTTPException(status_code=400, detail="topK must be in 1..50")
+    if not startup.state.ready:
+        raise HTTPException(status_code=503, detail="index not loaded yet")
+    with metrics.track("/rag/similar", "similar") as t:
+        store = _retriever().get_index_store()
+        if store.knn is None:
+            t.outcome = "unavailable"
+            raise HTTPException(status_code=404, detail="similar-drama graph not built for this index "
+                                                        "(build_index.py --knn-k; not available on a shard coordinator)")
+        with metrics.stage("search"):
+            items = store.similar(drama_id, topK)
+        if items is None:
+            t.outcome = "not_found"
+            raise HTTPException(status_code=404, detail=f"dramaId {drama_id} not in index")
+        return _json(SimilarResponse(dramaId=drama_id, relatedDramas=_to_hits(items)), t, x_timing)
 
-    store = get_index_store()
-
-    if scene == "qa" and req.dramaId:
-        # 段落级检索 + 限定当前剧
-        hits = store.search(req.question, topk=max(topk * 3, topk))
-        hits = store.filter_hits_by_drama(hits, req.dramaId)
-        if not hits:
-            hits = store.search(req.question, topk=max(topk * 2, topk))
-        items = store.hits_to_drama(hits, dedup_by_drama=True, limit=topk)
-    else:
-        # search / recommend 使用剧目级混合检索（向量 + tags + category 加权）
-        items = get_index_store().drama_level_hybrid(
-            query=req.question,
-            vec_topk=max(topk * 5, 50),
-            final_topk=topk,
-            alpha=0.8,
-            min_tag_hits=1
-        )
+@app.get("/shard/info")
+def shard_info():
+    # 分片节点：协调节点启动时读取（模型 / 维度 / 分片号需一致）
+    if not startup.state.ready:
+        return JSONResponse(status_code=503, content={"ready": False, "error": startup.state.error})
+    store = _retriever().get_index_store()
+    return {**store.info(), "shard": store.manifest.get("shard"), "shards": store.manifest.get("shards")}
+
+@app.post("/shard/search")
+async def shard_search(req: ShardSearchRequest, x_request_timeout_ms: Optional[int] = Header(default=None)):
+    """
+    Shard node: search this shard with vectors the coordinator already embedded (no encode here).
+    Returns per-row "dense" and per-query "sparse" hits with the metadata needed for merging.
+    """
+    if req.target not in {"chunk", "drama"}:
+        raise HTTPException(status_code=400, detail="target must be chunk or drama")
+    if req.vectors and not req.dim:
+        raise HTTPException(status_code=400, detail="dim is required with vectors")
+    vecs = decode_vectors(req.vectors, req.dim) if req.vectors else None
+    if req.dramaId is not None and vecs is None:
+        raise HTTPException(status_code=400, detail="dramaId needs a query vector")
+
+    def run():
+        store = _retriever().get_index_store()
+        return search_local(store, req.target, vecs, req.queries, req.topK, req.efSearch, req.nprobe, req.dramaId)
+
+    with metrics.track("/shard/search", req.target):
+        out = await _admitted(run, x_request_timeout_ms)
+        # 直接 json.dumps：几百条命中走 jsonable_encoder 要多花数毫秒
+        with metrics.stage("serialize"):
+            body = json.dumps(out, ensure_ascii=False)
+        return Response(content=body, media_type="application/json")
+
+def _cache_partition(q: Query) -> Optional[Hashable]:
+    # 带 efSearch / nprobe 覆盖的调参请求不走语义缓存；dramaId 只影响 QA
+    if not _semantic_cache.enabled or q.ef_search or q.nprobe:
+        return None
+    user = None
+    if q.personalized:
+        # 个性化结果按用户隔离；用户向量库更新后旧条目不再命中，由 LRU / TTL 淘汰
+        users = get_user_store()
+        user = (q.user_id, users.version if users is not None else None)
+    return q.scene, q.topk, q.drama_id if q.scene == "qa" else None, q.mode, user
+
+def _bind_cache(store) -> Hashable:
+    # 索引版本或编码器变化（热加载）时整体失效
+    bound = (store.version, store.index_dir, store.model.key)
+    _semantic_cache.bind(bound)
+    return bound
+
+def _cache_store(slot, items: List[Dict], resp: AskResponse) -> None:
+    if slot is not None:
+        part, vec, bound = slot
+        _semantic_cache.put(part, vec, (items, resp), bound)
 
-    #  Build answer (template / LLM)
-    answer = generate_answer(req.question, items, scene=scene, drama_id=req.dramaId)
+def _from_cache(q: Query, items: List[Dict], resp: AskResponse) -> AskResponse:
+    if not llm_enabled():
+        # 模板答案会引用问题原文，重新生成（几乎无开销）；LLM 答案直接复用，省掉一次调用
+        # （LLM 失败时退回的模板答案不会写入缓存）
+        return AskResponse(answer=build_template_answer(q.question, items), relatedDramas=resp.relatedDramas)
+    return resp
 
-    # Map to response
-    resp_items = [
+def _to_hits(items: List[Dict]) -> List[DramaHit]:
+    return [
         DramaHit(
             dramaId=int(it["dramaId"]),
             title=it.get("title") or "",
@@ -83,4 +454,3 @@ def rag_ask(req: AskRequest):
         )
         for it in items
     ]
-    return AskResponse(answer=answer, relatedDramas=resp_items)
\ No newline at end of file
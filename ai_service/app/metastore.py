@@ -0,0 +1,541 @@
+"""
+Compact columnar metadata for the chunk / drama indexes.
+
+Layout (all inside the index directory):
+- strings.json                  shared string table (titles, categories, tags)
+- strings.bin / strings_offsets.npy   same table as an mmap-able blob (INDEX_MMAP=1 reads this)
+- chunk_drama_ids.npy           int64 dramaId per chunk
+- chunk_ids.npy                 int32 chunk ordinal within its drama
+- chunk_title_idx.npy           int32 -> strings
+- chunk_category_idx.npy        int32 -> strings
+- chunk_text.bin                utf-8 blob of all chunk texts
+- chunk_text_offsets.npy        int64, n+1 byte offsets into chunk_text.bin
+- drama_ids.npy                 int64 dramaId per drama vector
+- drama_title_idx.npy           int32 -> strings
+- drama_category_idx.npy        int32 -> strings
+- drama_tag_offsets.npy         int64, n+1 offsets into drama_tag_idx.npy
+- drama_tag_idx.npy             int32 -> strings
+- chunk_vector_ids.npy          int64 FAISS id per chunk (dramaId * CHUNK_ID_STRIDE + chunk ordinal)
+- drama_text.bin / drama_text_offsets.npy   drama-level text (title + description)
+- meta.json                     format marker ({"format": 2, "idMapped": true})
+
+Since format 2 the FAISS indexes are ID-mapped with stable ids (dramaId for drama.faiss,
+chunk vector id for faiss.index) and rows are sorted by id, so search results are mapped
+back to rows with a binary search. Older directories are positional (id == row).
+
+Numeric columns are memory-mapped and chunk texts are sliced lazily, so only the
+rows that are actually hit get decoded. With `shared=True` the string table is read from the
+blob as well and dramaId -> chunk rows comes from the sorted chunk_drama_ids column, so nothing
+per-row is copied into process memory and uvicorn workers share the pages via the page cache.
+"""
+
+import json
+import mmap
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+STRINGS_FILE = "strings.json"
+STRINGS_TABLE = "strings"  # strings.bin + strings_offsets.npy
+CHUNK_TEXT_FILE = "chunk_text.bin"
+DRAMA_TEXT_FILE = "drama_text.bin"
+FORMAT_FILE = "meta.json"
+META_FORMAT = 2
+# 单部剧最多的段落数；段落向量 id = dramaId * CHUNK_ID_STRIDE + 段落序号
+CHUNK_ID_STRIDE = 1000
+CHUNK_COLUMNS = ["chunk_drama_ids", "chunk_ids", "chunk_title_idx", "chunk_category_idx", "chunk_text_offsets"]
+DRAMA_COLUMNS = ["drama_ids", "drama_title_idx", "drama_category_idx", "drama_tag_offsets", "drama_tag_idx"]
+
+
+def chunk_vector_id(drama_id: int, chunk_id: int) -> int:
+    return int(drama_id) * CHUNK_ID_STRIDE + int(chunk_id)
+
+
+def rows_for_ids(sorted_ids: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    """Map FAISS ids to table rows via binary search over the sorted id column; -1 if absent."""
+    ids = np.asarray(ids, dtype="int64")
+    if len(sorted_ids) == 0:
+        return np.full(ids.shape, -1, dtype="int64")
+    pos = np.searchsorted(sorted_ids, ids)
+    pos = np.minimum(pos, len(sorted_ids) - 1)
+    ok = (ids >= 0) & (np.asarray(sorted_ids[pos]) == ids)
+    return np.where(ok, pos, -1)
+
+
+def has_columnar_meta(index_dir: Path) -> bool:
+    names = [STRINGS_FILE, CHUNK_TEXT_FILE] + [f"{c}.npy" for c in CHUNK_COLUMNS + DRAMA_COLUMNS]
+    return all((index_dir / n).exists() for n in names)
+
+
+# -----------------------------
+# Shared read-only string table
+# -----------------------------
+
+def write_string_table(out_dir: Path, name: str, strings: List[str]) -> None:
+    """<name>.bin (utf-8 blob) + <name>_offsets.npy (int64, n+1)."""
+    offsets = np.zeros(len(strings) + 1, dtype="int64")
+    with (out_dir / f"{name}.bin").open("wb") as f:
+        pos = 0
+        for i, s in enumerate(strings):
+            b = s.encode("utf-8")
+            f.write(b)
+            pos += len(b)
+            offsets[i + 1] = pos
+    np.save(out_dir / f"{name}_offsets.npy", offsets)
+
+
+def has_string_table(index_dir: Path, name: str) -> bool:
+    return (index_dir / f"{name}.bin").exists() and (index_dir / f"{name}_offsets.npy").exists()
+
+
+class StringTable:
+    """
+    Read-only list of strings over an mmap'd blob; decoded on access, never materialized.
+    get() is a binary search and only valid for tables written in sorted order (BM25 vocab).
+    """
+    def __init__(self, index_dir: Path, name: str):
+        self._offsets = np.load(index_dir / f"{name}_offsets.npy", mmap_mode="r")
+        self._blob = _map_file(index_dir / f"{name}.bin")
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        return self._blob[start:end].decode("utf-8") if self._blob is not None and end > start else ""
+
+    def get(self, s: str, default: Optional[int] = None) -> Optional[int]:
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self[mid] < s:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < len(self) and self[lo] == s else default
+
+
+class DramaRanges:
+    """dramaId -> [start, end) chunk rows, by binary search over the sorted (id-mapped) chunk_drama_ids."""
+    def __init__(self, chunk_drama_ids: np.ndarray):
+        self._ids = chunk_drama_ids
+
+    def get(self, drama_id: int, default=None) -> Optional[Tuple[int, int]]:
+        start = int(np.searchsorted(self._ids, drama_id, side="left"))
+        if start >= len(self._ids) or int(self._ids[start]) != drama_id:
+            return default
+        return start, int(np.searchsorted(self._ids, drama_id, side="right"))
+
+    def __contains__(self, drama_id) -> bool:
+        return self.get(int(drama_id)) is not None
+
+
+# -----------------------------
+# Writer (used by scripts/build_index.py)
+# -----------------------------
+
+class MetaWriter:
+    """
+    Append-only writer; chunk texts are streamed to the blob as they are added,
+    so callers can feed rows batch by batch.
+    """
+    def __init__(self, out_dir: Path):
+        self.out_dir = out_dir
+        self._strings: List[str] = []
+        self._string_ids: Dict[str, int] = {}
+        self._cols: Dict[str, List[np.ndarray]] = {c: [] for c in CHUNK_COLUMNS + DRAMA_COLUMNS}
+        self._cols["chunk_vector_ids"] = []
+        self._cols["drama_text_offsets"] = []
+        self._blob = (out_dir / CHUNK_TEXT_FILE).open("wb")
+        self._blob_pos = 0
+        self._drama_blob = (out_dir / DRAMA_TEXT_FILE).open("wb")
+        self._drama_blob_pos = 0
+        self._tag_pos = 0
+        self._cols["chunk_text_offsets"].append(np.zeros(1, dtype="int64"))
+        self._cols["drama_tag_offsets"].append(np.zeros(1, dtype="int64"))
+        self._cols["drama_text_offsets"].append(np.zeros(1, dtype="int64"))
+
+    def intern(self, s: str) -> int:
+        s = s or ""
+        sid = self._string_ids.get(s)
+        if sid is None:
+            sid = len(self._strings)
+            self._strings.append(s)
+            self._string_ids[s] = sid
+        return sid
+
+    def add_chunks(self, drama_ids: Iterable[int], chunk_ids: Iterable[int], titles: Iterable[str],
+                   categories: Iterable[str], texts: Iterable[str]) -> None:
+        offsets = []
+        for t in texts:
+            b = (t or "").encode("utf-8")
+            self._blob.write(b)
+            self._blob_pos += len(b)
+            offsets.append(self._blob_pos)
+        dids = np.asarray([int(d) for d in drama_ids], dtype="int64")
+        cids = np.asarray(list(chunk_ids), dtype="int32")
+        self._cols["chunk_drama_ids"].append(dids)
+        self._cols["chunk_ids"].append(cids)
+        self._cols["chunk_vector_ids"].append(dids * CHUNK_ID_STRIDE + cids)
+        self._cols["chunk_title_idx"].append(np.asarray([self.intern(t) for t in titles], dtype="int32"))
+        self._cols["chunk_category_idx"].append(np.asarray([self.intern(c) for c in categories], dtype="int32"))
+        self._cols["chunk_text_offsets"].append(np.asarray(offsets, dtype="int64"))
+
+    def add_dramas(self, drama_ids: Iterable[int], titles: Iterable[str], categories: Iterable[str],
+                   tags_list: Iterable[List[str]], texts: Iterable[str]) -> None:
+        text_offsets = []
+        for t in texts:
+            b = (t or "").encode("utf-8")
+            self._drama_blob.write(b)
+            self._drama_blob_pos += len(b)
+            text_offsets.append(self._drama_blob_pos)
+        self._cols["drama_text_offsets"].append(np.asarray(text_offsets, dtype="int64"))
+        tag_idx: List[int] = []
+        offsets = []
+        for tags in tags_list:
+            tag_idx.extend(self.intern(t) for t in tags)
+            self._tag_pos += len(tags)
+            offsets.append(self._tag_pos)
+        self._cols["drama_ids"].append(np.asarray([int(d) for d in drama_ids], dtype="int64"))
+        self._cols["drama_title_idx"].append(np.asarray([self.intern(t) for t in titles], dtype="int32"))
+        self._cols["drama_category_idx"].append(np.asarray([self.intern(c) for c in categories], dtype="int32"))
+        self._cols["drama_tag_offsets"].append(np.asarray(offsets, dtype="int64"))
+        self._cols["drama_tag_idx"].append(np.asarray(tag_idx, dtype="int32"))
+
+    def close(self) -> None:
+        self._blob.close()
+        self._drama_blob.close()
+        with (self.out_dir / FORMAT_FILE).open("w", encoding="utf-8") as f:
+            json.dump({"format": META_FORMAT, "idMapped": True, "chunkIdStride": CHUNK_ID_STRIDE}, f)
+        for name, parts in self._cols.items():
+            dtype = parts[0].dtype if parts else np.dtype("int64")
+            arr = np.concatenate(parts).astype(dtype, copy=False) if parts else np.zeros(0, dtype=dtype)
+            np.save(self.out_dir / f"{name}.npy", arr)
+        with (self.out_dir / STRINGS_FILE).open("w", encoding="utf-8") as f:
+            json.dump(self._strings, f, ensure_ascii=False)
+        write_string_table(self.out_dir, STRINGS_TABLE, self._strings)
+
+
+# -----------------------------
+# Incremental splice (build_index.py --incremental)
+# -----------------------------
+
+def _merge_order(old_keys: np.ndarray, keep: np.ndarray, new_keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Row order of the table holding old rows `keep` plus the new rows, sorted by key.
+    Returns (order into concat(old[keep], new), old row -> new row (-1 = dropped), new rows of the added keys).
+    """
+    keys = np.concatenate([np.asarray(old_keys)[keep], np.asarray(new_keys, dtype="int64")])
+    order = np.argsort(keys, kind="stable")
+    pos = np.empty(len(keys), dtype="int64")
+    pos[order] = np.arange(len(keys), dtype="int64")
+    old_to_new = np.full(len(old_keys), -1, dtype="int64")
+    old_to_new[keep] = pos[:len(keep)]
+    return order, old_to_new, pos[len(keep):]
+
+
+def _splice_ragged(values: np.ndarray, offsets: np.ndarray, keep: np.ndarray, new_parts: List[np.ndarray],
+                   order: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    CSR column (values + n+1 offsets) of the merged table. Kept old rows are copied as runs of
+    consecutive rows, so the Python work is proportional to the number of inserted / removed rows.
+    """
+    offsets = np.asarray(offsets, dtype="int64")
+    old_lens = offsets[1:][keep] - offsets[:-1][keep]
+    lens = np.concatenate([old_lens, np.asarray([len(p) for p in new_parts], dtype="int64")])[order]
+    out_offsets = np.zeros(len(order) + 1, dtype="int64")
+    np.cumsum(lens, out=out_offsets[1:])
+    src_old = order < len(keep)
+    old_row = np.full(len(order), -1, dtype="int64")
+    old_row[src_old] = keep[order[src_old]]
+    # 一个 run = 一段连续的旧行；每个新行单独成段
+    start = np.ones(len(order), dtype=bool)
+    start[1:] = ~src_old[1:] | ~src_old[:-1] | (old_row[1:] != old_row[:-1] + 1)
+    bounds = np.append(np.flatnonzero(start), len(order))
+    pieces = []
+    for a, b in zip(bounds[:-1], bounds[1:]):
+        if src_old[a]:
+            pieces.append(np.asarray(values[offsets[old_row[a]]:offsets[old_row[b - 1] + 1]]))
+        else:
+            pieces.append(np.asarray(new_parts[order[a] - len(keep)]))
+    dtype = np.asarray(values[:0]).dtype
+    out = np.concatenate(pieces).astype(dtype, copy=False) if pieces else np.zeros(0, dtype=dtype)
+    return out, out_offsets
+
+
+def _read_blob(path: Path) -> np.ndarray:
+    return np.memmap(path, dtype="uint8", mode="r") if path.stat().st_size else np.zeros(0, dtype="uint8")
+
+
+def splice_tables(out_dir: Path, src_dir: Path, removed: np.ndarray, chunks: Dict[str, List],
+                  dramas: Dict[str, List]) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """
+    Columnar tables of `src_dir` minus the dramas in `removed`, plus the given rows, written to `out_dir`.
+    chunks: dramaId / chunk_id / title / category / text lists (sorted by chunk vector id);
+    dramas: id / title / category / tags / text lists (sorted by id).
+    Surviving rows are column slices of the old arrays, never decoded; the string table only grows
+    (strings of removed dramas stay until the next full build).
+    Returns {"chunk" | "drama": (old row -> new row, new rows of the added rows)} for the BM25 merge.
+    """
+    with (src_dir / STRINGS_FILE).open("r", encoding="utf-8") as f:
+        strings: List[str] = json.load(f)
+    n_old_strings = len(strings)
+    string_ids = {s: i for i, s in enumerate(strings)}
+
+    def intern(values: List[str]) -> np.ndarray:
+        out = []
+        for s in values:
+            s = s or ""
+            sid = string_ids.get(s)
+            if sid is None:
+                sid = string_ids[s] = len(strings)
+                strings.append(s)
+            out.append(sid)
+        return np.asarray(out, dtype="int32")
+
+    def col(name: str) -> np.ndarray:
+        return np.load(src_dir / f"{name}.npy", mmap_mode="r")
+
+    def save(name: str, arr: np.ndarray) -> None:
+        np.save(out_dir / f"{name}.npy", np.ascontiguousarray(arr))
+
+    def encode(texts: List[str]) -> List[np.ndarray]:
+        return [np.frombuffer((t or "").encode("utf-8"), dtype="uint8") for t in texts]
+
+    removed = np.asarray(removed, dtype="int64")
+    plans: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    # 段落表（按向量 id 有序）
+    old_dids = col("chunk_drama_ids")
+    keep = np.flatnonzero(~np.isin(old_dids, removed))
+    new_dids = np.asarray(chunks["dramaId"], dtype="int64")
+    new_cids = np.asarray(chunks["chunk_id"], dtype="int32")
+    order, old_to_new, new_rows = _merge_order(col("chunk_vector_ids"), keep,
+                                               new_dids * CHUNK_ID_STRIDE + new_cids)
+    dids = np.concatenate([np.asarray(old_dids)[keep], new_dids])[order]
+    cids = np.concatenate([np.asarray(col("chunk_ids"))[keep], new_cids])[order]
+    save("chunk_drama_ids", dids)
+    save("chunk_ids", cids)
+    save("chunk_vector_ids", dids * CHUNK_ID_STRIDE + cids)
+    save("chunk_title_idx", np.concatenate([np.asarray(col("chunk_title_idx"))[keep], intern(chunks["title"])])[order])
+    save("chunk_category_idx",
+         np.concatenate([np.asarray(col("chunk_category_idx"))[keep], intern(chunks["category"])])[order])
+    blob, offsets = _splice_ragged(_read_blob(src_dir / CHUNK_TEXT_FILE), col("chunk_text_offsets"), keep,
+                                   encode(chunks["text"]), order)
+    blob.tofile(out_dir / CHUNK_TEXT_FILE)
+    save("chunk_text_offsets", offsets)
+    plans["chunk"] = (old_to_new, new_rows)
+
+    # 剧目表（按 dramaId 有序）
+    old_ids = col("drama_ids")
+    keep = np.flatnonzero(~np.isin(old_ids, removed))
+    new_ids = np.asarray(dramas["id"], dtype="int64")
+    order, old_to_new, new_rows = _merge_order(old_ids, keep, new_ids)
+    save("drama_ids", np.concatenate([np.asarray(old_ids)[keep], new_ids])[order])
+    save("drama_title_idx", np.concatenate([np.asarray(col("drama_title_idx"))[keep], intern(dramas["title"])])[order])
+    save("drama_category_idx",
+         np.concatenate([np.asarray(col("drama_category_idx"))[keep], intern(dramas["category"])])[order])
+    tag_idx, tag_offsets = _splice_ragged(col("drama_tag_idx"), col("drama_tag_offsets"), keep,
+                                          [intern(tags) for tags in dramas["tags"]], order)
+    save("drama_tag_idx", tag_idx)
+    save("drama_tag_offsets", tag_offsets)
+    blob, offsets = _splice_ragged(_read_blob(src_dir / DRAMA_TEXT_FILE), col("drama_text_offsets"), keep,
+                                   encode(dramas["text"]), order)
+    blob.tofile(out_dir / DRAMA_TEXT_FILE)
+    save("drama_text_offsets", offsets)
+    plans["drama"] = (old_to_new, new_rows)
+
+    # 字符串表只追加：旧的 strings.bin 原样保留，新串接在后面
+    with (out_dir / STRINGS_FILE).open("w", encoding="utf-8") as f:
+        f.write(json.dumps(strings, ensure_ascii=False))
+    if has_string_table(src_dir, STRINGS_TABLE):
+        old_offsets = np.load(src_dir / f"{STRINGS_TABLE}_offsets.npy")
+        added = [s.encode("utf-8") for s in strings[n_old_strings:]]
+        with (out_dir / f"{STRINGS_TABLE}.bin").open("wb") as f:
+            f.write(bytes(_read_blob(src_dir / f"{STRINGS_TABLE}.bin")))
+            f.write(b"".join(added))
+        offsets = np.concatenate([old_offsets, old_offsets[-1] + np.cumsum([len(b) for b in added], dtype="int64")])
+        np.save(out_dir / f"{STRINGS_TABLE}_offsets.npy", offsets.astype("int64"))
+    else:
+        write_string_table(out_dir, STRINGS_TABLE, strings)
+    with (out_dir / FORMAT_FILE).open("w", encoding="utf-8") as f:
+        json.dump({"format": META_FORMAT, "idMapped": True, "chunkIdStride": CHUNK_ID_STRIDE}, f)
+    return plans
+
+
+# -----------------------------
+# Readers (used by app/retriever.py)
+# -----------------------------
+
+class ChunkTable:
+    """O(1) row accessor over the columnar chunk metadata."""
+    def __init__(self, index_dir: Path, strings: Sequence[str], id_mapped: bool = False):
+        self.strings = strings
+        self.id_mapped = id_mapped
+        self.vector_ids = np.load(index_dir / "chunk_vector_ids.npy", mmap_mode="r") if id_mapped else None
+        self.drama_ids = np.load(index_dir / "chunk_drama_ids.npy", mmap_mode="r")
+        self.chunk_ids = np.load(index_dir / "chunk_ids.npy", mmap_mode="r")
+        self._title_idx = np.load(index_dir / "chunk_title_idx.npy", mmap_mode="r")
+        self._category_idx = np.load(index_dir / "chunk_category_idx.npy", mmap_mode="r")
+        self._offsets = np.load(index_dir / "chunk_text_offsets.npy", mmap_mode="r")
+        self._blob = _map_file(index_dir / CHUNK_TEXT_FILE)
+
+    def __len__(self) -> int:
+        return int(self.drama_ids.shape[0])
+
+    def drama_id(self, i: int) -> int:
+        return int(self.drama_ids[i])
+
+    def title(self, i: int) -> str:
+        return self.strings[self._title_idx[i]]
+
+    def category(self, i: int) -> str:
+        return self.strings[self._category_idx[i]]
+
+    def text(self, i: int) -> str:
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        return bytes(self._blob[start:end]).decode("utf-8") if self._blob is not None else ""
+
+    def rows_for(self, ids: np.ndarray) -> np.ndarray:
+        return rows_for_ids(self.vector_ids, ids) if self.id_mapped else np.asarray(ids, dtype="int64")
+
+    def ids_for_rows(self, start: int, end: int) -> np.ndarray:
+        if self.id_mapped:
+            return np.asarray(self.vector_ids[start:end], dtype="int64")
+        return np.arange(start, end, dtype="int64")
+
+    def __getitem__(self, i: int) -> Dict:
+        return {
+            "dramaId": self.drama_id(i),
+            "title": self.title(i),
+            "category": self.category(i),
+            "chunk": self.text(i),
+            "chunk_id": int(self.chunk_ids[i]),
+        }
+
+
+class DramaTable:
+    """O(1) row accessor over the columnar drama-level metadata."""
+    def __init__(self, index_dir: Path, strings: Sequence[str], id_mapped: bool = False):
+        self.strings = strings
+        self.id_mapped = id_mapped
+        self.drama_ids = np.load(index_dir / "drama_ids.npy", mmap_mode="r")
+        self._text_offsets = None
+        self._text_blob = None
+        if (index_dir / "drama_text_offsets.npy").exists():
+            self._text_offsets = np.load(index_dir / "drama_text_offsets.npy", mmap_mode="r")
+            self._text_blob = _map_file(index_dir / DRAMA_TEXT_FILE)
+        self._title_idx = np.load(index_dir / "drama_title_idx.npy", mmap_mode="r")
+        self._category_idx = np.load(index_dir / "drama_category_idx.npy", mmap_mode="r")
+        self._tag_offsets = np.load(index_dir / "drama_tag_offsets.npy", mmap_mode="r")
+        self._tag_idx = np.load(index_dir / "drama_tag_idx.npy", mmap_mode="r")
+
+    def __len__(self) -> int:
+        return int(self.drama_ids.shape[0])
+
+    def drama_id(self, i: int) -> int:
+        return int(self.drama_ids[i])
+
+    def title(self, i: int) -> str:
+        return self.strings[self._title_idx[i]]
+
+    def category(self, i: int) -> str:
+        return self.strings[self._category_idx[i]]
+
+    def tags(self, i: int) -> List[str]:
+        start, end = int(self._tag_offsets[i]), int(self._tag_offsets[i + 1])
+        return [self.strings[j] for j in self._tag_idx[start:end]]
+
+    def text(self, i: int) -> str:
+        if self._text_offsets is None or self._text_blob is None:
+            return self.title(i)
+        start, end = int(self._text_offsets[i]), int(self._text_offsets[i + 1])
+        return bytes(self._text_blob[start:end]).decode("utf-8")
+
+    def rows_for(self, ids: np.ndarray) -> np.ndarray:
+        return rows_for_ids(self.drama_ids, ids) if self.id_mapped else np.asarray(ids, dtype="int64")
+
+    def __getitem__(self, i: int) -> Dict:
+        return {
+            "dramaId": self.drama_id(i),
+            "title": self.title(i),
+            "category": self.category(i),
+            "tags": self.tags(i),
+        }
+
+
+class RecordTable:
+    """
+    Same accessor interface over legacy JSONL records (metadata.jsonl / drama_meta.jsonl),
+    so indexes built before the columnar format keep working.
+    """
+    def __init__(self, path: Path):
+        self.records: List[Dict] = []
+        with path.open("r", encoding="utf-8") as f:
+            for line in f:
+                self.records.append(json.loads(line))
+        self.drama_ids = np.asarray(
+            [int(r["dramaId"]) if str(r.get("dramaId", "")).isdigit() else -1 for r in self.records],
+            dtype="int64",
+        )
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def drama_id(self, i: int) -> int:
+        return int(self.drama_ids[i])
+
+    def title(self, i: int) -> str:
+        return self.records[i].get("title", "") or ""
+
+    def category(self, i: int) -> str:
+        return self.records[i].get("category", "") or ""
+
+    def text(self, i: int) -> str:
+        return self.records[i].get("chunk", "") or ""
+
+    def tags(self, i: int) -> List[str]:
+        return self.records[i].get("tags", []) or []
+
+    def rows_for(self, ids: np.ndarray) -> np.ndarray:
+        return np.asarray(ids, dtype="int64")
+
+    def ids_for_rows(self, start: int, end: int) -> np.ndarray:
+        return np.arange(start, end, dtype="int64")
+
+    def __getitem__(self, i: int) -> Dict:
+        return self.records[i]
+
+
+def load_tables(index_dir: Path, shared: bool = False):
+    """
+    Returns (chunk_table, drama_table); prefers the columnar files, falls back to JSONL.
+    shared: read the string table from the mmap'd blob (if built) instead of parsing strings.json.
+    """
+    if has_columnar_meta(index_dir):
+        if shared and has_string_table(index_dir, STRINGS_TABLE):
+            strings = StringTable(index_dir, STRINGS_TABLE)
+        else:
+            with (index_dir / STRINGS_FILE).open("r", encoding="utf-8") as f:
+                strings = json.load(f)
+        fmt: Dict = {}
+        if (index_dir / FORMAT_FILE).exists():
+            with (index_dir / FORMAT_FILE).open("r", encoding="utf-8") as f:
+                fmt = json.load(f)
+        id_mapped = bool(fmt.get("idMapped", False))
+        return ChunkTable(index_dir, strings, id_mapped), DramaTable(index_dir, strings, id_mapped)
+    meta_path = index_dir / "metadata.jsonl"
+    drama_meta_path = index_dir / "drama_meta.jsonl"
+    if not meta_path.exists():
+        raise FileNotFoundError(f"Metadata file not found: {meta_path}")
+    if not drama_meta_path.exists():
+        raise FileNotFoundError("Drama-level index not found, please rebuild.")
+    return RecordTable(meta_path), RecordTable(drama_meta_path)
+
+
+def _map_file(path: Path) -> Optional[mmap.mmap]:
+    if path.stat().st_size == 0:
+        return None
+    with path.open("rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
@@ -0,0 +1,249 @@
+"""
+Per-stage latency instrumentation and Prometheus text exposition (no client library needed).
+- track(route, scene) opens a per-request Timing in a ContextVar; stage(name) blocks anywhere
+  below it (retriever, hybrid scoring, answer generation) add their duration to it. At the end of
+  the request every stage is observed once into rag_stage_duration_seconds{route,scene,stage}.
+- Outside a tracked request stage() is a no-op, so build scripts / batcher threads pay nothing.
+- Hot path cost is a ContextVar lookup + a few counter increments under a lock; text is only
+  rendered when /metrics is scraped. Collectors add gauges read from live stats at scrape time.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+# 秒；覆盖亚毫秒级的向量检索到秒级的 LLM 调用
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(v: float) -> str:
+    # {:g} 只保留 6 位有效数字，时间戳 / 大计数会失真
+    v = float(v)
+    return str(int(v)) if v.is_integer() else repr(v)
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    def __init__(self, name: str, help_: str, labels: Sequence[str] = ()):
+        self.name, self.help, self.labels = name, help_, tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, n: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + n
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        out += [f"{self.name}{_fmt_labels(self.labels, k)} {_num(v)}" for k, v in items]
+        return out
+
+
+class Histogram:
+    def __init__(self, name: str, help_: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help_, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values: Dict[Tuple[str, ...], List[float]] = {}  # [bucket counts..., +Inf, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        with self._lock:
+            row = self._values.get(labels)
+            if row is None:
+                row = self._values[labels] = [0.0] * (len(self.buckets) + 2)
+            row[bisect_left(self.buckets, value)] += 1  # 越界即 +Inf 桶
+            row[-1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for k, row in items:
+            cum = 0.0
+            for b, c in zip(self.buckets + (float("inf"),), row[:-1]):
+                cum += c
+                le = 'le="+Inf"' if b == float("inf") else 'le="%g"' % b
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labels, k, le)} {_num(cum)}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labels, k)} {row[-1]:.6f}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labels, k)} {_num(cum)}")
+        return out
+
+
+REQUEST_SECONDS = Histogram("rag_request_duration_seconds", "End-to-end request latency", ("route", "scene"))
+STAGE_SECONDS = Histogram("rag_stage_duration_seconds", "Time spent per pipeline stage within a request",
+                          ("route", "scene", "stage"))
+REQUESTS = Counter("rag_requests_total", "Requests by outcome", ("route", "scene", "outcome"))
+FALLBACKS = Counter("rag_fallbacks_total", "Fallback paths taken", ("kind",))
+# SSE：首 token 与整条流的耗时（从 hits 事件发出起算），以及流的结束方式
+STREAM_SECONDS = Histogram("rag_stream_duration_seconds", "Answer streaming time after the hits event",
+                           ("scene", "phase"))
+STREAMS = Counter("rag_streams_total", "Answer streams by how they ended", ("scene", "outcome"))
+
+# LLM 网关：上游调用耗时、结果与 token 用量（以上游返回的 usage 为准）
+LLM_SECONDS = Histogram("rag_llm_duration_seconds", "Upstream LLM call latency", ("kind", "phase"))
+LLM_CALLS = Counter("rag_llm_calls_total", "LLM gateway calls by outcome", ("kind", "outcome"))
+LLM_TOKENS = Counter("rag_llm_tokens_total", "Tokens reported by the LLM provider", ("type",))
+
+# 分片扇出（协调节点）：各分片的响应耗时（含超时后才返回的）与调用结果 ok / timeout / error
+SHARD_SECONDS = Histogram("rag_shard_duration_seconds", "Shard node search latency seen by the coordinator",
+                          ("shard",))
+SHARD_CALLS = Counter("rag_shard_calls_total", "Shard fan-out calls by outcome", ("shard", "outcome"))
+
+_metrics = [REQUEST_SECONDS, STAGE_SECONDS, REQUESTS, FALLBACKS, STREAM_SECONDS, STREAMS,
+            LLM_SECONDS, LLM_CALLS, LLM_TOKENS, SHARD_SECONDS, SHARD_CALLS]
+_collectors: List[Callable[[], List[str]]] = []
+
+
+def register_collector(fn: Callable[[], List[str]]) -> None:
+    """fn() returns exposition lines (with HELP/TYPE) computed at scrape time."""
+    _collectors.append(fn)
+
+
+def gauge_lines(name: str, help_: str, samples: Sequence[Tuple[Dict[str, str], float]]) -> List[str]:
+    out = [f"# HELP {name} {help_}", f"# TYPE {name} gauge"]
+    out += [f"{name}{_fmt_labels(list(lbl), list(lbl.values()))} {_num(v)}" for lbl, v in samples]
+    return out
+
+
+def render() -> str:
+    lines: List[str] = []
+    for m in _metrics:
+        lines += m.render()
+    for fn in _collectors:
+        try:
+            lines += fn()
+        except Exception as e:  # 单个 collector 出错不影响整体抓取
+            lines.append(f"# collector error: {_escape(e)}")
+    return "\n".join(lines) + "\n"
+
+
+# -----------------------------
+# Per-request stage timing
+# -----------------------------
+
+class Timing:
+    __slots__ = ("route", "scene", "stages", "t0", "outcome")
+
+    def __init__(self, route: str, scene: str):
+        self.route = route
+        self.scene = scene
+        self.stages: Dict[str, float] = {}
+        self.t0 = time.perf_counter()
+        self.outcome = "ok"
+
+    def add(self, stage_name: str, sec: float) -> None:
+        self.stages[stage_name] = self.stages.get(stage_name, 0.0) + sec
+
+    def server_timing(self) -> str:
+        """Server-Timing header value (milliseconds), e.g. `embed;dur=3.10, total;dur=5.02`."""
+        total = (time.perf_counter() - self.t0) * 1000.0
+        parts = [f"{k};dur={v * 1000.0:.2f}" for k, v in self.stages.items()]
+        return ", ".join(parts + [f"total;dur={total:.2f}"])
+
+
+_current: ContextVar[Optional[Timing]] = ContextVar("rag_timing", default=None)
+
+
+def current() -> Optional[Timing]:
+    return _current.get()
+
+
+@contextmanager
+def track(route: str, scene: str) -> Iterator[Timing]:
+    t = Timing(route, scene)
+    token = _current.set(t)
+    try:
+        yield t
+    except Exception:
+        if t.outcome == "ok":
+            t.outcome = "error"
+        raise
+    finally:
+        _current.reset(token)
+        REQUEST_SECONDS.observe(time.perf_counter() - t.t0, t.route, t.scene)
+        REQUESTS.inc(t.route, t.scene, t.outcome)
+        for name, sec in t.stages.items():
+            STAGE_SECONDS.observe(sec, t.route, t.scene, name)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    t = _current.get()
+    if t is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        t.add(name, time.perf_counter() - t0)
+
+
+def add_stage(name: str, sec: float) -> None:
+    t = _current.get()
+    if t is not None:
+        t.add(name, sec)
+
+
+def fallback(kind: str) -> None:
+    FALLBACKS.inc(kind)
+
+
+def process_memory(pid: Union[int, str] = "self") -> Dict[str, int]:
+    """
+    Bytes from /proc (Linux): rss / anon / file / shmem, plus pss and uss from smaps_rollup.
+    pss splits shared pages (mmap'd index files, page cache) across the processes mapping them,
+    so summing it over uvicorn workers gives their real combined footprint; {} elsewhere.
+    """
+    out: Dict[str, int] = {}
+    fields = {"VmRSS": "rss", "RssAnon": "anon", "RssFile": "file", "RssShmem": "shmem", "VmHWM": "peak_rss"}
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                key = line.split(":", 1)[0]
+                if key in fields:
+                    out[fields[key]] = int(line.split()[1]) * 1024
+        with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+            rollup = {line.split(":", 1)[0]: int(line.split()[1]) * 1024 for line in f if line.rstrip().endswith("kB")}
+        out["pss"] = rollup.get("Pss", 0)
+        out["uss"] = rollup.get("Private_Clean", 0) + rollup.get("Private_Dirty", 0)
+    except (OSError, ValueError, IndexError):
+        pass
+    return out
+
+
+def serve(port: int, host: str = "127.0.0.1") -> threading.Thread:
+    """Plain HTTP /metrics for processes without FastAPI (the MCP stdio server)."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):  # stdio 被 MCP 协议占用，不能打印访问日志
+            pass
+
+    server = ThreadingHTTPServer((host, port), _Handler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    return thread
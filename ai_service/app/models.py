@@ -6,6 +6,10 @@ class AskRequest(BaseModel):
     topK: Optional[int] = Field(default=None, ge=1, le=50)
     scene: str = Field(default="search", description="search | recommend | qa")
     dramaId: Optional[int] = Field(default=None, description="Used for QA context")
+    efSearch: Optional[int] = Field(default=None, ge=1, le=4096, description="HNSW efSearch override")
+    nprobe: Optional[int] = Field(default=None, ge=1, le=65536, description="IVF nprobe override")
+    retrievalMode: Optional[str] = Field(default=None, description="vector | sparse | fused (default: per-scene setting)")
+    userId: Optional[int] = Field(default=None, description="Personalizes scene=recommend (taste vector, watched excluded)")
 
 class DramaHit(BaseModel):
     dramaId: int
@@ -17,4 +21,25 @@ class DramaHit(BaseModel):
 
 class AskResponse(BaseModel):
     answer: str
-    relatedDramas: List[DramaHit]
\ No newline at end of file
+    relatedDramas: List[DramaHit]
+
+class SimilarResponse(BaseModel):
+    dramaId: int
+    relatedDramas: List[DramaHit]  # precomputed neighbors, best first
+
+class AskBatchRequest(BaseModel):
+    items: List[AskRequest] = Field(..., min_length=1, description="Questions answered together; scenes may be mixed")
+
+class AskBatchResponse(BaseModel):
+    results: List[AskResponse]  # same order as items
+
+class ShardSearchRequest(BaseModel):
+    """Coordinator -> shard node (see app/shards.py); vectors are base64 little-endian float32, rows x dim."""
+    target: str = Field(default="drama", description="chunk | drama")
+    topK: int = Field(..., ge=1, le=4096)
+    vectors: Optional[str] = None
+    dim: Optional[int] = None
+    queries: List[str] = Field(default_factory=list, description="BM25 queries (sparse / fused modes)")
+    efSearch: Optional[int] = Field(default=None, ge=1, le=4096)
+    nprobe: Optional[int] = Field(default=None, ge=1, le=65536)
+    dramaId: Optional[int] = Field(default=None, description="Score only this drama's chunks (QA)")
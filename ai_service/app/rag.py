@@ -0,0 +1,128 @@
+"""
+Scene routing for /rag/ask, shared by the single and batch endpoints and the MCP tools.
+- qa + dramaId: score chunks within that drama (falls back to the chunk index)
+- recommend + userId (known to the user store, app/userstore.py): one drama.faiss search with the
+  query vector blended with the user's taste vector, watched dramas excluded, then hybrid scoring
+- otherwise:    drama-level hybrid retrieval (vector / BM25 / fused + tags + category)
+The batch path embeds every question in one encode call and runs one multi-row FAISS search per
+index (per efSearch/nprobe override); the per-row logic then runs on those vectors and hits.
+"""
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from . import metrics
+from .config import settings
+from .userstore import UserTaste, blend, get_user_store
+
+Hits = List[Tuple[int, float]]
+
+
+@dataclass
+class Query:
+    question: str
+    scene: str  # search | recommend | qa
+    topk: int
+    mode: str  # vector | sparse | fused
+    drama_id: Optional[int] = None
+    ef_search: Optional[int] = None
+    nprobe: Optional[int] = None
+    user_id: Optional[int] = None
+
+    @property
+    def in_drama(self) -> bool:
+        return self.scene == "qa" and bool(self.drama_id)
+
+    @property
+    def personalized(self) -> bool:
+        # 用户兴趣向量只作用于向量召回；sparse 模式忽略 userId
+        return self.scene == "recommend" and self.user_id is not None and self.mode != "sparse"
+
+    @property
+    def vec_topk(self) -> int:
+        return max(self.topk * 5, 50)
+
+
+def retrieve_items(store, q: Query, qvec: Optional[np.ndarray] = None,
+                   vec_hits: Optional[Hits] = None) -> List[Dict]:
+    """Drama-level items for one query; `qvec` / `vec_hits` come from retrieve_items_batch."""
+    if q.in_drama:
+        # 段落级检索：只在当前剧的段落向量上打分
+        hits = store.search_in_drama(q.question, q.drama_id, topk=q.topk,
+                                     ef_search=q.ef_search, nprobe=q.nprobe, qvec=qvec)
+        if not hits:
+            metrics.fallback("qa_unconstrained")
+            hits = store.retrieve("chunk", q.question, topk=max(q.topk * 2, q.topk), mode=q.mode,
+                                  ef_search=q.ef_search, nprobe=q.nprobe, vec_hits=vec_hits)
+        return store.hits_to_drama(hits, dedup_by_drama=True, limit=q.topk)
+    mode = q.mode
+    taste = user_taste(store, q)
+    if taste is not None:
+        # 个性化推荐：查询向量与预计算的用户向量加权后只查一次 FAISS，已看过的剧在检索时排除
+        qv = qvec[0] if qvec is not None else store.embed_query(q.question)
+        vec_hits = store.search_excluding("drama", blend(qv, taste, settings.user_taste_weight),
+                                          max(q.vec_topk, q.topk * 3), taste.watched, q.ef_search, q.nprobe)
+        mode = "vector"
+    # search / recommend 使用剧目级混合检索（向量 + tags + category 加权）
+    return store.drama_level_hybrid(
+        query=q.question,
+        vec_topk=q.vec_topk,
+        final_topk=q.topk,
+        alpha=0.8,
+        min_tag_hits=1,
+        ef_search=q.ef_search,
+        nprobe=q.nprobe,
+        mode=mode,
+        vec_hits=vec_hits,
+    )
+
+
+def user_taste(store, q: Query) -> Optional[UserTaste]:
+    """Precomputed taste of q.user_id (None: not personalized, or no usable vector for this user)."""
+    if not q.personalized:
+        return None
+    with metrics.stage("user"):
+        users = get_user_store()
+        if users is None or users.model != store.model_name:
+            # 无用户向量库，或其来源索引的模型与当前服务不一致
+            metrics.fallback("user_store_unavailable")
+            return None
+        taste = users.lookup(q.user_id)
+    if taste is None:
+        metrics.fallback("user_unknown")
+    return taste
+
+
+def _vector_plan(store, q: Query) -> Optional[Tuple[str, int]]:
+    """(target index, k) of the FAISS search retrieve_items would run for `q`, or None."""
+    if q.personalized:
+        return None  # 查询向量要先与用户向量加权，逐行检索
+    if q.in_drama:
+        if int(q.drama_id) in store.drama_chunks:
+            return None  # 剧内打分直接用查询向量，不查 FAISS
+        target, k = "chunk", max(q.topk * 2, q.topk)
+    else:
+        target, k = "drama", max(q.vec_topk, q.topk * 3)
+    if q.mode == "sparse" and store.bm25.get(target) is not None:
+        return None
+    return target, k
+
+
+def retrieve_items_batch(store, queries: List[Query]) -> List[List[Dict]]:
+    if not queries:
+        return []
+    vecs = store._embed([q.question for q in queries])
+    plans = [_vector_plan(store, q) for q in queries]
+    groups: Dict[Tuple[str, Optional[int], Optional[int]], List[int]] = {}
+    for i, (q, plan) in enumerate(zip(queries, plans)):
+        if plan is not None:
+            groups.setdefault((plan[0], q.ef_search, q.nprobe), []).append(i)
+
+    vec_hits: List[Optional[Hits]] = [None] * len(queries)
+    for (target, ef_search, nprobe), rows in groups.items():
+        k = max(plans[i][1] for i in rows)
+        for i, hits in zip(rows, store.search_vectors(target, vecs[rows], k, ef_search, nprobe)):
+            vec_hits[i] = hits[:plans[i][1]]
+    return [retrieve_items(store, q, qvec=vecs[i:i + 1], vec_hits=vec_hits[i]) for i, q in enumerate(queries)]
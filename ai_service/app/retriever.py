@@ -1,13 +1,109 @@
 import json
+import logging
 import re
+import threading
+import time
+from collections import OrderedDict
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 
 import faiss  # type: ignore
 import numpy as np
-from sentence_transformers import SentenceTransformer
-
+from . import metrics
+from .batching import MicroBatcher
 from .config import settings
+from .encoder_service import RemoteEncoder
+from .encoders import Encoder, load_encoder
+from .hybrid import HybridScorer
+from .knn import KnnGraph
+from .metastore import DramaRanges, load_tables
+from .sparse import BM25Index, fuse
+from .versions import read_manifest, resolve_index_dir, verify_manifest
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """
+    Thread-safe LRU cache: normalized query text -> float32 embedding.
+    Bounded by entry count with an optional TTL; flushed whenever the bound model changes.
+    """
+    def __init__(self, max_size: int, ttl_sec: float = 0.0):
+        self.max_size = max_size
+        self.ttl_sec = ttl_sec
+        self.model_name: Optional[str] = None
+        self._data: "OrderedDict[str, Tuple[float, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        # bge 系列 tokenizer 本身是小写化的，这里统一大小写/空白不会改变向量语义
+        return re.sub(r"\s+", " ", text or "").strip().lower()
+
+    def bind_model(self, model_name: str) -> None:
+        """Invalidate all entries if the embedding model differs from the cached one."""
+        with self._lock:
+            if self.model_name != model_name:
+                self._data.clear()
+                self.model_name = model_name
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            ts, vec = entry
+            if self.ttl_sec > 0 and time.monotonic() - ts > self.ttl_sec:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return vec
+
+    def put(self, key: str, vec: np.ndarray) -> None:
+        vec = np.array(vec, dtype="float32", copy=True)
+        vec.setflags(write=False)
+        with self._lock:
+            self._data[key] = (time.monotonic(), vec)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "model": self.model_name,
+                "size": len(self._data),
+                "maxSize": self.max_size,
+                "ttlSec": self.ttl_sec,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hitRate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+# Process-wide so the cache survives IndexStore re-creation (invalidated via bind_model)
+_embed_cache = EmbeddingCache(settings.embed_cache_size, settings.embed_cache_ttl_sec)
 
 
 class IndexStore:
@@ -15,167 +111,553 @@ class IndexStore:
     Loads FAISS index and metadata produced by Step 1.
     Provides vector search and simple filtering helpers.
     """
-    def __init__(self, index_dir: Path, model_name: str):
+    def __init__(self, index_dir: Path, model_name: str, model: Optional[Encoder] = None,
+                 verify: bool = False):
         self.index_dir = index_dir
         self.index_path = index_dir / "faiss.index"
-        self.meta_path = index_dir / "metadata.jsonl"
         self.model_name = model_name
+        self.manifest = read_manifest(index_dir) or {}
+        self.version: Optional[str] = self.manifest.get("buildId")
+        self.loaded_at = time.time()
+        # 各加载阶段耗时（秒），启动日志与 /healthz 使用
+        self.load_phases: Dict[str, float] = {}
+        t_phase = time.perf_counter()
+
+        def lap(phase: str) -> None:
+            nonlocal t_phase
+            now = time.perf_counter()
+            self.load_phases[phase] = round(now - t_phase, 3)
+            t_phase = now
 
         if not self.index_path.exists():
             raise FileNotFoundError(f"FAISS index not found: {self.index_path}")
-        if not self.meta_path.exists():
-            raise FileNotFoundError(f"Metadata file not found: {self.meta_path}")
-
-        self.index = faiss.read_index(str(self.index_path))
-        self.metadata: List[Dict] = []
-        with self.meta_path.open("r", encoding="utf-8") as f:
-            for line in f:
-                self.metadata.append(json.loads(line))
-
         self.drama_index_path = self.index_dir / "drama.faiss"
-        self.drama_meta_path = self.index_dir / "drama_meta.jsonl"
-        if not self.drama_index_path.exists() or not self.drama_meta_path.exists():
+        if not self.drama_index_path.exists():
             raise FileNotFoundError("Drama-level index not found, please rebuild.")
-        self.drama_index = faiss.read_index(str(self.drama_index_path))
-        self.drama_meta: List[Dict] = []
-        with self.drama_meta_path.open("r", encoding="utf-8") as f:
-            for line in f:
-                self.drama_meta.append(json.loads(line))
 
-        # Load embedding model
-        self.model = SentenceTransformer(self.model_name)
+        if verify:
+            verify_manifest(index_dir, self.manifest)
+            lap("verify")
+        # INDEX_MMAP：向量码本 mmap 只读映射，多个 worker 共享页缓存（IVF 倒排表仍按进程加载）
+        io_flags = faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY if settings.index_mmap else 0
+        self.index = faiss.read_index(str(self.index_path), io_flags)
+        self.drama_index = faiss.read_index(str(self.drama_index_path), io_flags)
+        if self.manifest.get("dim") and int(self.manifest["dim"]) != self.index.d:
+            raise ValueError(f"Manifest dim {self.manifest['dim']} != index dim {self.index.d}")
+        self._index_kinds = {t: _index_kind(self._index_for(t)) for t in ("chunk", "drama")}
+        lap("faiss")
 
-    def _embed(self, texts: List[str]) -> np.ndarray:
+        # 列式元数据（mmap，按行惰性读取）；旧索引回退到 JSONL
+        self.metadata, self.drama_meta = load_tables(index_dir, shared=settings.index_mmap)
+        # 相似剧图（可选，mmap）：GET /rag/similar 直接按行读取
+        self.knn = KnnGraph.load(index_dir)
+        lap("metadata")
+
+        # tag / category / 同义词在加载时预计算，drama_level_hybrid 只做向量化打分
+        self.hybrid = HybridScorer(self.drama_meta, settings.lexicon_path)
+        lap("hybrid")
+
+        # BM25 倒排（可选；缺失时 sparse/fused 模式退化为纯向量）
+        self.bm25 = {t: BM25Index.load(index_dir, t, shared=settings.index_mmap) for t in ("chunk", "drama")}
+
+        # dramaId -> [start, end) 段落元数据行区间，用于 QA 场景只在当前剧内打分；
+        # 共享模式下直接二分有序的 chunk_drama_ids 列，不建 dict
+        if settings.index_mmap and getattr(self.metadata, "id_mapped", False):
+            self.drama_chunks = DramaRanges(self.metadata.drama_ids)
+        else:
+            self.drama_chunks = self._load_drama_chunks(index_dir / "drama_chunks.json")
+        lap("bm25")
+
+        self._init_query_side(model)
+        lap("model")
+        logger.info(f"Index {self.version} loaded: "
+                    + ", ".join(f"{k}={v:.2f}s" for k, v in self.load_phases.items()))
+
+    def _init_query_side(self, model: Optional[Encoder]) -> None:
+        """Encoder, query embedding cache and micro-batcher (shared with the shard coordinator)."""
+        # Load embedding model (reused across hot reloads when the model name is unchanged);
+        # EMBEDDING_MODEL_DIR only applies to the configured model, never to a different manifest model
+        local_dir = settings.embedding_model_dir if self.model_name == settings.embedding_model_name else ""
+        if model is not None:
+            self.model = model
+        elif settings.encoder_socket:
+            # 多 worker：编码集中在一个进程（scripts/encoder_server.py），worker 不加载模型
+            self.model = RemoteEncoder(settings.encoder_socket)
+            if self.model.model_name != self.model_name:
+                raise ValueError(f"Encoder service serves {self.model.model_name}, index needs {self.model_name}")
+        else:
+            self.model = load_encoder(self.model_name, settings.encoder_backend, settings.encoder_onnx_file or None,
+                                      local_dir=local_dir or None)
+        built_with = self.manifest.get("encoderBackend")
+        if built_with and built_with != self.model.backend:
+            logger.warning(f"Index {self.version} was built with encoder backend '{built_with}', "
+                           f"serving with '{self.model.backend}'; vectors may drift")
+        self.embed_cache = _embed_cache
+        self.embed_cache.bind_model(self.model.key)
+
+        self.batcher: Optional[MicroBatcher] = None
+        if settings.embed_batch_enabled:
+            self.batcher = MicroBatcher(
+                self,
+                window_ms=settings.embed_batch_window_ms,
+                max_batch=settings.embed_batch_max_size,
+                queue_depth=settings.embed_batch_queue_depth,
+            )
+
+    def warmup(self, n: int) -> Dict:
+        """
+        Run `n` drama titles through encode (single + batched), both FAISS indexes and BM25,
+        so lazy kernel / allocator initialization is paid before the first real request.
+        Goes around the query cache and the micro-batcher on purpose.
+        """
+        t0 = time.perf_counter()
+        n_dramas = len(self.drama_meta)
+        texts = [self.drama_meta.title(i) or "warmup" for i in range(min(n, n_dramas))] or ["warmup"]
+        self._encode(texts[:1])
+        q = self._encode(texts)
+        for target in ("chunk", "drama"):
+            self._index_for(target).search(q, 10, params=self._search_params(target))
+            if self.bm25.get(target) is not None:
+                for t in texts:
+                    self.bm25[target].search(t, 10)
+        sec = round(time.perf_counter() - t0, 3)
+        self.load_phases["warmup"] = sec
+        return {"queries": len(texts), "sec": sec}
+
+    def info(self) -> Dict:
+        return {
+            "version": self.version,
+            "dir": str(self.index_dir),
+            "model": self.model_name,
+            "encoderBackend": self.model.backend,
+            "dim": int(self.index.d),
+            "chunks": int(self.index.ntotal),
+            "dramas": int(self.drama_index.ntotal),
+            "loadedAt": round(self.loaded_at, 3),
+            "loadPhases": self.load_phases,
+            "mmap": settings.index_mmap,
+            "encoderSocket": settings.encoder_socket or None,
+            "knnK": self.knn.k if self.knn is not None else None,
+        }
+
+    def close(self) -> None:
+        """Retire this store after a swap; requests still holding it keep working (batcher runs inline)."""
+        if self.batcher is not None:
+            self.batcher.close()
+
+    def _load_drama_chunks(self, path: Path) -> Dict[int, Tuple[int, int]]:
+        ranges: Dict[int, Tuple[int, int]] = {}
+        if path.exists():
+            with path.open("r", encoding="utf-8") as f:
+                for did, (start, end) in json.load(f).items():
+                    if str(did).isdigit():
+                        ranges[int(did)] = (int(start), int(end))
+            return ranges
+        # 兼容旧索引：从 metadata 推导（build_corpus 保证同一剧的段落连续）
+        ids = np.asarray(self.metadata.drama_ids)
+        if len(ids) == 0:
+            return ranges
+        bounds = np.flatnonzero(np.diff(ids)) + 1
+        starts = np.concatenate(([0], bounds))
+        ends = np.concatenate((bounds, [len(ids)]))
+        for start, end in zip(starts, ends):
+            if ids[start] >= 0:
+                ranges[int(ids[start])] = (int(start), int(end))
+        return ranges
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
         emb = self.model.encode(
             texts, show_progress_bar=False, convert_to_numpy=True, normalize_embeddings=True
         )
         return emb.astype("float32")
 
-    def search(self, query: str, topk: int) -> List[Tuple[int, float]]:
-        q = self._embed([query])
-        D, I = self.index.search(q, topk)
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        with metrics.stage("embed"):
+            return self._embed_cached(texts)
+
+    def _embed_cached(self, texts: List[str]) -> np.ndarray:
+        cache = self.embed_cache
+        if not cache.enabled:
+            return self._encode(texts)
+
+        keys = [cache.normalize(t) for t in texts]
+        vecs: Dict[str, np.ndarray] = {}
+        missing: List[str] = []
+        for k in dict.fromkeys(keys):  # 去重保序
+            v = cache.get(k)
+            if v is None:
+                missing.append(k)
+            else:
+                vecs[k] = v
+        if missing:
+            # 只对未命中的（去重后的）查询做一次前向
+            emb = self._encode(missing)
+            for k, v in zip(missing, emb):
+                cache.put(k, v)
+                vecs[k] = v
+        return np.stack([vecs[k] for k in keys]).astype("float32", copy=False)
+
+    def embed_query(self, query: str) -> np.ndarray:
+        """Query vector (dim,), encoded via the micro-batcher when enabled."""
+        if self.batcher is not None:
+            with metrics.stage("batcher"):
+                return self.batcher.embed(query)
+        return self._embed([query])[0]
+
+    def _index_for(self, target: str):
+        return self.drama_index if target == "drama" else self.index
+
+    def _table_for(self, target: str):
+        return self.drama_meta if target == "drama" else self.metadata
+
+    def _to_hits(self, target: str, D: np.ndarray, I: np.ndarray) -> List[Tuple[int, float]]:
+        """FAISS ids -> metadata rows (ID-mapped indexes use stable ids, see app/metastore.py)."""
+        rows = self._table_for(target).rows_for(I)
+        return [(int(r), float(s)) for r, s in zip(rows, D) if r >= 0]
+
+    def _search_params(self, target: str, ef_search: Optional[int] = None, nprobe: Optional[int] = None, sel=None):
+        """
+        Per-call FAISS search parameters: request override > Settings > value stored in the index.
+        Returns None when nothing needs overriding.
+        """
+        kind = self._index_kinds[target]
+        ef = ef_search or settings.faiss_ef_search
+        probe = nprobe or settings.faiss_nprobe
+        if kind == "hnsw" and ef:
+            params = faiss.SearchParametersHNSW(efSearch=int(ef))
+        elif kind == "ivf" and probe:
+            params = faiss.SearchParametersIVF(nprobe=int(probe))
+        elif sel is not None:
+            params = faiss.SearchParameters()
+        else:
+            return None
+        if sel is not None:
+            params.sel = sel
+        return params
+
+    def _search(self, target: str, query: str, topk: int,
+                ef_search: Optional[int] = None, nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        if self.batcher is not None:
+            # 编码 + 检索在微批线程中与并发请求共享完成，这里只能整体计时（含攒批窗口）
+            with metrics.stage("batcher"):
+                D, I = self.batcher.search(query, topk, target, knobs=(ef_search, nprobe))
+        else:
+            q = self._embed([query])
+            params = self._search_params(target, ef_search, nprobe)
+            with metrics.stage("search"):
+                D, I = self._index_for(target).search(q, topk, params=params)
+            D, I = D[0], I[0]
+        return self._to_hits(target, D, I)
+
+    def search_vectors(self, target: str, vecs: np.ndarray, topk: int,
+                       ef_search: Optional[int] = None, nprobe: Optional[int] = None) -> List[List[Tuple[int, float]]]:
+        """One multi-row FAISS search for already-embedded queries (batch endpoint); hits per row."""
+        params = self._search_params(target, ef_search, nprobe)
+        with metrics.stage("search"):
+            D, I = self._index_for(target).search(np.ascontiguousarray(vecs, dtype="float32"), topk, params=params)
+        return [self._to_hits(target, d, i) for d, i in zip(D, I)]
+
+    def search_excluding(self, target: str, vec: np.ndarray, topk: int, exclude: np.ndarray,
+                         ef_search: Optional[int] = None, nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        """One FAISS search for a single vector (dim,) that never returns the dramaIds in `exclude`."""
+        if len(exclude) == 0:
+            return self.search_vectors(target, vec[None, :], topk, ef_search, nprobe)[0]
+        inner = faiss.IDSelectorBatch(self._faiss_ids_for_dramas(target, exclude))
+        sel = faiss.IDSelectorNot(inner)
+        params = self._search_params(target, ef_search, nprobe, sel=sel)
+        with metrics.stage("search"):
+            D, I = self._index_for(target).search(np.ascontiguousarray(vec[None, :], dtype="float32"), topk,
+                                                  params=params)
+        return self._to_hits(target, D[0], I[0])
+
+    def _faiss_ids_for_dramas(self, target: str, drama_ids: np.ndarray) -> np.ndarray:
+        """dramaIds -> FAISS ids of `target`; only an ID-mapped drama.faiss is keyed by dramaId itself."""
+        table = self._table_for(target)
+        drama_ids = np.asarray(drama_ids, dtype="int64")
+        if target == "drama" and getattr(table, "id_mapped", False):
+            return drama_ids
+        # 旧版按位置编号的索引（或 chunk 索引）：先找出这些 dramaId 所在的行
+        rows = np.flatnonzero(np.isin(np.asarray(table.drama_ids), drama_ids))
+        if getattr(table, "id_mapped", False):
+            return np.asarray(table.vector_ids[rows], dtype="int64")
+        return rows.astype("int64")
+
+    def sparse_search(self, target: str, query: str, topk: int) -> List[Tuple[int, float]]:
+        bm25 = self.bm25.get(target)
+        if bm25 is None:
+            return []
+        with metrics.stage("sparse"):
+            return bm25.search(query, topk)
+
+    def retrieve(self, target: str, query: str, topk: int, mode: str = "vector",
+                 ef_search: Optional[int] = None, nprobe: Optional[int] = None,
+                 vec_hits: Optional[List[Tuple[int, float]]] = None) -> List[Tuple[int, float]]:
+        """
+        Candidate retrieval on the chunk or drama index.
+        mode: vector (FAISS) | sparse (BM25) | fused (rank fusion of both; see settings.fusion_method)
+        vec_hits: FAISS hits already computed by a batched search (skips the per-query search)
+        """
+        if mode not in ("sparse", "fused") or self.bm25.get(target) is None:
+            if mode in ("sparse", "fused"):
+                metrics.fallback("sparse_unavailable")
+            return vec_hits if vec_hits is not None else self._search(target, query, topk, ef_search, nprobe)
+        if mode == "sparse":
+            hits = self.sparse_search(target, query, topk)
+            top = hits[0][1] if hits and hits[0][1] > 0 else 1.0
+            return [(idx, score / top) for idx, score in hits]
+        if vec_hits is None:
+            vec_hits = self._search(target, query, topk, ef_search, nprobe)
+        sparse_hits = self.sparse_search(target, query, topk)
+        return fuse(vec_hits, sparse_hits, topk, method=settings.fusion_method,
+                    rrf_k=settings.rrf_k, vector_weight=settings.fusion_vector_weight)
+
+    def search(self, query: str, topk: int,
+               ef_search: Optional[int] = None, nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
         # returns list of (meta_index, score)
-        return [(int(i), float(s)) for i, s in zip(I[0], D[0])]
+        return self._search("chunk", query, topk, ef_search, nprobe)
 
     def hits_to_drama(self, hits: List[Tuple[int, float]], dedup_by_drama: bool = True, limit: Optional[int] = None):
         """
         Convert vector hits to drama-level results (deduplicate by dramaId, keep best score).
         """
-        by_drama: Dict[int, Dict] = {}
-        for idx, score in hits:
-            m = self.metadata[idx]
-            did = int(m["dramaId"]) if str(m["dramaId"]).isdigit() else m["dramaId"]
-            did = int(did)  # enforce int if possible
-            prev = by_drama.get(did)
-            if prev is None or score > prev["score"]:
-                by_drama[did] = {
-                    "dramaId": did,
-                    "title": m.get("title", ""),
-                    "category": m.get("category", ""),
-                    "snippet": m.get("chunk", "")[:400].replace("\n", " "),
-                    "score": score,
-                }
-
-        items = list(by_drama.values()) if dedup_by_drama else []
-        if not dedup_by_drama:
-            for idx, score in hits:
-                m = self.metadata[idx]
-                did = int(m["dramaId"]) if str(m["dramaId"]).isdigit() else m["dramaId"]
-                did = int(did)
-                items.append({
-                    "dramaId": did,
-                    "title": m.get("title", ""),
-                    "category": m.get("category", ""),
-                    "snippet": m.get("chunk", "")[:400].replace("\n", " "),
-                    "score": score,
-                })
-        items.sort(key=lambda x: x["score"], reverse=True)
-        if limit:
-            items = items[:limit]
-        return items
+        return drama_items(self.metadata, hits, dedup_by_drama, limit)
+
+    def search_in_drama(self, query: str, drama_id: int, topk: int,
+                        ef_search: Optional[int] = None, nprobe: Optional[int] = None,
+                        qvec: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """
+        Score only the chunks of one drama (exact inner product over its vector range).
+        Returns [] if the drama has no chunks in the index. `qvec` (1 x dim) skips the encode.
+        """
+        rng = self.drama_chunks.get(int(drama_id))
+        if rng is None:
+            return []
+        start, end = rng  # 元数据行区间
+        ids = self.metadata.ids_for_rows(start, end)
+        q = qvec if qvec is not None else self._embed([query])
+        with metrics.stage("search"):
+            try:
+                vecs = self.index.reconstruct_batch(ids)
+            except RuntimeError:
+                # 索引类型不支持 reconstruct 时，用 ID 选择器限定搜索范围
+                sel = faiss.IDSelectorBatch(ids)
+                params = self._search_params("chunk", ef_search, nprobe, sel=sel)
+                D, I = self.index.search(q, min(topk, end - start), params=params)
+                return self._to_hits("chunk", D[0], I[0])
+            scores = vecs @ q[0]
+            order = np.argsort(-scores)[:topk]
+        return [(start + int(i), float(scores[i])) for i in order]
 
     def filter_hits_by_drama(self, hits: List[Tuple[int, float]], drama_id: int) -> List[Tuple[int, float]]:
-        return [(idx, score) for idx, score in hits if int(self.metadata[idx].get("dramaId", -1)) == drama_id]
+        return [(idx, score) for idx, score in hits if self.metadata.drama_id(idx) == drama_id]
     
-    def search_drama_level(self, query: str, topk: int) -> List[Tuple[int, float]]:
-        q = self._embed([query])
-        D, I = self.drama_index.search(q, topk)
-        return [(int(i), float(s)) for i, s in zip(I[0], D[0])]
+    def search_drama_level(self, query: str, topk: int,
+                           ef_search: Optional[int] = None, nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        return self._search("drama", query, topk, ef_search, nprobe)
+
+    def similar(self, drama_id: int, topk: int) -> Optional[List[Dict]]:
+        """Precomputed nearest dramas of `drama_id` from the kNN graph; None if it is not in the index."""
+        row = int(self.drama_meta.rows_for(np.asarray([drama_id], dtype="int64"))[0])
+        if row < 0:
+            return None
+        nbrs = self.knn.neighbors(row, topk)
+        rows = self.drama_meta.rows_for(np.asarray([i for i, _ in nbrs], dtype="int64"))
+        return [{
+            "dramaId": did,
+            "title": self.drama_meta.title(int(r)),
+            "category": self.drama_meta.category(int(r)),
+            "snippet": ", ".join(self.drama_meta.tags(int(r)))[:160],
+            "score": score,
+        } for (did, score), r in zip(nbrs, rows) if r >= 0]
 
     def _tokenize(self, text: str) -> List[str]:
-        text = (text or "").lower()
-        text = re.sub(r"[^a-z0-9\-\+\s]", " ", text)
-        toks = [t for t in text.split() if len(t) > 1]
-        # 简单同义词归一（可扩展为读取 json 词典）
-        syn = {
-            "funny": ["comedy","humorous","humor"],
-            "time-travel": ["time","travel","timetravel","isekai"],
-            "time": ["time"],
-            "travel": ["travel"],
-        }
-        mapped: List[str] = []
-        for t in toks:
-            mapped.append(t)
-            for k, arr in syn.items():
-                if t in arr:
-                    mapped.append(k)
-        return list(dict.fromkeys(mapped))  # 去重保序
-
-    def _category_boost(self, query_tokens: List[str], category: str) -> float:
-        c = (category or "").lower()
-        bonus = 0.0
-        # 朴素匹配，可按你实际 category 值调整映射
-        if "comedy" in query_tokens and "comedy" in c: bonus += 0.12
-        if "romance" in query_tokens and "romance" in c: bonus += 0.10
-        if "mystery" in query_tokens and "mystery" in c: bonus += 0.10
-        if "urban" in query_tokens and "urban" in c: bonus += 0.08
-        if "costume" in query_tokens and "costume" in c: bonus += 0.08
-        if "youth" in query_tokens and "youth" in c: bonus += 0.06
-        return bonus
-
-    def drama_level_hybrid(self, query: str, vec_topk: int, final_topk: int, alpha: float=0.8, min_tag_hits: int=1) -> List[Dict]:
-        # 1) 向量召回（剧目级）
-        vec_hits = self.search_drama_level(query, topk=max(vec_topk, final_topk*3))
-        q_tokens = self._tokenize(query)
-
-        # 2) 混合打分：向量 + tags 命中 + category 加权
-        scored = []
-        for idx, vscore in vec_hits:
-            m = self.drama_meta[idx]
-            tags = [t.lower() for t in (m.get("tags", []) or [])]
-            tag_hits = sum(1 for t in q_tokens if t in tags)
-            if min_tag_hits > 0 and tag_hits < min_tag_hits:
+        return self.hybrid.tokenize(text)
+
+    def drama_level_hybrid(self, query: str, vec_topk: int, final_topk: int, alpha: float=0.8, min_tag_hits: int=1,
+                           ef_search: Optional[int] = None, nprobe: Optional[int] = None,
+                           mode: str = "vector", vec_hits: Optional[List[Tuple[int, float]]] = None) -> List[Dict]:
+        # 1) 召回（剧目级）：向量 / BM25 / 融合，分数均在 [0, 1] 量级
+        vec_hits = self.retrieve("drama", query, topk=max(vec_topk, final_topk*3), mode=mode,
+                                 ef_search=ef_search, nprobe=nprobe, vec_hits=vec_hits)
+        with metrics.stage("hybrid"):
+            return self._hybrid_items(query, vec_hits, final_topk, alpha, min_tag_hits)
+
+    def _hybrid_items(self, query: str, vec_hits: List[Tuple[int, float]], final_topk: int,
+                      alpha: float, min_tag_hits: int) -> List[Dict]:
+        return hybrid_items(self.hybrid, self.drama_meta, query, vec_hits, final_topk, alpha, min_tag_hits)
+
+def drama_items(table, hits: List[Tuple[int, float]], dedup_by_drama: bool = True,
+                limit: Optional[int] = None) -> List[Dict]:
+    """Chunk hits (rows of `table`) -> drama-level items; shared with the shard coordinator."""
+    by_drama: Dict[int, Dict] = {}
+    items: List[Dict] = []
+    for idx, score in hits:
+        did = table.drama_id(idx)
+        if dedup_by_drama:
+            prev = by_drama.get(did)
+            if prev is not None and score <= prev["score"]:
                 continue
-            tag_score = tag_hits / max(1, len(set(q_tokens)))
-            cat_bonus = self._category_boost(q_tokens, m.get("category","") or "")
-            hybrid = alpha * vscore + (1.0 - alpha) * tag_score + cat_bonus
-            scored.append((idx, hybrid, vscore, tag_hits, cat_bonus))
-
-        # 回退：若过滤太严，允许仅靠向量分返回
-        if len(scored) < final_topk:
-            scored = [(idx, vscore, vscore, 0, 0.0) for idx, vscore in vec_hits]
-
-        scored.sort(key=lambda x: x[1], reverse=True)
-        picked = scored[:final_topk]
-
-        items: List[Dict] = []
-        for idx, _, vscore, tag_hits, cat_bonus in picked:
-            m = self.drama_meta[idx]
-            items.append({
-                "dramaId": int(m["dramaId"]) if str(m["dramaId"]).isdigit() else m["dramaId"],
-                "title": m.get("title",""),
-                "category": m.get("category",""),
-                "snippet": ", ".join(m.get("tags",[]))[:160],
-                "score": float(vscore + cat_bonus),
-                "tagHits": int(tag_hits),
-            })
-        return items
-
-# Singleton-like loader
+        item = {
+            "dramaId": did,
+            "title": table.title(idx),
+            "category": table.category(idx),
+            "snippet": table.text(idx)[:400].replace("\n", " "),
+            "score": score,
+        }
+        if dedup_by_drama:
+            by_drama[did] = item
+        else:
+            items.append(item)
+
+    if dedup_by_drama:
+        items = list(by_drama.values())
+    items.sort(key=lambda x: x["score"], reverse=True)
+    if limit:
+        items = items[:limit]
+    return items
+
+def hybrid_items(scorer: HybridScorer, table, query: str, vec_hits: List[Tuple[int, float]], final_topk: int,
+                 alpha: float, min_tag_hits: int) -> List[Dict]:
+    """Drama hits (rows of `table`, scored by `scorer` built over it) -> final hybrid-ranked items."""
+    q_tokens = scorer.tokenize(query)
+    cand = np.fromiter((i for i, _ in vec_hits), dtype="int64", count=len(vec_hits))
+    vscores = np.fromiter((v for _, v in vec_hits), dtype="float64", count=len(vec_hits))
+
+    # 2) 混合打分：向量 + tags 命中 + category 加权（预计算矩阵上的向量化计算）
+    hybrid, tag_hits, cat_bonus = scorer.score(cand, vscores, q_tokens, alpha)
+    keep = tag_hits >= min_tag_hits if min_tag_hits > 0 else np.ones(len(cand), dtype=bool)
+
+    # 回退：若过滤太严，允许仅靠向量分返回
+    if int(keep.sum()) < final_topk:
+        metrics.fallback("tag_filter")
+        keep = np.ones(len(cand), dtype=bool)
+        hybrid = vscores
+        tag_hits = np.zeros(len(cand), dtype="int64")
+        cat_bonus = np.zeros(len(cand), dtype="float64")
+
+    pos = np.flatnonzero(keep)
+    picked = pos[np.argsort(-hybrid[pos], kind="stable")[:final_topk]]
+
+    items: List[Dict] = []
+    for p in picked:
+        idx = int(cand[p])
+        items.append({
+            "dramaId": table.drama_id(idx),
+            "title": table.title(idx),
+            "category": table.category(idx),
+            "snippet": ", ".join(table.tags(idx))[:160],
+            "score": float(vscores[p] + cat_bonus[p]),
+            "tagHits": int(tag_hits[p]),
+        })
+    return items
+
+def _index_kind(index) -> str:
+    """'hnsw' | 'ivf' | 'flat' — decides which search-time knobs apply."""
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    if hasattr(index, "hnsw"):
+        return "hnsw"
+    try:
+        faiss.extract_index_ivf(index)
+        return "ivf"
+    except RuntimeError:
+        return "flat"
+
+# Singleton-like loader; reload_index_store() swaps the reference, callers keep the store they got
 _index_store: Optional[IndexStore] = None
+_reload_lock = threading.Lock()
+_reload_stats: Dict = {"reloads": 0, "failures": 0, "last": None}
+
+def _load_store(model: Optional[Encoder] = None) -> IndexStore:
+    if settings.shard_urls:
+        # 协调节点：本地不加载索引，检索扇出到各分片节点（app/coordinator.py）
+        from .coordinator import ShardedStore
+        from .shards import shard_urls
+        return ShardedStore(shard_urls(), model=model)
+    index_dir, _ = resolve_index_dir(settings.ai_index_dir)
+    manifest = read_manifest(index_dir) or {}
+    name = manifest.get("model") or settings.embedding_model_name
+    return IndexStore(index_dir, name, model=model if model is not None and model.model_name == name else None,
+                      verify=settings.index_verify_checksum)
 
 def get_index_store() -> IndexStore:
     global _index_store
     if _index_store is None:
-        _index_store = IndexStore(settings.ai_index_dir, settings.embedding_model_name)
-    return _index_store
\ No newline at end of file
+        with _reload_lock:
+            if _index_store is None:
+                _index_store = _load_store()
+    return _index_store
+
+def reload_index_store(force: bool = False) -> Dict:
+    """
+    Load the active index version in the calling thread and swap it in atomically.
+    The old store is only retired, so in-flight requests finish on it; a failed load
+    keeps the old version serving.
+    """
+    global _index_store
+    with _reload_lock:
+        old = _index_store
+        index_dir, build_id = resolve_index_dir(settings.ai_index_dir)
+        if old is not None and not force and old.index_dir == index_dir and old.version == build_id:
+            return {"reloaded": False, "version": build_id}
+        t0 = time.perf_counter()
+        try:
+            new = _load_store(old.model if old else None)
+        except Exception as e:
+            _reload_stats["failures"] += 1
+            _reload_stats["last"] = {"ok": False, "error": str(e), "at": round(time.time(), 3)}
+            logger.warning(f"Index reload failed, keeping {old.version if old else None}: {e}")
+            raise
+        _index_store = new
+        duration = time.perf_counter() - t0
+        _reload_stats["reloads"] += 1
+        _reload_stats["last"] = {
+            "ok": True,
+            "from": old.version if old else None,
+            "to": new.version,
+            "durationSec": round(duration, 3),
+            "modelReused": old is not None and new.model is old.model,
+            "at": round(time.time(), 3),
+        }
+    if old is not None:
+        old.close()
+    logger.info(f"Index swapped to {new.version} ({new.index_dir}) in {duration:.2f}s")
+    return {"reloaded": True, **_reload_stats["last"]}
+
+def reload_stats() -> Dict:
+    return {"reloads": _reload_stats["reloads"], "failures": _reload_stats["failures"],
+            "last": _reload_stats["last"]}
+
+
+class IndexWatcher:
+    """Polls CURRENT / manifest.json and hot-reloads when the active build id changes."""
+    def __init__(self, interval_sec: float):
+        self.interval_sec = interval_sec
+        self._stop = threading.Event()
+        self._failed: Optional[Tuple[Path, Optional[str]]] = None
+        self._thread = threading.Thread(target=self._loop, name="index-watcher", daemon=True)
+
+    def start(self) -> "IndexWatcher":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval_sec):
+            store = _index_store
+            try:
+                index_dir, build_id = resolve_index_dir(settings.ai_index_dir)
+            except Exception as e:
+                # CURRENT 暂时不可读（如正在切换）：下一轮再解析，不记为失败版本
+                logger.warning(f"Index watcher could not resolve {settings.ai_index_dir}: {e}")
+                continue
+            changed = store is not None and (index_dir != store.index_dir or build_id != store.version)
+            if not changed or (index_dir, build_id) == self._failed:
+                continue
+            try:
+                reload_index_store()
+            except Exception:
+                # 失败已记录在 reload_stats 中；同一版本不再重试，直到 CURRENT 再次变化
+                self._failed = (index_dir, build_id)
\ No newline at end of file
@@ -0,0 +1,123 @@
+"""
+Semantic response cache: paraphrased queries ("funny time-travel drama" / "time travel comedy")
+reuse a recent AskResponse instead of rerunning retrieval + answer generation.
+- One small exact inner-product FAISS index per (scene, topK, dramaId, retrievalMode) partition,
+  holding the normalized vectors of recently answered queries
+- Hit: nearest cached vector with cosine >= threshold (and not older than the TTL)
+- Capacity-bounded LRU across partitions; everything is dropped when the index version or
+  encoder changes, so cached answers never outlive the data they were computed from
+- The nearest-neighbour similarity of every lookup goes into a histogram, to tune the threshold
+"""
+
+import threading
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, Optional
+
+import numpy as np
+
+# 相似度直方图分桶边界（余弦）
+SIM_BUCKETS = (0.5, 0.7, 0.8, 0.85, 0.9, 0.92, 0.94, 0.96, 0.98, 0.99)
+
+
+@dataclass
+class _Entry:
+    partition: Hashable
+    created: float
+    response: Any
+
+
+class SemanticCache:
+    def __init__(self, max_size: int, threshold: float, ttl_sec: float = 0.0):
+        self.max_size = max_size
+        self.threshold = threshold
+        self.ttl_sec = ttl_sec
+        self.bound_to: Optional[Hashable] = None
+        self._parts: Dict[Hashable, Any] = {}  # partition -> faiss.IndexIDMap2(IndexFlatIP)
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._sim_counts = [0] * (len(SIM_BUCKETS) + 1)
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def bind(self, key: Hashable) -> None:
+        """Drop every entry when `key` (index version + encoder) changes."""
+        with self._lock:
+            if key != self.bound_to:
+                if self._entries:
+                    self._stats["invalidations"] += 1
+                self._parts.clear()
+                self._entries.clear()
+                self.bound_to = key
+
+    def _drop(self, eid: int) -> None:
+        entry = self._entries.pop(eid)
+        index = self._parts[entry.partition]
+        index.remove_ids(np.array([eid], dtype="int64"))
+        if index.ntotal == 0:
+            del self._parts[entry.partition]
+
+    def get(self, partition: Hashable, vec: np.ndarray) -> Optional[Any]:
+        with self._lock:
+            index = self._parts.get(partition)
+            if index is None:
+                self._stats["misses"] += 1
+                return None
+            D, I = index.search(np.asarray(vec, dtype="float32").reshape(1, -1), 1)
+            sim, eid = float(D[0, 0]), int(I[0, 0])
+            self._sim_counts[bisect_right(SIM_BUCKETS, sim)] += 1
+            if eid < 0 or sim < self.threshold:
+                self._stats["misses"] += 1
+                return None
+            entry = self._entries[eid]
+            if self.ttl_sec > 0 and time.time() - entry.created > self.ttl_sec:
+                self._drop(eid)
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(eid)
+            self._stats["hits"] += 1
+            return entry.response
+
+    def put(self, partition: Hashable, vec: np.ndarray, response: Any, bound: Hashable = None) -> None:
+        """`bound`: the bind() key the response was computed under; stale ones are not stored."""
+        if not self.enabled:
+            return
+        import faiss  # type: ignore  # lazy: app.main is imported before faiss (see app/startup.py)
+
+        vec = np.asarray(vec, dtype="float32").reshape(1, -1)
+        with self._lock:
+            if bound is not None and bound != self.bound_to:
+                return
+            index = self._parts.get(partition)
+            if index is None:
+                index = self._parts[partition] = faiss.IndexIDMap2(faiss.IndexFlatIP(vec.shape[1]))
+            eid = self._next_id
+            self._next_id += 1
+            index.add_with_ids(vec, np.array([eid], dtype="int64"))
+            self._entries[eid] = _Entry(partition, time.time(), response)
+            while len(self._entries) > self.max_size:
+                self._drop(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            out: Dict[str, Any] = dict(self._stats)
+            out["size"] = len(self._entries)
+            out["partitions"] = len(self._parts)
+            sims = list(self._sim_counts)
+        lookups = out["hits"] + out["misses"]
+        out["hitRate"] = round(out["hits"] / lookups, 4) if lookups else 0.0
+        out["maxSize"] = self.max_size
+        out["threshold"] = self.threshold
+        out["ttlSec"] = self.ttl_sec
+        # 最近邻相似度分布：key 为桶下界，便于判断阈值附近有多少查询
+        lows = ("<" + str(SIM_BUCKETS[0]),) + tuple(f">={b}" for b in SIM_BUCKETS)
+        out["similarity"] = dict(zip(lows, sims))
+        return out
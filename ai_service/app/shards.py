@@ -0,0 +1,226 @@
+"""
+Scatter-gather over a sharded index (build_index.py --shards N: dramaId % N, one index root per shard).
+- Shard node: an ordinary service on one shard (AI_INDEX_DIR=<root>/shard-XX). It also answers
+  POST /shard/search with already-embedded query vectors; search_local() returns the hits together
+  with the few metadata fields the coordinator scores on, so no second round trip is needed.
+- Coordinator: SHARD_URLS set (app/coordinator.py). ShardFanout sends one request per shard in
+  parallel and waits at most SHARD_TIMEOUT_MS; a shard that errors or is late is left out, the
+  request is answered from the others and marked partial (see mark_partial).
+This module does not import faiss, so app.main can use it at import time.
+"""
+
+import base64
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import httpx
+import numpy as np
+
+from . import metrics
+from .config import settings
+
+logger = logging.getLogger("uvicorn")
+
+
+class ShardsUnavailable(RuntimeError):
+    """No shard answered in time; nothing to merge."""
+
+
+def shard_urls() -> List[str]:
+    return [u.strip().rstrip("/") for u in settings.shard_urls.split(",") if u.strip()]
+
+
+def encode_vectors(vecs: np.ndarray) -> str:
+    return base64.b64encode(np.ascontiguousarray(vecs, dtype="<f4").tobytes()).decode("ascii")
+
+
+def decode_vectors(data: str, dim: int) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(data), dtype="<f4").reshape(-1, dim).astype("float32")
+
+
+def mark_partial() -> None:
+    # 本请求的结果缺了至少一个分片：记为 partial（不进语义缓存，响应头 X-Partial-Results: 1）
+    metrics.fallback("shard_partial")
+    t = metrics.current()
+    if t is not None and t.outcome == "ok":
+        t.outcome = "partial"
+
+
+# -----------------------------
+# Shard node
+# -----------------------------
+
+def _rows(table, target: str, hits: List[Tuple[int, float]]) -> List[Dict]:
+    out = []
+    for row, score in hits:
+        rec = {"row": row, "score": score, "dramaId": table.drama_id(row),
+               "title": table.title(row), "category": table.category(row)}
+        if target == "drama":
+            rec["tags"] = table.tags(row)
+        else:
+            rec["text"] = table.text(row)[:400]
+        out.append(rec)
+    return out
+
+
+def search_local(store, target: str, vecs: Optional[np.ndarray], queries: Sequence[str], topk: int,
+                 ef_search: Optional[int] = None, nprobe: Optional[int] = None,
+                 drama_id: Optional[int] = None) -> Dict:
+    """
+    Node side of /shard/search: FAISS hits per vector row ("dense") and BM25 hits per query
+    ("sparse"), each hit with its row metadata. With drama_id, scores that drama's chunks only.
+    """
+    table = store._table_for(target)
+    out: Dict = {"version": store.version, "dense": [], "sparse": []}
+    if drama_id is not None:
+        hits = store.search_in_drama("", drama_id, topk, ef_search, nprobe, qvec=vecs[:1])
+        out["dense"] = [_rows(table, "chunk", hits)]
+        return out
+    if vecs is not None and len(vecs):
+        out["dense"] = [_rows(table, target, h) for h in store.search_vectors(target, vecs, topk, ef_search, nprobe)]
+    out["sparse"] = [_rows(table, target, store.sparse_search(target, q, topk)) for q in queries]
+    return out
+
+
+# -----------------------------
+# Coordinator
+# -----------------------------
+
+@dataclass(frozen=True)
+class ShardRow:
+    """One hit's metadata as sent by a shard; (shard, row) identifies it across the cluster."""
+    shard: int
+    row: int
+    drama_id: int = field(compare=False)
+    title: str = field(compare=False)
+    category: str = field(compare=False)
+    text: str = field(compare=False, default="")
+    tags: Tuple[str, ...] = field(compare=False, default=())
+
+
+def parse_rows(shard: int, recs: List[Dict]) -> List[Tuple[ShardRow, float]]:
+    return [(ShardRow(shard, int(r["row"]), int(r["dramaId"]), r.get("title") or "", r.get("category") or "",
+                      r.get("text") or "", tuple(r.get("tags") or ())), float(r["score"])) for r in recs]
+
+
+class RowTable:
+    """Positional table interface (as in app/metastore.py) over merged ShardRows."""
+    def __init__(self, rows: List[ShardRow]):
+        self.rows = rows
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def drama_id(self, i: int) -> int:
+        return self.rows[i].drama_id
+
+    def title(self, i: int) -> str:
+        return self.rows[i].title
+
+    def category(self, i: int) -> str:
+        return self.rows[i].category
+
+    def text(self, i: int) -> str:
+        return self.rows[i].text
+
+    def tags(self, i: int) -> List[str]:
+        return list(self.rows[i].tags)
+
+
+def positional(hits: List[Tuple[ShardRow, float]]) -> Tuple[RowTable, List[Tuple[int, float]]]:
+    return RowTable([r for r, _ in hits]), [(i, s) for i, (_, s) in enumerate(hits)]
+
+
+def merge_topk(per_shard: List[List[Tuple[ShardRow, float]]], topk: int) -> List[Tuple[ShardRow, float]]:
+    """Per-shard top-k lists -> global top-k (every shard sorted its own list already)."""
+    merged = [h for hits in per_shard for h in hits]
+    merged.sort(key=lambda h: h[1], reverse=True)
+    return merged[:topk]
+
+
+class ShardClient:
+    def __init__(self, no: int, url: str):
+        self.no = no
+        self.url = url
+        self.label = str(no)
+        self.info: Dict = {}
+        self.version: Optional[str] = None
+        self.calls = {"ok": 0, "timeout": 0, "error": 0}
+
+    def report(self) -> Dict:
+        return {"url": self.url, "shard": self.info.get("shard", self.no), "version": self.version,
+                "chunks": self.info.get("chunks"), "dramas": self.info.get("dramas"), "calls": dict(self.calls)}
+
+
+class ShardFanout:
+    """
+    Parallel HTTP calls to the shard nodes from the inference worker threads: one pooled keep-alive
+    client, one thread per in-flight shard call, a shared deadline per fan-out.
+    """
+    def __init__(self, urls: List[str], timeout_sec: float):
+        if not urls:
+            raise ValueError("SHARD_URLS is empty")
+        self.shards = [ShardClient(i, url) for i, url in enumerate(urls)]
+        self.timeout_sec = timeout_sec
+        # 迟到的调用在后台继续跑完（结果丢弃），由 HTTP 超时兜底，避免线程堆积
+        self._http = httpx.Client(timeout=max(timeout_sec * 2, 1.0),
+                                  limits=httpx.Limits(max_connections=64 * len(urls),
+                                                      max_keepalive_connections=16 * len(urls)))
+        self._pool = ThreadPoolExecutor(max_workers=16 * len(urls), thread_name_prefix="shard-fanout")
+
+    def fetch_info(self, wait_sec: float) -> None:
+        """GET /shard/info on every shard, retrying until all answered or `wait_sec` passed."""
+        deadline = time.monotonic() + wait_sec
+        while True:
+            for s in self.shards:
+                if s.info:
+                    continue
+                try:
+                    r = self._http.get(f"{s.url}/shard/info", timeout=5.0)
+                    if r.status_code == 200:
+                        s.info = r.json()
+                        s.version = s.info.get("version")
+                except httpx.HTTPError:
+                    pass
+            if all(s.info for s in self.shards) or time.monotonic() >= deadline:
+                return
+            time.sleep(0.5)
+
+    def _call(self, shard: ShardClient, payload: Dict) -> Dict:
+        t0 = time.perf_counter()
+        try:
+            r = self._http.post(f"{shard.url}/shard/search", json=payload)
+            r.raise_for_status()
+            return r.json()
+        finally:
+            metrics.SHARD_SECONDS.observe(time.perf_counter() - t0, shard.label)
+
+    def scatter(self, payload: Dict, shards: Optional[List[ShardClient]] = None) -> List[Tuple[ShardClient, Dict]]:
+        """(shard, response) for every shard that answered before the deadline."""
+        shards = shards or self.shards
+        with metrics.stage("scatter"):
+            futs = {self._pool.submit(self._call, s, payload): s for s in shards}
+            done, late = wait(futs, timeout=self.timeout_sec)
+        out: List[Tuple[ShardClient, Dict]] = []
+        for fut, s in futs.items():
+            if fut in late:
+                fut.cancel()
+                outcome = "timeout"
+            elif fut.exception() is not None:
+                logger.warning(f"Shard {s.no} ({s.url}) failed: {fut.exception()}")
+                outcome = "error"
+            else:
+                resp = fut.result()
+                s.version = resp.get("version", s.version)
+                out.append((s, resp))
+                outcome = "ok"
+            s.calls[outcome] += 1
+            metrics.SHARD_CALLS.inc(s.label, outcome)
+        if not out:
+            raise ShardsUnavailable(f"no shard answered within {self.timeout_sec * 1000:.0f}ms")
+        if len(out) < len(shards):
+            mark_partial()
+        return out
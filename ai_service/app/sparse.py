@@ -0,0 +1,261 @@
+"""
+BM25 inverted index stored as compact arrays (CSR by term):
+- <prefix>_bm25_vocab.json     sorted term list (term id = position)
+- <prefix>_bm25_vocab.bin / _offsets.npy   same list as an mmap-able blob (shared mode)
+- <prefix>_bm25_indptr.npy     int64, len(vocab)+1 posting offsets
+- <prefix>_bm25_docs.npy       int32 row ids (chunk row / drama row)
+- <prefix>_bm25_weights.npy    float32 precomputed BM25 term-document impacts
+- <prefix>_bm25_tf.npy / _doclen.npy   float32 term frequency per posting / token count per doc
+                               (only read by merge_bm25, to re-weight after an incremental sync)
+Querying sums the impacts of the query terms' postings, so it needs no extra service.
+"""
+
+import json
+import re
+import tempfile
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .metastore import StringTable, has_string_table, write_string_table
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "from", "has", "he", "her", "his",
+    "in", "into", "is", "it", "its", "of", "on", "or", "she", "that", "the", "their", "they", "this",
+    "to", "was", "were", "who", "with",
+}
+
+
+def bm25_tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN_RE.findall((text or "").lower()) if len(t) > 1 and t not in _STOPWORDS]
+
+
+def write_bm25(out_dir: Path, prefix: str, texts: Iterable[str], k1: float = 1.2, b: float = 0.75,
+               block_postings: int = 4_000_000) -> Dict:
+    """
+    Build BM25 postings for `texts` (row i == doc i) and write them under `prefix`.
+    Postings are collected in blocks of `block_postings`, each spilled to disk sorted by term,
+    then scattered into the final CSR arrays, so memory is bounded by one block (plus vocab
+    and doc lengths) regardless of corpus size.
+    """
+    vocab: Dict[str, int] = {}
+    doc_lens = array("f")
+    terms, docs, tfs = array("i"), array("i"), array("f")
+    blocks: List[Path] = []
+    spill_dir = Path(tempfile.mkdtemp(prefix=f".{prefix}_bm25_", dir=out_dir))
+
+    def spill() -> None:
+        t = np.frombuffer(terms, dtype="int32")
+        order = np.argsort(t, kind="stable")  # doc 在 term 组内保持升序
+        path = spill_dir / f"block{len(blocks)}.npz"
+        np.savez(path, terms=t[order], docs=np.frombuffer(docs, dtype="int32")[order],
+                 tf=np.frombuffer(tfs, dtype="float32")[order])
+        blocks.append(path)
+        del t  # 释放对 array 缓冲区的引用后才能清空
+        for a in (terms, docs, tfs):
+            del a[:]
+
+    for doc, text in enumerate(texts):
+        counts = Counter(bm25_tokenize(text))
+        doc_lens.append(sum(counts.values()))
+        if not counts:
+            continue
+        terms.extend(vocab.setdefault(t, len(vocab)) for t in counts)
+        docs.extend([doc] * len(counts))
+        tfs.extend(counts.values())
+        if len(docs) >= block_postings:
+            spill()
+    if len(docs) or not blocks:
+        spill()
+
+    n_docs = len(doc_lens)
+    dl = np.frombuffer(doc_lens, dtype="float32") if n_docs else np.zeros(0, dtype="float32")
+    avgdl = float(dl.mean()) if n_docs else 1.0
+
+    # 词表按字典序重排；各 block 重新按新 term id 排序并统计每个 term 的 posting 数
+    sorted_terms = sorted(vocab)
+    remap = np.zeros(len(vocab), dtype="int32")
+    for new_id, t in enumerate(sorted_terms):
+        remap[vocab[t]] = new_id
+    block_counts = []
+    for path in blocks:
+        with np.load(path) as z:
+            t, d, f = remap[z["terms"]] if len(z["terms"]) else z["terms"], z["docs"], z["tf"]
+        order = np.argsort(t, kind="stable")
+        np.savez(path, terms=t[order], docs=d[order], tf=f[order])
+        block_counts.append(np.bincount(t, minlength=len(sorted_terms)).astype("int64"))
+
+    df = np.sum(block_counts, axis=0) if block_counts else np.zeros(len(sorted_terms), dtype="int64")
+    idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5)).astype("float32")
+    indptr = np.zeros(len(sorted_terms) + 1, dtype="int64")
+    np.cumsum(df, out=indptr[1:])
+    total = int(indptr[-1])
+
+    out_docs = np.lib.format.open_memmap(out_dir / f"{prefix}_bm25_docs.npy", mode="w+", dtype="int32", shape=(total,))
+    out_weights = np.lib.format.open_memmap(out_dir / f"{prefix}_bm25_weights.npy", mode="w+", dtype="float32",
+                                            shape=(total,))
+    out_tf = np.lib.format.open_memmap(out_dir / f"{prefix}_bm25_tf.npy", mode="w+", dtype="float32", shape=(total,))
+    base = indptr[:-1].copy()  # 每个 term 在输出中的下一个写入位置
+    for path, counts in zip(blocks, block_counts):
+        with np.load(path) as z:
+            t, d, tf = z["terms"], z["docs"], z["tf"]
+        if len(t):
+            block_indptr = np.zeros(len(sorted_terms) + 1, dtype="int64")
+            np.cumsum(counts, out=block_indptr[1:])
+            dest = base[t] + np.arange(len(t), dtype="int64") - block_indptr[t]
+            norm = k1 * (1.0 - b + b * dl[d] / max(avgdl, 1e-6))
+            out_docs[dest] = d
+            out_weights[dest] = idf[t] * tf * (k1 + 1.0) / (tf + norm)
+            out_tf[dest] = tf
+        base += counts
+        path.unlink()
+    spill_dir.rmdir()
+    for a in (out_docs, out_weights, out_tf):
+        a.flush()
+    del out_docs, out_weights, out_tf
+
+    _save_vocab(out_dir, prefix, sorted_terms, indptr, dl)
+    return {"docs": n_docs, "terms": len(sorted_terms), "postings": total, "avgdl": round(avgdl, 2)}
+
+
+def _save_vocab(out_dir: Path, prefix: str, terms: List[str], indptr: np.ndarray, doc_lens: np.ndarray) -> None:
+    with (out_dir / f"{prefix}_bm25_vocab.json").open("w", encoding="utf-8") as f:
+        json.dump(terms, f, ensure_ascii=False)
+    write_string_table(out_dir, f"{prefix}_bm25_vocab", terms)
+    np.save(out_dir / f"{prefix}_bm25_indptr.npy", indptr)
+    np.save(out_dir / f"{prefix}_bm25_doclen.npy", np.asarray(doc_lens, dtype="float32"))
+
+
+def can_merge_bm25(index_dir: Path, prefix: str) -> bool:
+    """Postings written with tf / doc lengths (older builds need one full write_bm25 first)."""
+    return all((index_dir / f"{prefix}_bm25_{name}.npy").exists() for name in ("tf", "doclen", "docs", "indptr"))
+
+
+def merge_bm25(out_dir: Path, src_dir: Path, prefix: str, old_to_new: np.ndarray, new_rows: np.ndarray,
+               new_texts: List[str], k1: float = 1.2, b: float = 0.75) -> Dict:
+    """
+    Postings of `src_dir` re-keyed to the spliced table (old row -> new row, -1 = removed) plus
+    the postings of `new_texts` (rows `new_rows`), written to `out_dir`. Only the new texts are
+    tokenized; kept postings stay sorted (term and row order are both preserved), so the new ones
+    are merged in with one searchsorted. Weights are recomputed for the new idf / avgdl and match
+    a full write_bm25 over the same rows.
+    """
+    with (src_dir / f"{prefix}_bm25_vocab.json").open("r", encoding="utf-8") as f:
+        old_vocab: List[str] = json.load(f)
+    indptr = np.load(src_dir / f"{prefix}_bm25_indptr.npy")
+    old_docs = np.load(src_dir / f"{prefix}_bm25_docs.npy", mmap_mode="r")
+    old_tf = np.load(src_dir / f"{prefix}_bm25_tf.npy", mmap_mode="r")
+    old_dl = np.load(src_dir / f"{prefix}_bm25_doclen.npy")
+
+    old_to_new = np.asarray(old_to_new, dtype="int64")
+    n_docs = int((old_to_new >= 0).sum()) + len(new_rows)
+    rows = old_to_new[np.asarray(old_docs, dtype="int64")]
+    kept = rows >= 0
+    terms = np.repeat(np.arange(len(old_vocab), dtype="int64"), np.diff(indptr))[kept]
+    rows, tf = rows[kept], np.asarray(old_tf)[kept]
+
+    dl = np.zeros(n_docs, dtype="float32")
+    dl[old_to_new[old_to_new >= 0]] = old_dl[old_to_new >= 0]
+    new_counts = []
+    for row, text in zip(new_rows, new_texts):
+        counts = Counter(bm25_tokenize(text))
+        dl[row] = sum(counts.values())
+        new_counts.append(counts)
+
+    # 合并后的有序词表；旧词的相对顺序不变，所以旧 posting 仍按 (term, row) 有序
+    vocab = sorted(set(old_vocab).union(*new_counts))
+    term_ids = {t: i for i, t in enumerate(vocab)}
+    terms = np.fromiter((term_ids[t] for t in old_vocab), dtype="int64", count=len(old_vocab))[terms]
+    add_terms = np.asarray([term_ids[t] for c in new_counts for t in c], dtype="int64")
+    add_rows = np.asarray([r for r, c in zip(new_rows, new_counts) for _ in c], dtype="int64")
+    add_tf = np.asarray([v for c in new_counts for v in c.values()], dtype="float32")
+    key = terms * max(n_docs, 1) + rows
+    add_key = add_terms * max(n_docs, 1) + add_rows
+    order = np.argsort(add_key, kind="stable")
+    at = np.searchsorted(key, add_key[order])
+    terms = np.insert(terms, at, add_terms[order])
+    rows = np.insert(rows, at, add_rows[order])
+    tf = np.insert(tf, at, add_tf[order])
+
+    # 删除后 df 为 0 的词从词表中去掉
+    df = np.bincount(terms, minlength=len(vocab))
+    if len(vocab) and not df.all():
+        live = df > 0
+        terms = (np.cumsum(live) - 1)[terms]
+        vocab = [t for t, ok in zip(vocab, live) if ok]
+        df = df[live]
+
+    avgdl = float(dl.mean()) if n_docs else 1.0
+    idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5)).astype("float32")
+    norm = k1 * (1.0 - b + b * dl[rows] / max(avgdl, 1e-6))
+    weights = (idf[terms] * tf * (k1 + 1.0) / (tf + norm)).astype("float32")
+    new_indptr = np.zeros(len(vocab) + 1, dtype="int64")
+    np.cumsum(df, out=new_indptr[1:])
+
+    np.save(out_dir / f"{prefix}_bm25_docs.npy", rows.astype("int32"))
+    np.save(out_dir / f"{prefix}_bm25_weights.npy", weights)
+    np.save(out_dir / f"{prefix}_bm25_tf.npy", tf.astype("float32"))
+    _save_vocab(out_dir, prefix, vocab, new_indptr, dl)
+    return {"docs": n_docs, "terms": len(vocab), "postings": int(len(rows)), "avgdl": round(avgdl, 2),
+            "tokenized_docs": len(new_rows)}
+
+
+class BM25Index:
+    def __init__(self, index_dir: Path, prefix: str, shared: bool = False):
+        # shared：词表走 mmap 的有序字符串表（二分查找），不在每个 worker 里建 dict
+        if shared and has_string_table(index_dir, f"{prefix}_bm25_vocab"):
+            self.vocab = StringTable(index_dir, f"{prefix}_bm25_vocab")
+        else:
+            with (index_dir / f"{prefix}_bm25_vocab.json").open("r", encoding="utf-8") as f:
+                self.vocab = {t: i for i, t in enumerate(json.load(f))}
+        self.indptr = np.load(index_dir / f"{prefix}_bm25_indptr.npy", mmap_mode="r")
+        self.docs = np.load(index_dir / f"{prefix}_bm25_docs.npy", mmap_mode="r")
+        self.weights = np.load(index_dir / f"{prefix}_bm25_weights.npy", mmap_mode="r")
+
+    @classmethod
+    def load(cls, index_dir: Path, prefix: str, shared: bool = False) -> Optional["BM25Index"]:
+        if not (index_dir / f"{prefix}_bm25_vocab.json").exists():
+            return None
+        return cls(index_dir, prefix, shared)
+
+    def search(self, query: str, topk: int) -> List[Tuple[int, float]]:
+        tids = [i for i in (self.vocab.get(t) for t in dict.fromkeys(bm25_tokenize(query))) if i is not None]
+        if not tids or topk <= 0:
+            return []
+        docs = np.concatenate([self.docs[self.indptr[t]:self.indptr[t + 1]] for t in tids])
+        weights = np.concatenate([self.weights[self.indptr[t]:self.indptr[t + 1]] for t in tids])
+        if len(docs) == 0:
+            return []
+        order = np.argsort(docs, kind="stable")
+        uniq, starts = np.unique(docs[order], return_index=True)
+        scores = np.add.reduceat(weights[order], starts)
+        k = min(topk, len(uniq))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(uniq[i]), float(scores[i])) for i in top]
+
+
+def fuse(vector_hits: List[Tuple[int, float]], sparse_hits: List[Tuple[int, float]], topk: int,
+         method: str = "rrf", rrf_k: int = 60, vector_weight: float = 0.7) -> List[Tuple[int, float]]:
+    """
+    Rank fusion of two hit lists. Scores are rescaled so the best fused hit is 1.0,
+    keeping them on the same scale as cosine similarities for downstream scoring.
+    """
+    fused: Dict[int, float] = {}
+    if method == "weighted":
+        top_sparse = max((s for _, s in sparse_hits), default=0.0) or 1.0
+        for idx, s in vector_hits:
+            fused[idx] = fused.get(idx, 0.0) + vector_weight * s
+        for idx, s in sparse_hits:
+            fused[idx] = fused.get(idx, 0.0) + (1.0 - vector_weight) * s / top_sparse
+    else:
+        for hits in (vector_hits, sparse_hits):
+            for rank, (idx, _) in enumerate(hits):
+                fused[idx] = fused.get(idx, 0.0) + 1.0 / (rrf_k + rank + 1)
+    ranked = sorted(fused.items(), key=lambda x: x[1], reverse=True)[:topk]
+    top = ranked[0][1] if ranked and ranked[0][1] > 0 else 1.0
+    return [(idx, score / top) for idx, score in ranked]
@@ -0,0 +1,95 @@
+"""
+Startup sequencing for the online service: imports -> index/model load -> warmup.
+Each phase is timed (logs + /healthz) and readiness (/readyz) only flips after warmup,
+so an orchestrator never routes traffic to a pod that would serve its first query cold.
+faiss / torch are imported here, on the startup path, instead of when app.main is imported,
+which lets STARTUP_MODE=background answer liveness probes while they load.
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from . import admission
+from .config import settings
+
+logger = logging.getLogger("uvicorn")
+
+
+class StartupState:
+    def __init__(self):
+        self.started_at = time.time()
+        self.ready_at: Optional[float] = None
+        self.phases: Dict[str, float] = {}
+        self.error: Optional[str] = None
+        self.warmup: Optional[Dict] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.ready_at is not None
+
+    @contextmanager
+    def phase(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = round(time.perf_counter() - t0, 3)
+            logger.info(f"[startup] {name}: {self.phases[name]:.2f}s")
+
+    def report(self) -> Dict:
+        return {
+            "ready": self.ready,
+            "mode": settings.startup_mode,
+            "phases": self.phases,
+            "totalSec": round(self.ready_at - self.started_at, 3) if self.ready else None,
+            "warmup": self.warmup,
+            "error": self.error,
+        }
+
+
+state = StartupState()
+_watcher = None
+
+
+def run_startup() -> bool:
+    """Load everything the request path needs; returns readiness. Never raises."""
+    global _watcher
+    try:
+        with state.phase("imports"):
+            from . import retriever  # faiss + numpy kernels; torch / transformers come with the model
+            admission.controller.intra_op_threads = admission.configure_threads(admission.controller.workers)
+        with state.phase("load"):
+            store = retriever.get_index_store()
+        state.phases.update({f"load.{k}": v for k, v in store.load_phases.items()})
+        if settings.warmup_queries > 0:
+            with state.phase("warmup"):
+                state.warmup = store.warmup(settings.warmup_queries)
+        if settings.index_watch_interval_sec > 0 and not settings.shard_urls:
+            # 协调节点不持有索引：分片节点各自热加载，组合版本随分片响应更新
+            _watcher = retriever.IndexWatcher(settings.index_watch_interval_sec).start()
+    except Exception as e:
+        state.error = str(e)
+        logger.warning(f"AI preloaded failed: {e}")
+        return False
+    state.ready_at = time.time()
+    logger.info(f"AI index/model ready in {state.ready_at - state.started_at:.2f}s")
+    return True
+
+
+def start(background: bool) -> None:
+    if background:
+        threading.Thread(target=run_startup, name="startup", daemon=True).start()
+    else:
+        run_startup()
+
+
+def shutdown() -> None:
+    if _watcher is not None:
+        _watcher.stop()
+    admission.controller.close()
+    from .llm import gateway
+
+    gateway.close()
@@ -0,0 +1,202 @@
+"""
+User taste vectors for the recommend scene (built by scripts/build_user_vectors.py from watch_history).
+Layout under USER_STORE_DIR:
+- state.json        {"version", "base", "delta", "watermark", "model", "dim", "halfLifeDays", ...}
+                    (replaced atomically; names the live segments)
+- <segment>/        one sorted snapshot of users:
+    user_ids.npy         int64, sorted
+    vectors.npy          float16 (n, dim), L2-normalized taste vector per user
+    watched_offsets.npy  int64, n+1 offsets into watched_ids.npy
+    watched_ids.npy      int64 dramaIds the user has watched (sorted per user)
+The base segment holds every user as of the last compaction; the delta segment holds users whose
+history changed since, and wins on lookup. Incremental runs only rewrite the (small) delta and fold
+it into a new base once it grows past --compact-ratio of the base.
+A taste vector is the normalized sum of the user's watched drama vectors (drama.faiss), weighted by
+log1p(minutes watched) * 0.5 ** (age / half-life); age is taken from the user's latest watch, which
+scales all of a user's weights by the same factor, so a vector does not go stale as time passes.
+Everything is memory-mapped: lookups are two binary searches and one row read, no aggregation.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .config import settings
+
+logger = logging.getLogger("uvicorn")
+
+STATE_FILE = "state.json"
+SEGMENT_FILES = ("user_ids", "vectors", "watched_offsets", "watched_ids")
+
+
+@dataclass(frozen=True)
+class UserTaste:
+    vector: np.ndarray  # float32 (dim,), normalized
+    watched: np.ndarray  # int64 dramaIds
+
+
+@dataclass
+class Segment:
+    """Column arrays of one segment (memory-mapped when opened from disk)."""
+    user_ids: np.ndarray
+    vectors: np.ndarray
+    watched_offsets: np.ndarray
+    watched_ids: np.ndarray
+
+    @classmethod
+    def open(cls, path: Path, mmap: bool = True) -> "Segment":
+        mode = "r" if mmap else None
+        return cls(*(np.load(path / f"{name}.npy", mmap_mode=mode) for name in SEGMENT_FILES))
+
+    @classmethod
+    def empty(cls, dim: int) -> "Segment":
+        return cls(np.zeros(0, dtype="int64"), np.zeros((0, dim), dtype="float16"),
+                   np.zeros(1, dtype="int64"), np.zeros(0, dtype="int64"))
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+    def row(self, user_id: int) -> int:
+        pos = int(np.searchsorted(self.user_ids, user_id))
+        return pos if pos < len(self.user_ids) and int(self.user_ids[pos]) == user_id else -1
+
+    def taste(self, row: int) -> Optional[UserTaste]:
+        vec = np.asarray(self.vectors[row], dtype="float32")
+        if not vec.any():
+            return None  # 只有进度为 0 的观看记录
+        watched = np.asarray(self.watched_ids[self.watched_offsets[row]:self.watched_offsets[row + 1]])
+        return UserTaste(vec, watched)
+
+    def take(self, rows: np.ndarray) -> "Segment":
+        """Rows `rows` (in that order) as a new in-memory segment; CSR columns gathered without a loop."""
+        rows = np.asarray(rows, dtype="int64")
+        starts = np.asarray(self.watched_offsets[:-1])[rows]
+        lens = np.asarray(self.watched_offsets[1:])[rows] - starts
+        offsets = np.concatenate(([0], np.cumsum(lens))).astype("int64")
+        gather = np.repeat(starts - offsets[:-1], lens) + np.arange(offsets[-1], dtype="int64")
+        return Segment(np.asarray(self.user_ids)[rows], np.asarray(self.vectors)[rows], offsets,
+                       np.asarray(self.watched_ids)[gather])
+
+    def write(self, path: Path) -> None:
+        path.mkdir(parents=True, exist_ok=True)
+        for name in SEGMENT_FILES:
+            np.save(path / f"{name}.npy", np.ascontiguousarray(getattr(self, name)))
+
+
+def concat_segments(parts: List[Segment]) -> Segment:
+    offsets = [np.zeros(1, dtype="int64")]
+    base = 0
+    for p in parts:
+        offsets.append(np.asarray(p.watched_offsets[1:]) + base)
+        base += int(p.watched_offsets[-1])
+    return Segment(np.concatenate([np.asarray(p.user_ids) for p in parts]),
+                   np.concatenate([np.asarray(p.vectors) for p in parts]),
+                   np.concatenate(offsets).astype("int64"),
+                   np.concatenate([np.asarray(p.watched_ids) for p in parts]))
+
+
+def merge_segments(newer: Segment, older: Segment) -> Segment:
+    """Union sorted by userId; users present in both come from `newer`."""
+    keep = np.flatnonzero(~np.isin(np.asarray(older.user_ids), np.asarray(newer.user_ids)))
+    both = concat_segments([newer, older.take(keep)])
+    return both.take(np.argsort(both.user_ids, kind="stable"))
+
+
+def read_state(root: Path) -> Optional[Dict]:
+    path = root / STATE_FILE
+    if not path.exists():
+        return None
+    with path.open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_state(root: Path, state: Dict) -> None:
+    tmp = root / (STATE_FILE + ".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, root / STATE_FILE)
+
+
+def blend(qvec: np.ndarray, taste: UserTaste, weight: float) -> np.ndarray:
+    """Normalized (1 - weight) * query + weight * taste, shape (dim,)."""
+    v = (1.0 - weight) * np.asarray(qvec, dtype="float32").reshape(-1) + weight * taste.vector
+    n = float(np.linalg.norm(v))
+    return (v / n if n > 0 else v).astype("float32")
+
+
+class UserStore:
+    def __init__(self, root: Path):
+        self.root = root
+        state = read_state(root)
+        if state is None:
+            raise FileNotFoundError(f"No {STATE_FILE} in {root}")
+        self.state = state
+        self.version: str = state["version"]
+        self.model: str = state.get("model") or ""
+        self.dim = int(state["dim"])
+        # delta 在前：增量更新过的用户以 delta 为准
+        self.segments = [Segment.open(root / name) for name in (state.get("delta"), state["base"]) if name]
+        self.loaded_at = time.time()
+        self._stats = {"lookups": 0, "found": 0}
+
+    def lookup(self, user_id: int) -> Optional[UserTaste]:
+        self._stats["lookups"] += 1
+        for seg in self.segments:
+            row = seg.row(int(user_id))
+            if row >= 0:
+                taste = seg.taste(row)
+                if taste is not None:
+                    self._stats["found"] += 1
+                return taste
+        return None
+
+    def stats(self) -> Dict:
+        return {
+            "dir": str(self.root),
+            "version": self.version,
+            "model": self.model,
+            "users": int(self.state.get("users", 0)),
+            "segments": [len(s) for s in self.segments],
+            "watermark": self.state.get("watermark"),
+            "loadedAt": round(self.loaded_at, 3),
+            **self._stats,
+        }
+
+
+# Checked at most every USER_STORE_CHECK_SEC; a new state.json is picked up without a restart
+_store: Optional[UserStore] = None
+_checked_at = 0.0
+_seen: Optional[Tuple[int, int]] = None
+_lock = threading.Lock()
+
+
+def get_user_store() -> Optional[UserStore]:
+    """The current user store, or None if USER_STORE_DIR has none (personalization off)."""
+    global _store, _checked_at, _seen
+    if time.monotonic() - _checked_at < settings.user_store_check_sec:
+        return _store
+    with _lock:
+        if time.monotonic() - _checked_at < settings.user_store_check_sec:
+            return _store
+        _checked_at = time.monotonic()
+        try:
+            st = (settings.user_store_dir / STATE_FILE).stat()
+        except OSError:
+            _store, _seen = None, None
+            return None
+        if (st.st_mtime_ns, st.st_size) != _seen:
+            try:
+                _store = UserStore(settings.user_store_dir)
+                logger.info(f"User store {_store.version} loaded: {_store.stats()['segments']} users per segment")
+            except Exception as e:
+                # 旧版本（若有）继续服务
+                logger.warning(f"User store load failed: {e}")
+            _seen = (st.st_mtime_ns, st.st_size)
+        return _store
@@ -0,0 +1,133 @@
+"""
+Versioned index directories for zero-downtime reloads:
+- <root>/versions/<build_id>/   one complete index per build (FAISS + metadata + manifest.json)
+- <root>/CURRENT                text file naming the active build id (replaced atomically)
+A plain index directory without CURRENT is still served as-is (unversioned layout).
+Sharded builds (build_index.py --shards N) put one such root per shard under <root>/shard-XX/,
+rows partitioned by dramaId % N, plus <root>/shards.json describing the split.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+MANIFEST_FILE = "manifest.json"
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+CHECKSUM_FILES = ("faiss.index", "drama.faiss")
+SHARDS_FILE = "shards.json"
+
+
+def new_build_id() -> str:
+    return datetime.utcnow().strftime("%Y%m%dT%H%M%S") + "-" + uuid.uuid4().hex[:6]
+
+
+def index_checksum(index_dir: Path) -> str:
+    """sha256 over the FAISS files; metadata is derived from the same build."""
+    h = hashlib.sha256()
+    for name in CHECKSUM_FILES:
+        path = index_dir / name
+        if not path.exists():
+            continue
+        h.update(name.encode("utf-8"))
+        with path.open("rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    return "sha256:" + h.hexdigest()
+
+
+def write_manifest(index_dir: Path, build_id: str, model_name: str, dim: int, **extra) -> Dict:
+    manifest = {
+        "buildId": build_id,
+        "checksum": index_checksum(index_dir),
+        "model": model_name,
+        "dim": int(dim),
+        "createdAt": datetime.utcnow().isoformat() + "Z",
+        **extra,
+    }
+    with (index_dir / MANIFEST_FILE).open("w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def read_manifest(index_dir: Path) -> Optional[Dict]:
+    path = index_dir / MANIFEST_FILE
+    if not path.exists():
+        return None
+    with path.open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def verify_manifest(index_dir: Path, manifest: Optional[Dict]) -> None:
+    if manifest and manifest.get("checksum") and manifest["checksum"] != index_checksum(index_dir):
+        raise ValueError(f"Index checksum mismatch in {index_dir} (partial copy?)")
+
+
+def active_build_id(root: Path) -> Optional[str]:
+    path = root / CURRENT_FILE
+    if not path.exists():
+        return None
+    return path.read_text(encoding="utf-8").strip() or None
+
+
+def resolve_index_dir(root: Path) -> Tuple[Path, Optional[str]]:
+    """(directory to load, build id) for either layout."""
+    build_id = active_build_id(root)
+    if build_id is None:
+        manifest = read_manifest(root)
+        return root, (manifest or {}).get("buildId")
+    return root / VERSIONS_DIR / build_id, build_id
+
+
+def version_dir(root: Path, build_id: str) -> Path:
+    return root / VERSIONS_DIR / build_id
+
+
+def publish_version(root: Path, build_id: str) -> None:
+    """Point CURRENT at `build_id` (write + os.replace, so readers never see a partial file)."""
+    if not (version_dir(root, build_id) / "faiss.index").exists():
+        raise FileNotFoundError(f"Version not found: {version_dir(root, build_id)}")
+    tmp = root / (CURRENT_FILE + ".tmp")
+    tmp.write_text(build_id + "\n", encoding="utf-8")
+    os.replace(tmp, root / CURRENT_FILE)
+
+
+def prune_versions(root: Path, keep: int) -> None:
+    """Delete all but the newest `keep` versions (never the active one)."""
+    vdir = root / VERSIONS_DIR
+    if keep <= 0 or not vdir.exists():
+        return
+    active = active_build_id(root)
+    versions = sorted((p for p in vdir.iterdir() if p.is_dir()), key=lambda p: p.name, reverse=True)
+    for p in versions[keep:]:
+        if p.name != active:
+            shutil.rmtree(p, ignore_errors=True)
+
+
+def shard_of(drama_id: int, n_shards: int) -> int:
+    """Owning shard of a drama (all of its chunks live there too)."""
+    return int(drama_id) % n_shards
+
+
+def shard_dir(root: Path, shard: int) -> Path:
+    return root / f"shard-{shard:02d}"
+
+
+def write_shard_map(root: Path, n_shards: int, **extra) -> Dict:
+    shard_map = {
+        "shards": int(n_shards),
+        "partition": "dramaId % shards",
+        "dirs": [shard_dir(root, i).name for i in range(n_shards)],
+        "createdAt": datetime.utcnow().isoformat() + "Z",
+        **extra,
+    }
+    tmp = root / (SHARDS_FILE + ".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(shard_map, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, root / SHARDS_FILE)
+    return shard_map
@@ -4,18 +4,27 @@ MCP Tool server for Short Drama RAG (stdio).
 Tools:
 - vector_search(query: str, topK: int=6) -> { ok, data: { items, answer } }
 - qa_for_drama(question: str, dramaId: int, topK: int=6) -> { ok, data: { items, answer } }
+- batch_search(queries: list[str], topK: int=6, scene: str="search", dramaId: int|None=None)
+    -> { ok, data: { results: [{ query, items, answer }] } }
+- similar_dramas(dramaId: int, topK: int=10) -> { ok, data: { items } }  (precomputed "more like this")
 
 Reuses FAISS index & embedding model from ai_service/app.
 """
 
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 from mcp.server.fastmcp import FastMCP
 
-from ai_service.app.retriever import get_index_store
+from ai_service.app import metrics
+from ai_service.app.config import settings
 from ai_service.app.llm import generate_answer
 
 srv = FastMCP("short-drama-rag-tools")
 
+def get_index_store():
+    # 延迟导入：stdio 握手不必等 faiss / torch，首次调用工具时才加载索引和模型
+    from ai_service.app.retriever import get_index_store as _get
+    return _get()
+
 def _ok(data: Dict[str, Any]) -> Dict[str, Any]:
     return {"ok": True, "data": data}
 
@@ -32,10 +41,12 @@ def vector_search(query: str, topK: int = 6) -> Dict[str, Any]:
     if not isinstance(topK, int) or topK <= 0 or topK > 50:
         return _err("topK must be an integer in 1..50")
 
-    store = get_index_store()
-    hits = store.search(query, topk=max(topK * 3, topK))
-    items = store.hits_to_drama(hits, dedup_by_drama=True, limit=topK)
-    answer = generate_answer(query, items, scene="search", drama_id=None)
+    with metrics.track("mcp:vector_search", "search"):
+        store = get_index_store()
+        hits = store.search(query, topk=max(topK * 3, topK))
+        items = store.hits_to_drama(hits, dedup_by_drama=True, limit=topK)
+        with metrics.stage("answer"):
+            answer = generate_answer(query, items, scene="search", drama_id=None)
     return _ok({"items": items, "answer": answer})
 
 @srv.tool()
@@ -50,16 +61,68 @@ def qa_for_drama(question: str, dramaId: int, topK: int = 6) -> Dict[str, Any]:
     if not isinstance(topK, int) or topK <= 0 or topK > 50:
         return _err("topK must be an integer in 1..50")
 
-    store = get_index_store()
-    hits = store.search(question, topk=max(topK * 3, topK))
-    hits = store.filter_hits_by_drama(hits, dramaId)
-    if not hits:
-        # fallback: unconstrained search
-        hits = store.search(question, topk=max(topK * 2, topK))
+    with metrics.track("mcp:qa_for_drama", "qa"):
+        store = get_index_store()
+        hits = store.search_in_drama(question, dramaId, topk=topK)
+        if not hits:
+            # fallback: unconstrained search
+            metrics.fallback("qa_unconstrained")
+            hits = store.search(question, topk=max(topK * 2, topK))
 
-    items = store.hits_to_drama(hits, dedup_by_drama=True, limit=topK)
-    answer = generate_answer(question, items, scene="qa", drama_id=dramaId)
+        items = store.hits_to_drama(hits, dedup_by_drama=True, limit=topK)
+        with metrics.stage("answer"):
+            answer = generate_answer(question, items, scene="qa", drama_id=dramaId)
     return _ok({"items": items, "answer": answer})
 
+@srv.tool()
+def batch_search(queries: List[str], topK: int = 6, scene: str = "search",
+                 dramaId: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Run several queries (e.g. alternative phrasings) in one call: one embedding pass and one
+    index search for all of them. scene: search | recommend | qa (qa uses dramaId if given).
+    """
+    if not isinstance(queries, list) or not queries or len(queries) > 64:
+        return _err("queries must be a list of 1..64 strings")
+    if any(not isinstance(q, str) or not q.strip() for q in queries):
+        return _err("every query must be a non-empty string")
+    if not isinstance(topK, int) or topK <= 0 or topK > 50:
+        return _err("topK must be an integer in 1..50")
+    if scene not in ("search", "recommend", "qa"):
+        return _err("scene must be one of: search, recommend, qa")
+
+    from ai_service.app.rag import Query, retrieve_items_batch
+
+    rows = [Query(question=q, scene=scene, topk=topK, mode=settings.retrieval_mode(scene), drama_id=dramaId)
+            for q in queries]
+    with metrics.track("mcp:batch_search", scene):
+        results = retrieve_items_batch(get_index_store(), rows)
+        with metrics.stage("answer"):
+            answers = [generate_answer(q, items, scene=scene, drama_id=dramaId) for q, items in zip(queries, results)]
+    return _ok({"results": [
+        {"query": q, "items": items, "answer": answer} for q, items, answer in zip(queries, results, answers)
+    ]})
+
+@srv.tool()
+def similar_dramas(dramaId: int, topK: int = 10) -> Dict[str, Any]:
+    """
+    Dramas most similar to the given one, from the neighbor graph built with the index (no search).
+    """
+    if not isinstance(dramaId, int):
+        return _err("dramaId must be an integer")
+    if not isinstance(topK, int) or topK <= 0 or topK > 50:
+        return _err("topK must be an integer in 1..50")
+
+    with metrics.track("mcp:similar_dramas", "similar"):
+        store = get_index_store()
+        if store.knn is None:
+            return _err("similar-drama graph not built for this index (build_index.py --knn-k)")
+        items = store.similar(dramaId, topK)
+    if items is None:
+        return _err(f"dramaId {dramaId} not in index")
+    return _ok({"items": items})
+
 if __name__ == "__main__":
+    if settings.mcp_metrics_port:
+        # stdio 已被 JSON-RPC 占用，指标另起一个本地 HTTP 端口
+        metrics.serve(settings.mcp_metrics_port)
     srv.run()  # stdio JSON-RPC
\ No newline at end of file
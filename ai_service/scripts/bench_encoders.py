@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Compare encoder backends (see app/encoders.py) against the fp32 sentence-transformers reference.
+- Parity: per-text cosine between each backend and fp32 on sampled chunk texts (mean / p1 / min),
+  plus top-k overlap of a brute-force search over the sample (does the drift change rankings?)
+- Speed: single-query latency percentiles (the /rag/ask path) and batch throughput (the build path)
+Usage:
+  python scripts/bench_encoders.py --index-dir index --backends st,int8,onnx --samples 512 --out bench_encoders.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from app.encoders import load_encoder  # noqa: E402
+from app.metastore import load_tables  # noqa: E402
+from app.versions import resolve_index_dir  # noqa: E402
+
+
+def sample_texts(index_dir: Path, samples: int) -> List[str]:
+    chunks, _ = load_tables(resolve_index_dir(index_dir)[0])
+    rng = np.random.default_rng(0)
+    rows = rng.choice(len(chunks), size=min(samples, len(chunks)), replace=False)
+    return [chunks.text(int(i)) for i in rows]
+
+
+def speed(encoder, texts: List[str], queries: int, batch_size: int) -> Dict:
+    encoder.encode(texts[:8], batch_size=8)  # warmup
+    lat = []
+    for t in texts[:queries]:
+        t0 = time.perf_counter()
+        encoder.encode([t], batch_size=1)
+        lat.append((time.perf_counter() - t0) * 1000.0)
+    t0 = time.perf_counter()
+    encoder.encode(texts, batch_size=batch_size)
+    sec = time.perf_counter() - t0
+    return {
+        "query_p50_ms": round(float(np.percentile(lat, 50)), 3),
+        "query_p95_ms": round(float(np.percentile(lat, 95)), 3),
+        "batch_texts_per_sec": round(len(texts) / sec, 1),
+    }
+
+
+def parity(ref: np.ndarray, emb: np.ndarray, k: int) -> Dict:
+    cos = np.sum(ref * emb, axis=1)
+    k = min(k, len(ref))
+    # 样本内互查：用各自的向量做 brute-force top-k，比较与 fp32 结果的重合度
+    top_ref = np.argsort(-(ref @ ref.T), axis=1)[:, :k]
+    top_emb = np.argsort(-(emb @ emb.T), axis=1)[:, :k]
+    overlap = np.mean([len(set(a) & set(b)) / k for a, b in zip(top_ref, top_emb)])
+    return {
+        "cosine_mean": round(float(cos.mean()), 6),
+        "cosine_p1": round(float(np.percentile(cos, 1)), 6),
+        "cosine_min": round(float(cos.min()), 6),
+        f"top{k}_overlap": round(float(overlap), 4),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Encoder backend parity + latency/throughput comparison.")
+    ap.add_argument("--index-dir", type=str, default="index", help="Sample chunk texts from this index")
+    ap.add_argument("--model-name", type=str, default=os.getenv("EMBEDDING_MODEL_NAME", "BAAI/bge-small-en-v1.5"))
+    ap.add_argument("--backends", type=str, default="st,int8,onnx")
+    ap.add_argument("--onnx-file", type=str, default=os.getenv("ENCODER_ONNX_FILE", ""))
+    ap.add_argument("--samples", type=int, default=512)
+    ap.add_argument("--queries", type=int, default=100, help="Single-text encodes for the latency percentiles")
+    ap.add_argument("--batch-size", type=int, default=64)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--out", type=str, default="")
+    args = ap.parse_args()
+
+    texts = sample_texts(Path(args.index_dir).resolve(), args.samples)
+    ref = load_encoder(args.model_name, "st").encode(texts, batch_size=args.batch_size)
+    results: Dict[str, Dict] = {}
+    for backend in [b.strip() for b in args.backends.split(",") if b.strip()]:
+        try:
+            t0 = time.perf_counter()
+            encoder = load_encoder(args.model_name, backend, args.onnx_file or None)
+            load_sec = time.perf_counter() - t0
+        except Exception as e:  # 可选依赖缺失（如 onnxruntime）时记录原因并继续
+            results[backend] = {"error": str(e)}
+            continue
+        emb = encoder.encode(texts, batch_size=args.batch_size)
+        results[backend] = {"load_sec": round(load_sec, 3), **parity(ref, emb, args.k),
+                            **speed(encoder, texts, args.queries, args.batch_size)}
+
+    report = {"model": args.model_name, "samples": len(texts), "backends": results}
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Compare vector-only, BM25-only and fused retrieval on the drama-level index.
+- Queries: drama titles sampled from the index (exact-name recall), plus an optional
+  JSONL file of {"query": ..., "dramaId": ...} labelled queries.
+- Reports recall@k (target dramaId in top-k) and per-query latency percentiles per mode.
+Usage:
+  python scripts/bench_sparse.py --index-dir index --samples 500 --k 10 --out bench_sparse.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# 基准测量原始检索开销：关闭查询缓存与微批
+os.environ.setdefault("EMBED_CACHE_SIZE", "0")
+os.environ.setdefault("EMBED_BATCH_ENABLED", "0")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from app.retriever import IndexStore  # noqa: E402
+
+MODES = ["vector", "sparse", "fused"]
+
+
+def load_queries(store: IndexStore, samples: int, queries_path: str) -> List[Tuple[str, int]]:
+    rng = np.random.default_rng(0)
+    n = len(store.drama_meta)
+    rows = rng.choice(n, size=min(samples, n), replace=False) if n else []
+    queries = [(store.drama_meta.title(int(i)), store.drama_meta.drama_id(int(i))) for i in rows]
+    if queries_path:
+        with open(queries_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    rec = json.loads(line)
+                    queries.append((rec["query"], int(rec["dramaId"])))
+    return queries
+
+
+def run_mode(store: IndexStore, queries: List[Tuple[str, int]], mode: str, k: int) -> Dict:
+    lat: List[float] = []
+    found = 0
+    for q, did in queries:
+        t = time.perf_counter()
+        hits = store.retrieve("drama", q, topk=k, mode=mode)
+        lat.append((time.perf_counter() - t) * 1000.0)
+        if any(store.drama_meta.drama_id(idx) == did for idx, _ in hits):
+            found += 1
+    return {
+        f"recall@{k}": round(found / max(len(queries), 1), 4),
+        "p50_ms": round(float(np.percentile(lat, 50)), 3),
+        "p95_ms": round(float(np.percentile(lat, 95)), 3),
+        "p99_ms": round(float(np.percentile(lat, 99)), 3),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark vector vs BM25 vs fused retrieval.")
+    ap.add_argument("--index-dir", type=str, default="index")
+    ap.add_argument("--model-name", type=str, default=os.getenv("EMBEDDING_MODEL_NAME", "BAAI/bge-small-en-v1.5"))
+    ap.add_argument("--samples", type=int, default=500, help="Title queries sampled from the catalog")
+    ap.add_argument("--queries", type=str, default="", help="Optional JSONL of labelled queries")
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--out", type=str, default="", help="Write results JSON here")
+    args = ap.parse_args()
+
+    store = IndexStore(Path(args.index_dir).resolve(), args.model_name)
+    if store.bm25.get("drama") is None:
+        raise SystemExit("No BM25 postings in the index dir; rebuild with scripts/build_index.py")
+    queries = load_queries(store, args.samples, args.queries)
+    store.retrieve("drama", "warmup", topk=args.k, mode="fused")
+
+    results = {m: run_mode(store, queries, m, args.k) for m in MODES}
+    report = {"indexDir": str(store.index_dir), "queries": len(queries), "k": args.k, "modes": results}
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
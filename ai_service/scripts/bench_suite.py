@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+"""
+Offline retrieval benchmark + load-test suite. Uses the deterministic `hash` encoder backend
+(app/encoders.py), so it runs without network access or model downloads.
+For each catalog size:
+1. generate a synthetic drama CSV of ~N chunks (seeded Zipf vocabulary, genre words, categories)
+2. build it with `build_index.py --source csv` (wall time + peak RSS of the build process)
+3. in-process single-query latency percentiles with caches off: IndexStore.search (chunk vector),
+   drama_level_hybrid for search / recommend, and the QA in-drama path
+4. HTTP load against /rag/ask on a local uvicorn: closed loop (C clients back to back) and
+   open loop (Poisson arrivals at R req/s; latency counted from the scheduled send time)
+Results go to JSON; --compare reports regressions against an earlier run (exit code 1).
+Usage:
+  python scripts/bench_suite.py --sizes 1000,10000,100000 --out bench/run.json
+  python scripts/bench_suite.py --sizes 1000000 --index-type ivf-pq --skip-http --out bench/1m.json
+  python scripts/bench_suite.py --sizes 10000 --compare bench/baseline.json --tolerance 0.15
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# 单查询延迟要测完整路径：在导入 app.* 之前关闭查询缓存与微批
+os.environ.setdefault("ENCODER_BACKEND", "hash")
+os.environ["EMBED_CACHE_SIZE"] = "0"
+os.environ["EMBED_BATCH_ENABLED"] = "0"
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+from app.config import settings  # noqa: E402
+from app.encoders import load_encoder  # noqa: E402
+from app.rag import Query, retrieve_items  # noqa: E402
+from app.retriever import IndexStore  # noqa: E402
+from app.versions import resolve_index_dir  # noqa: E402
+
+GENRE_WORDS = (
+    "love revenge ceo marriage contract divorce betrayal family secret rich poor palace empire "
+    "emperor princess general detective murder ghost school campus doctor lawyer funny comedy "
+    "time travel rebirth system villain heiress bodyguard twins amnesia pregnant wedding mafia "
+    "werewolf vampire alpha luna war rival sweet cold warrior sister brother mother daughter"
+).split()
+CATEGORIES = ["Romance", "Comedy", "Mystery", "Urban", "Costume", "Youth", "Fantasy", "Thriller"]
+CHARS_PER_CHUNK = 340  # build_index 默认 chunk_size=400 / overlap=60
+SCENES = ("vector_search", "search", "recommend", "qa")
+
+
+# -----------------------------
+# Synthetic catalog
+# -----------------------------
+
+def _vocabulary(rng: np.random.Generator, size: int) -> Tuple[np.ndarray, np.ndarray]:
+    letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    fillers = {"".join(rng.choice(letters, size=rng.integers(4, 9))) for _ in range(size)}
+    vocab = np.array(GENRE_WORDS + sorted(fillers - set(GENRE_WORDS)))
+    p = 1.0 / np.arange(1, len(vocab) + 1) ** 1.05  # Zipf：少数高频词 + 长尾
+    return vocab, p / p.sum()
+
+
+def write_catalog(path: Path, n_chunks: int, chunks_per_drama: int, seed: int) -> Dict:
+    rng = np.random.default_rng(seed)
+    vocab, p = _vocabulary(rng, 4000)
+    n_dramas = max(n_chunks // chunks_per_drama, 1)
+    words_per_drama = chunks_per_drama * CHARS_PER_CHUNK // 7  # 平均词长 ~6 + 空格
+    block = 10_000
+    path.parent.mkdir(parents=True, exist_ok=True)
+    for start in range(0, n_dramas, block):
+        n = min(block, n_dramas - start)
+        words = rng.choice(vocab, size=(n, words_per_drama), p=p)
+        genre = rng.choice(GENRE_WORDS, size=(n, 2))
+        df = pd.DataFrame({
+            "id": np.arange(start + 1, start + n + 1),
+            "title": [f"{a.title()} {b.title()} {start + i + 1}" for i, (a, b) in enumerate(genre)],
+            "description": [". ".join(" ".join(row[j:j + 12]) for j in range(0, len(row), 12)) + "." for row in words],
+            "category": rng.choice(CATEGORIES, size=n),
+        })
+        df.to_csv(path, mode="w" if start == 0 else "a", header=start == 0, index=False)
+    return {"dramas": n_dramas, "csv": str(path), "mb": round(path.stat().st_size / 2 ** 20, 2)}
+
+
+def make_queries(n: int, n_dramas: int, seed: int) -> List[Tuple[str, int]]:
+    rng = np.random.default_rng(seed + 1)
+    out = []
+    for _ in range(n):
+        words = rng.choice(GENRE_WORDS, size=int(rng.integers(2, 5)), replace=False)
+        out.append((" ".join(words), int(rng.integers(1, n_dramas + 1))))
+    return out
+
+
+# -----------------------------
+# Build
+# -----------------------------
+
+def run_build(csv_path: Path, out_dir: Path, args) -> Dict:
+    cmd = [sys.executable, str(ROOT / "scripts" / "build_index.py"), "--source", "csv",
+           "--csv-path", str(csv_path), "--out-dir", str(out_dir), "--encoder-backend", "hash",
+           "--index-type", args.index_type, "--no-embed-cache", "--workers", str(args.build_workers)]
+    if args.stream:
+        cmd.append("--stream")
+    # stderr 写临时文件而不是管道：大规模构建的 tqdm / 警告输出会写满 64 KB 管道，子进程阻塞、wait4 永不返回
+    with tempfile.TemporaryFile() as err_file:
+        t0 = time.perf_counter()
+        proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=err_file, cwd=str(ROOT))
+        # wait4 给出该子进程自身的资源占用（ru_maxrss 为 KB）
+        _, status, usage = os.wait4(proc.pid, 0)
+        sec = time.perf_counter() - t0
+        if os.waitstatus_to_exitcode(status) != 0:
+            err_file.seek(0)
+            err = err_file.read().decode("utf-8", "replace")
+            raise RuntimeError(f"build failed:\n{err[-2000:]}")
+    with (out_dir / "stats.json").open("r", encoding="utf-8") as f:
+        stats = json.load(f)
+    return {
+        "sec": round(sec, 2),
+        "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),
+        "chunks": stats.get("chunks"),
+        "dramas": stats.get("rows"),
+        "index_type": stats.get("index_type"),
+        "index_mb": round(sum(f.stat().st_size for f in out_dir.iterdir() if f.is_file()) / 2 ** 20, 1),
+    }
+
+
+# -----------------------------
+# In-process latency
+# -----------------------------
+
+def pct(ms: List[float]) -> Dict:
+    a = np.asarray(ms, dtype="float64")
+    if not len(a):
+        return {"n": 0}
+    return {"n": int(len(a)), "mean_ms": round(float(a.mean()), 3),
+            **{f"p{q}_ms": round(float(np.percentile(a, q)), 3) for q in (50, 95, 99)}}
+
+
+def measure_latency(index_dir: Path, queries: List[Tuple[str, int]], topk: int) -> Dict:
+    store = IndexStore(resolve_index_dir(index_dir)[0], settings.embedding_model_name,
+                       model=load_encoder(settings.embedding_model_name, "hash"))
+    calls = {
+        "vector_search": lambda q, d: store.search(q, topk=topk),
+        "search": lambda q, d: retrieve_items(store, Query(q, "search", topk, settings.retrieval_mode("search"))),
+        "recommend": lambda q, d: retrieve_items(store, Query(q, "recommend", topk, settings.retrieval_mode("recommend"))),
+        "qa": lambda q, d: retrieve_items(store, Query(q, "qa", topk, settings.retrieval_mode("qa"), drama_id=d)),
+    }
+    out = {}
+    for scene, fn in calls.items():
+        for q, d in queries[:20]:  # warmup
+            fn(q, d)
+        ms = []
+        for q, d in queries:
+            t0 = time.perf_counter()
+            fn(q, d)
+            ms.append((time.perf_counter() - t0) * 1000.0)
+        out[scene] = pct(ms)
+    store.close()
+    return out
+
+
+# -----------------------------
+# HTTP load
+# -----------------------------
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(index_dir: Path, args) -> Tuple[subprocess.Popen, str]:
+    port = _free_port()
+    env = dict(os.environ, AI_INDEX_DIR=str(index_dir), ENCODER_BACKEND="hash",
+               EMBED_CACHE_SIZE=os.getenv("BENCH_EMBED_CACHE_SIZE", "0"),
+               EMBED_BATCH_ENABLED="1", SEMANTIC_CACHE_SIZE="0", PYTHONPATH=str(ROOT.parent))
+    cmd = [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+           "--log-level", "warning", "--workers", str(args.http_workers)]
+    proc = subprocess.Popen(cmd, cwd=str(ROOT), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    base = f"http://127.0.0.1:{port}"
+    import httpx
+
+    deadline = time.time() + 300
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited:\n{proc.stderr.read().decode('utf-8', 'replace')[-2000:]}")
+        try:
+            if httpx.get(f"{base}/readyz", timeout=1.0).status_code == 200:
+                return proc, base
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("server did not become ready")
+
+
+def _server_peak_rss_mb(pid: int) -> Optional[float]:
+    try:
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+    return None
+
+
+def _body(queries: List[Tuple[str, int]], i: int) -> Dict:
+    q, d = queries[i % len(queries)]
+    scene = ("search", "recommend", "qa")[i % 3]
+    return {"question": q, "topK": 6, "scene": scene, **({"dramaId": d} if scene == "qa" else {})}
+
+
+def _summary(lat: List[float], statuses: Dict[int, int], sec: float) -> Dict:
+    ok = statuses.get(200, 0)
+    return {"completed": sum(statuses.values()), "ok": ok, "status": {str(k): v for k, v in sorted(statuses.items())},
+            "rps": round(ok / sec, 1), **pct(lat)}
+
+
+async def closed_loop(base: str, queries, concurrency: int, duration: float) -> Dict:
+    import httpx
+
+    lat: List[float] = []
+    statuses: Dict[int, int] = {}
+    counter = iter(range(10 ** 9))
+    end = time.perf_counter() + duration
+    async with httpx.AsyncClient(base_url=base, timeout=30.0,
+                                 limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def worker():
+            while time.perf_counter() < end:
+                t0 = time.perf_counter()
+                try:
+                    r = await client.post("/rag/ask", json=_body(queries, next(counter)))
+                    code = r.status_code
+                except httpx.HTTPError:
+                    code = 0
+                statuses[code] = statuses.get(code, 0) + 1
+                if code == 200:
+                    lat.append((time.perf_counter() - t0) * 1000.0)
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        sec = time.perf_counter() - t0
+    return {"concurrency": concurrency, "duration_sec": round(sec, 2), **_summary(lat, statuses, sec)}
+
+
+async def open_loop(base: str, queries, rate: float, duration: float, seed: int) -> Dict:
+    import httpx
+
+    rng = np.random.default_rng(seed)
+    arrivals = np.cumsum(rng.exponential(1.0 / rate, size=int(rate * duration * 1.5) + 1))
+    arrivals = arrivals[arrivals < duration]
+    lat: List[float] = []
+    statuses: Dict[int, int] = {}
+    async with httpx.AsyncClient(base_url=base, timeout=30.0,
+                                 limits=httpx.Limits(max_connections=512)) as client:
+        start = time.perf_counter()
+
+        async def fire(i: int, at: float):
+            await asyncio.sleep(max(0.0, start + at - time.perf_counter()))
+            try:
+                r = await client.post("/rag/ask", json=_body(queries, i))
+                code = r.status_code
+            except httpx.HTTPError:
+                code = 0
+            statuses[code] = statuses.get(code, 0) + 1
+            if code == 200:
+                # 从计划发送时刻计时，避免 coordinated omission 低估排队延迟
+                lat.append((time.perf_counter() - (start + at)) * 1000.0)
+
+        await asyncio.gather(*[fire(i, float(at)) for i, at in enumerate(arrivals)])
+        sec = time.perf_counter() - start
+    return {"target_rps": rate, "sent": int(len(arrivals)), "duration_sec": round(sec, 2),
+            **_summary(lat, statuses, sec)}
+
+
+def measure_http(index_dir: Path, queries, args) -> Dict:
+    proc, base = start_server(index_dir, args)
+    try:
+        out = {"closed": [], "open": []}
+        for c in args.concurrency:
+            out["closed"].append(asyncio.run(closed_loop(base, queries, c, args.duration)))
+        for rate in args.rates:
+            out["open"].append(asyncio.run(open_loop(base, queries, rate, args.duration, args.seed)))
+        out["server_peak_rss_mb"] = _server_peak_rss_mb(proc.pid) if args.http_workers == 1 else None
+        return out
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+# -----------------------------
+# Regression compare
+# -----------------------------
+
+def _metrics(run: Dict) -> Dict[str, Tuple[float, bool]]:
+    """Flatten one size entry -> {name: (value, higher_is_better)}."""
+    out: Dict[str, Tuple[float, bool]] = {}
+    build = run.get("build") or {}
+    for k in ("sec", "peak_rss_mb"):
+        if build.get(k) is not None:
+            out[f"build.{k}"] = (build[k], False)
+    for scene, lat in (run.get("latency") or {}).items():
+        for k in ("p50_ms", "p95_ms"):
+            if k in lat:
+                out[f"latency.{scene}.{k}"] = (lat[k], False)
+    http = run.get("http") or {}
+    for row in http.get("closed", []):
+        out[f"http.closed.c{row['concurrency']}.rps"] = (row["rps"], True)
+        if "p95_ms" in row:
+            out[f"http.closed.c{row['concurrency']}.p95_ms"] = (row["p95_ms"], False)
+    for row in http.get("open", []):
+        if "p95_ms" in row:
+            out[f"http.open.r{row['target_rps']:g}.p95_ms"] = (row["p95_ms"], False)
+    return out
+
+
+def compare(baseline: Dict, current: Dict, tolerance: float) -> List[Dict]:
+    base_runs = {r["target_chunks"]: r for r in baseline.get("runs", [])}
+    regressions = []
+    for run in current.get("runs", []):
+        base = base_runs.get(run["target_chunks"])
+        if base is None:
+            continue
+        old, new = _metrics(base), _metrics(run)
+        for name, (value, higher_better) in new.items():
+            if name not in old or not old[name][0]:
+                continue
+            ratio = value / old[name][0]
+            worse = ratio < 1 - tolerance if higher_better else ratio > 1 + tolerance
+            if worse:
+                regressions.append({"chunks": run["target_chunks"], "metric": name,
+                                    "baseline": old[name][0], "current": value, "ratio": round(ratio, 3)})
+    return regressions
+
+
+def _git_rev() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=str(ROOT),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Synthetic-catalog build / latency / HTTP load benchmark.")
+    ap.add_argument("--sizes", type=str, default="1000,10000", help="Target chunk counts, comma separated")
+    ap.add_argument("--work-dir", type=str, default="bench_work", help="Catalog CSVs and built indexes")
+    ap.add_argument("--chunks-per-drama", type=int, default=4)
+    ap.add_argument("--index-type", type=str, default="flat", help="Passed to build_index.py --index-type")
+    ap.add_argument("--stream", action="store_true", help="Build with --stream")
+    ap.add_argument("--build-workers", type=int, default=1)
+    ap.add_argument("--queries", type=int, default=500, help="Single-query latency samples per scene")
+    ap.add_argument("--topk", type=int, default=6)
+    ap.add_argument("--skip-http", action="store_true")
+    ap.add_argument("--concurrency", type=str, default="1,8,32", help="Closed-loop client counts")
+    ap.add_argument("--rates", type=str, default="50,200", help="Open-loop arrival rates (req/s)")
+    ap.add_argument("--duration", type=float, default=10.0, help="Seconds per HTTP load step")
+    ap.add_argument("--http-workers", type=int, default=1, help="uvicorn --workers")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--out", type=str, default="", help="Write the JSON report here")
+    ap.add_argument("--compare", type=str, default="", help="Baseline JSON report to check for regressions")
+    ap.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative slowdown before flagging")
+    args = ap.parse_args()
+    args.concurrency = [int(x) for x in args.concurrency.split(",") if x.strip()]
+    args.rates = [float(x) for x in args.rates.split(",") if x.strip()]
+
+    work = Path(args.work_dir).resolve()
+    report = {
+        "meta": {"git": _git_rev(), "python": platform.python_version(), "cpus": os.cpu_count(),
+                 "platform": platform.platform(), "encoder": "hash", "at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                 "args": {k: v for k, v in vars(args).items() if k not in ("out", "compare")}},
+        "runs": [],
+    }
+    for size in [int(x) for x in args.sizes.split(",") if x.strip()]:
+        print(f"[Bench] {size} chunks")
+        csv_path = work / f"catalog_{size}.csv"
+        catalog = write_catalog(csv_path, size, args.chunks_per_drama, args.seed)
+        index_dir = work / f"index_{size}_{args.index_type}"
+        run = {"target_chunks": size, "catalog": catalog, "build": run_build(csv_path, index_dir, args)}
+        print(f"  build: {run['build']}")
+        queries = make_queries(args.queries, catalog["dramas"], args.seed)
+        run["latency"] = measure_latency(index_dir, queries, args.topk)
+        print(f"  latency: " + ", ".join(f"{k} p50={v['p50_ms']}ms p95={v['p95_ms']}ms" for k, v in run["latency"].items()))
+        if not args.skip_http:
+            run["http"] = measure_http(index_dir, queries, args)
+            print("  http: " + ", ".join(f"c{r['concurrency']}={r['rps']}rps" for r in run["http"]["closed"]))
+        report["runs"].append(run)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            report["regressions"] = compare(json.load(f), report, args.tolerance)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.out:
+        Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if report.get("regressions"):
+        print(f"[Bench] {len(report['regressions'])} regression(s) beyond {args.tolerance:.0%}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
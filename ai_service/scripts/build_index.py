@@ -4,26 +4,47 @@ Build FAISS index for drama semantic search (English-first).
 - Source: MySQL (via env) or CSV
 - Text fields: title + description (extendable)
 - Model: BAAI/bge-small-en-v1.5 (local, fast, English)
-- Index: FAISS IndexFlatIP with normalized embeddings (cosine similarity)
+- Index: FAISS inner product on normalized embeddings (cosine similarity);
+  --index-type selects flat (exact), hnsw, ivf-flat, ivf-pq or sq (scalar-quantized flat)
 Outputs:
-- <out_dir>/faiss.index
-- <out_dir>/metadata.jsonl
-- <out_dir>/stats.json
+- <out_dir>/faiss.index, <out_dir>/drama.faiss
+- columnar metadata (strings.json/.bin, chunk_*.npy, chunk_text.bin, drama_*.npy; see app/metastore.py)
+- <out_dir>/metadata.jsonl, drama_meta.jsonl (only with --export-jsonl)
+- <out_dir>/{chunk,drama}_bm25_*.{json,npy} (BM25 inverted index, see app/sparse.py)
+- <out_dir>/drama_chunks.json (dramaId -> [start, end) chunk metadata row range)
+- <out_dir>/drama_knn_{ids,scores}.npy ("more like this" neighbors per drama, --knn-k; see app/knn.py)
+- <out_dir>/tfidf.joblib (fitted tag vectorizer, reused by --incremental)
+- <out_dir>/stats.json, <out_dir>/sync_state.json (updateTime watermark + digests of the rows at it, mysql only)
+- <out_dir>/manifest.json (build id, checksum, model, dim; see app/versions.py)
+- <out_dir>/embed_cache/ (content-addressed embedding cache shared across builds; see app/embcache.py)
+With --versioned, <out_dir> is a root: the build goes to <out_dir>/versions/<build_id>/ and
+<out_dir>/CURRENT is switched to it once complete, so a running service can hot-reload.
+Both indexes are ID-mapped with stable ids (dramaId / dramaId*CHUNK_ID_STRIDE+chunk) so
+--incremental can upsert changed dramas and remove_ids offline / deleted ones.
+With --shards N, rows are partitioned by dramaId % N and each shard is a complete index root
+<out_dir>/shard-XX/ (all of the above, also with --versioned / --incremental / --stream);
+<out_dir>/shards.json records the split. --shard-index builds one shard only (one per machine).
 """
 
 import argparse
+import hashlib
 import json
 import math
 import os
 import re
+import shutil
+import sys
 import time
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterator, List, Optional, Tuple
 
+import joblib
 import numpy as np
 import pandas as pd
 from sklearn.feature_extraction.text import TfidfVectorizer
+from threadpoolctl import threadpool_limits
 from tqdm import tqdm
 
 try:
@@ -32,7 +53,18 @@ except Exception as e:
     raise RuntimeError("FAISS is required. Please install faiss-cpu.") from e
 
 from dotenv import load_dotenv
-from sentence_transformers import SentenceTransformer
+
+# 复用在线服务的元数据格式定义（ai_service/app）
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from app.metastore import CHUNK_ID_STRIDE, MetaWriter, chunk_vector_id, load_tables, splice_tables  # noqa: E402
+from app.knn import KnnGraph, build_knn, update_knn, write_knn  # noqa: E402
+from app.embcache import DiskEmbeddingCache  # noqa: E402
+from app.encoders import ENCODER_BACKENDS, Encoder, load_encoder  # noqa: E402
+from app.sparse import can_merge_bm25, merge_bm25, write_bm25  # noqa: E402
+from app.versions import (  # noqa: E402
+    MANIFEST_FILE, active_build_id, new_build_id, prune_versions, publish_version, resolve_index_dir, shard_dir,
+    shard_of, version_dir, write_manifest, write_shard_map,
+)
 
 # -----------------------------
 # Utilities
@@ -93,23 +125,34 @@ def chunk_by_sentences(text: str, max_chars: int, overlap_chars: int) -> List[st
 
     return chunks
 
+# normalized column -> accepted source column names (first present wins)
+COLUMN_ALIASES: Dict[str, List[str]] = {
+    "id": ["id", "ID", "dramaId", "drama_id"],
+    "title": ["title", "name", "Title"],
+    "description": ["description", "desc", "synopsis", "overview"],
+    "category": ["category", "tags", "genre", "Category"],
+}
+STATE_COLUMNS = ["status", "isDelete", "updateTime"]
+
 def pick_first_present(cols: List[str], candidates: List[str]) -> Optional[str]:
     for c in candidates:
         if c in cols:
             return c
     return None
 
-def normalize_dataframe(df_raw: pd.DataFrame) -> pd.DataFrame:
+def normalize_dataframe(df_raw: pd.DataFrame, live_only: bool = False) -> pd.DataFrame:
     """
     Map source columns to normalized schema: id, title, description, category
     Accept both camelCase and snake_case variants; fallback if missing.
+    live_only: drop offline / soft-deleted rows (status / isDelete); MySQL sources only, since
+    --incremental removes those dramas and a full build has to agree with it.
     """
     cols = df_raw.columns.tolist()
 
-    id_col = pick_first_present(cols, ["id", "ID", "dramaId", "drama_id"])
-    title_col = pick_first_present(cols, ["title", "name", "Title"])
-    desc_col = pick_first_present(cols, ["description", "desc", "synopsis", "overview"])
-    cat_col = pick_first_present(cols, ["category", "tags", "genre", "Category"])
+    id_col = pick_first_present(cols, COLUMN_ALIASES["id"])
+    title_col = pick_first_present(cols, COLUMN_ALIASES["title"])
+    desc_col = pick_first_present(cols, COLUMN_ALIASES["description"])
+    cat_col = pick_first_present(cols, COLUMN_ALIASES["category"])
 
     if not id_col or not title_col:
         raise ValueError(f"Required columns not found. Have: {cols}. Need at least id/title.")
@@ -121,14 +164,30 @@ def normalize_dataframe(df_raw: pd.DataFrame) -> pd.DataFrame:
         "category": df_raw[cat_col] if cat_col in df_raw else "",
     })
 
-    # Ensure types and cleaning
-    df["id"] = df["id"]
+    if live_only:
+        # 下线 / 逻辑删除的剧不进入索引（与 --incremental 的 remove_ids 一致）
+        live = pd.Series(True, index=df_raw.index)
+        if "status" in df_raw:
+            live &= df_raw["status"].fillna(1).astype(int) == 1
+        if "isDelete" in df_raw:
+            live &= df_raw["isDelete"].fillna(0).astype(int) == 0
+        df = df[live.values]
+    if "updateTime" in df_raw and len(df_raw):
+        # 水位线取所有读到的行（含下线/删除），供 --incremental 使用
+        df.attrs["watermark"] = pd.to_datetime(df_raw["updateTime"]).max()
+        df.attrs["watermark_rows"] = boundary_rows(df_raw)
+
+    # Ensure types and cleaning (ids must be integers: they are the FAISS ids)
+    ids = pd.to_numeric(df["id"], errors="coerce")
+    if ids.isna().any():
+        raise ValueError("id column must be integer (used as stable FAISS id)")
+    df["id"] = ids.astype("int64")
     for col in ["title", "description", "category"]:
         df[col] = df[col].astype(str).map(clean_text)
 
-    # Drop empty titles
-    df = df[df["title"].map(lambda x: len(x) > 0)]
-    df = df.reset_index(drop=True)
+    # Drop empty titles; rows sorted by id so metadata rows follow FAISS id order
+    df = df[df["title"].str.len() > 0]
+    df = df.sort_values("id", kind="stable").reset_index(drop=True)
     return df
 
 # -----------------------------
@@ -153,7 +212,70 @@ def load_from_mysql(table: str, limit: Optional[int] = None) -> pd.DataFrame:
         if limit and limit > 0:
             sql += f" LIMIT {int(limit)}"
         df_raw = pd.read_sql(text(sql), conn)
-    return normalize_dataframe(df_raw)
+    return normalize_dataframe(df_raw, live_only=True)
+
+def row_digests(df_raw: pd.DataFrame) -> Dict[str, str]:
+    """id -> digest of the columns an index build reads (title/description/category/status/isDelete)."""
+    cols = df_raw.columns.tolist()
+    picked = [pick_first_present(cols, names) for names in COLUMN_ALIASES.values()]
+    picked = [c for c in picked + ["status", "isDelete"] if c and c in cols]
+    out: Dict[str, str] = {}
+    for row in df_raw[picked].itertuples(index=False):
+        key = json.dumps([None if pd.isna(v) else str(v) for v in row], ensure_ascii=False)
+        out[str(row[0])] = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    return out
+
+def boundary_rows(df_raw: pd.DataFrame) -> Dict[str, str]:
+    """Digests of the rows in the newest updateTime second: the rows the next sync's >= reads again."""
+    t = pd.to_datetime(df_raw["updateTime"]).dt.floor("s")
+    return row_digests(df_raw[(t == t.max()).values])
+
+def load_changed_from_mysql(table: str, watermark: str, applied: Optional[Dict[str, str]] = None
+                            ) -> Tuple[pd.DataFrame, List[int], Optional[pd.Timestamp], Dict[str, str]]:
+    """
+    Rows with updateTime >= watermark. The watermark only has second precision, so the boundary
+    second is read again (a row committed in it after the last sync must not be lost); boundary
+    rows whose digest matches `applied` (sync_state.json) were already indexed and are dropped.
+    Returns (live rows normalized, all changed ids, new watermark, digests of the new boundary rows).
+    """
+    load_dotenv(override=True)
+    host = os.getenv("DB_HOST", "127.0.0.1")
+    port = int(os.getenv("DB_PORT", "3306"))
+    user = os.getenv("DB_USER", "root")
+    password = os.getenv("DB_PASSWORD", "")
+    db = os.getenv("DB_NAME", "short_drama")
+
+    from sqlalchemy import create_engine, text  # lazy import
+    uri = f"mysql+pymysql://{user}:{password}@{host}:{port}/{db}?charset=utf8mb4"
+    engine = create_engine(uri)
+    with engine.connect() as conn:
+        sql = (f"SELECT id, title, description, category, status, isDelete, updateTime FROM {table} "
+               f"WHERE updateTime >= :wm ORDER BY updateTime, id")
+        df_raw = pd.read_sql(text(sql), conn, params={"wm": watermark})
+    if df_raw.empty:
+        return df_raw, [], None, {}
+    new_wm = pd.to_datetime(df_raw["updateTime"]).max()
+    new_rows = boundary_rows(df_raw)
+    if applied:
+        at_wm = (pd.to_datetime(df_raw["updateTime"]).dt.floor("s") == pd.Timestamp(watermark)).values
+        digests = row_digests(df_raw[at_wm])
+        seen = df_raw["id"].astype(str).map(lambda i: i in digests and applied.get(i) == digests[i]).values
+        df_raw = df_raw[~(at_wm & seen)]
+    changed = [int(x) for x in df_raw["id"].tolist()]
+    return normalize_dataframe(df_raw, live_only=True), changed, new_wm, new_rows
+
+def select_shard(df: pd.DataFrame, args: argparse.Namespace) -> pd.DataFrame:
+    """Rows owned by this shard (dramaId % --shards == --shard-index); unsharded builds keep all."""
+    if args.shards <= 1 or df.empty:
+        return df
+    keep = df["id"].map(lambda i: shard_of(i, args.shards) == args.shard_index)
+    out = df[keep.values].reset_index(drop=True)
+    out.attrs.update(df.attrs)  # watermark 等
+    return out
+
+def shard_partition(args: argparse.Namespace) -> Dict:
+    """Recorded in manifest.json so a shard node can report which slice it serves."""
+    return {"shard": args.shard_index, "shards": args.shards} if args.shards > 1 else {}
 
 def load_from_csv(csv_path: Path, limit: Optional[int] = None) -> pd.DataFrame:
     df_raw = pd.read_csv(csv_path)
@@ -184,10 +306,14 @@ def build_corpus(df: pd.DataFrame, min_chunk_chars: int, chunk_size: int, chunk_
         if not chunks:
             # fallback: at least use title
             chunks = [title]
+        if len(chunks) > CHUNK_ID_STRIDE:
+            # 段落向量 id = dramaId * CHUNK_ID_STRIDE + 序号，超出会与下一部剧的 id 冲突
+            raise ValueError(f"dramaId={did} has {len(chunks)} chunks, more than the {CHUNK_ID_STRIDE} a drama "
+                             f"can hold in the chunk id space; raise --chunk-size")
 
         for idx, c in enumerate(chunks):
             corpus.append({
-                "dramaId": int(did) if str(did).isdigit() else str(did),
+                "dramaId": int(did),
                 "title": title,
                 "category": category,
                 "chunk": c,
@@ -196,15 +322,300 @@ def build_corpus(df: pd.DataFrame, min_chunk_chars: int, chunk_size: int, chunk_
             })
     return corpus
 
-def embed_texts(model: SentenceTransformer, texts: List[str], batch_size: int, normalize: bool = True) -> np.ndarray:
-    emb = model.encode(
-        texts,
-        batch_size=batch_size,
-        show_progress_bar=True,
-        convert_to_numpy=True,
-        normalize_embeddings=normalize,
-    )
-    return emb.astype("float32")
+def embed_texts(model: Encoder, texts: List[str], batch_size: int, normalize: bool = True,
+                cache: Optional[DiskEmbeddingCache] = None, progress: bool = True) -> np.ndarray:
+    def encode(batch: List[str]) -> np.ndarray:
+        emb = model.encode(
+            batch,
+            batch_size=batch_size,
+            show_progress_bar=progress,
+            convert_to_numpy=True,
+            normalize_embeddings=normalize,
+        )
+        return emb.astype("float32")
+    # 命中磁盘缓存的文本不再重新编码（缓存按 model + normalize 分命名空间）
+    return cache.embed(texts, encode) if cache is not None else encode(texts)
+
+def open_embed_cache(args: argparse.Namespace, root: Path, model_key: str) -> Optional[DiskEmbeddingCache]:
+    """`model_key` identifies the vector space (model + encoder backend), see Encoder.key."""
+    if args.no_embed_cache:
+        return None
+    cache_dir = Path(args.embed_cache_dir).resolve() if args.embed_cache_dir else root / "embed_cache"
+    return DiskEmbeddingCache(cache_dir, model_key, normalize=True)
+
+def report_embed_cache(cache: Optional[DiskEmbeddingCache]) -> Optional[Dict]:
+    if cache is None:
+        return None
+    report = cache.report()
+    print(f"[EmbedCache] hit-rate {report['hitRate']:.1%} ({report['hits']} hits / {report['misses']} misses), "
+          f"encoded in {report['encodeSec']:.2f}s, saved ~{report['secSaved']:.2f}s")
+    return report
+
+# -----------------------------
+# Worker pool (--workers N)
+# -----------------------------
+
+_WORKER_MODEL: Optional[Encoder] = None
+
+def _init_worker(model_name: str, backend: str, onnx_file: str, torch_threads: int) -> None:
+    """
+    Per-process setup: cap intra-op threads, then load this worker's model replica.
+    The spawned worker imports this module (numpy, faiss) before running the initializer, so
+    OMP_NUM_THREADS & co. would be read too late; each pool is resized through its own API.
+    """
+    global _WORKER_MODEL
+    try:
+        import torch  # type: ignore
+        torch.set_num_threads(torch_threads)
+    except ImportError:
+        pass
+    faiss.omp_set_num_threads(torch_threads)
+    threadpool_limits(limits=torch_threads)  # numpy 的 BLAS（OpenBLAS / MKL）
+    if model_name:
+        _WORKER_MODEL = load_encoder(model_name, backend, onnx_file or None)
+
+def _chunk_shard(task: Tuple[pd.DataFrame, int, int, int]) -> Tuple[List[Dict], int, float]:
+    df, min_chunk_chars, chunk_size, chunk_overlap = task
+    t = time.perf_counter()
+    corpus = build_corpus(df, min_chunk_chars, chunk_size, chunk_overlap)
+    return corpus, os.getpid(), time.perf_counter() - t
+
+def _encode_shard(task: Tuple[List[str], int, bool]) -> Tuple[np.ndarray, int, float]:
+    texts, batch_size, normalize = task
+    t = time.perf_counter()
+    emb = _WORKER_MODEL.encode(texts, batch_size=batch_size, show_progress_bar=False,
+                               convert_to_numpy=True, normalize_embeddings=normalize)
+    return emb.astype("float32"), os.getpid(), time.perf_counter() - t
+
+class WorkerPool:
+    """
+    Process pool with one model replica per worker. Exposes `encode` with the
+    Encoder signature, so it drops in wherever a model is passed.
+    Inputs are split into contiguous shards and results are reassembled in submission
+    order (imap), so vector / metadata order is identical to a single-process build.
+    """
+    def __init__(self, model_name: str, workers: int, torch_threads: int = 0,
+                 backend: str = "st", onnx_file: str = ""):
+        import multiprocessing as mp
+        self.model_name = model_name
+        self.backend = backend
+        self.variant = onnx_file if backend == "onnx" else ""
+        self.key = Encoder(model_name, backend, None, self.variant).key
+        self.workers = workers
+        self.torch_threads = torch_threads or max(1, (os.cpu_count() or 1) // workers)
+        # spawn: 父进程已初始化 torch 线程池，fork 后可能死锁
+        self._pool = mp.get_context("spawn").Pool(
+            workers, initializer=_init_worker, initargs=(model_name, backend, onnx_file, self.torch_threads))
+        self._stats: Dict[str, Dict[int, List[float]]] = {"chunk": {}, "embed": {}}
+
+    def _shards(self, n: int) -> List[Tuple[int, int]]:
+        # 每个 worker 约 4 个分片，兼顾负载均衡与 IPC 开销
+        size = max(1, math.ceil(n / (self.workers * 4)))
+        return [(i, min(i + size, n)) for i in range(0, n, size)]
+
+    def _record(self, stage: str, pid: int, items: int, sec: float) -> None:
+        st = self._stats[stage].setdefault(pid, [0, 0.0])
+        st[0] += items
+        st[1] += sec
+
+    def encode(self, texts: List[str], batch_size: int = 32, show_progress_bar: bool = False,
+               convert_to_numpy: bool = True, normalize_embeddings: bool = True) -> np.ndarray:
+        shards = self._shards(len(texts))
+        tasks = [(texts[a:b], batch_size, normalize_embeddings) for a, b in shards]
+        out = []
+        for (a, b), (emb, pid, sec) in tqdm(zip(shards, self._pool.imap(_encode_shard, tasks)),
+                                            total=len(tasks), disable=not show_progress_bar, desc="Encode"):
+            self._record("embed", pid, b - a, sec)
+            out.append(emb)
+        return np.concatenate(out) if out else np.zeros((0, 0), dtype="float32")
+
+    def chunk(self, df: pd.DataFrame, min_chunk_chars: int, chunk_size: int, chunk_overlap: int) -> List[Dict]:
+        tasks = [(df.iloc[a:b], min_chunk_chars, chunk_size, chunk_overlap) for a, b in self._shards(len(df))]
+        corpus: List[Dict] = []
+        for task, (part, pid, sec) in zip(tasks, self._pool.imap(_chunk_shard, tasks)):
+            self._record("chunk", pid, len(task[0]), sec)
+            corpus.extend(part)
+        return corpus
+
+    def report(self) -> Dict:
+        def per_worker(stage: str) -> List[Dict]:
+            return [{"worker": i, "pid": pid, "items": int(n), "sec": round(sec, 3),
+                     "perSec": round(n / sec, 1) if sec > 0 else 0.0}
+                    for i, (pid, (n, sec)) in enumerate(sorted(self._stats[stage].items()))]
+        return {"workers": self.workers, "torch_threads": self.torch_threads,
+                "chunk": per_worker("chunk"), "embed": per_worker("embed")}
+
+    def close(self) -> None:
+        self._pool.close()
+        self._pool.join()
+
+def open_encoder(args: argparse.Namespace):
+    """Encoder in-process, or a WorkerPool of replicas with --workers > 1."""
+    print(f"[Model] Loading: {args.model_name} ({args.encoder_backend})"
+          + (f" x{args.workers} workers" if args.workers > 1 else ""))
+    if args.workers > 1:
+        return WorkerPool(args.model_name, args.workers, args.torch_threads,
+                          backend=args.encoder_backend, onnx_file=args.encoder_onnx_file)
+    return load_encoder(args.model_name, args.encoder_backend, args.encoder_onnx_file or None)
+
+def chunk_corpus(df: pd.DataFrame, args: argparse.Namespace, model) -> List[Dict]:
+    if isinstance(model, WorkerPool):
+        return model.chunk(df, args.min_chunk_chars, args.chunk_size, args.chunk_overlap)
+    return build_corpus(df, args.min_chunk_chars, args.chunk_size, args.chunk_overlap)
+
+INDEX_TYPES = ["flat", "hnsw", "ivf-flat", "ivf-pq", "sq"]
+TRAINED_INDEX_TYPES = {"ivf-flat", "ivf-pq", "sq"}
+
+def _auto_nlist(n: int, requested: int, n_train: Optional[int] = None) -> int:
+    # FAISS 建议每个聚类中心至少 ~39 个训练样本
+    n_train = n if n_train is None else n_train
+    nlist = requested if requested > 0 else int(4 * math.sqrt(max(n, 1)))
+    return max(1, min(nlist, n_train // 39 if n_train >= 39 else 1))
+
+def _pq_subquantizers(dim: int, requested: int) -> int:
+    m = max(1, min(requested, dim))
+    while dim % m != 0:
+        m -= 1
+    return m
+
+def index_factory_string(index_type: str, dim: int, n: int, args: argparse.Namespace,
+                         n_train: Optional[int] = None) -> str:
+    """`n` = expected index size, `n_train` = vectors available for training (default n)."""
+    n_train = n if n_train is None else n_train
+    if index_type == "hnsw":
+        return f"HNSW{args.hnsw_m}"
+    if index_type == "ivf-flat":
+        return f"IVF{_auto_nlist(n, args.ivf_nlist, n_train)},Flat"
+    if index_type == "ivf-pq":
+        if n_train < (1 << args.pq_nbits):
+            print(f"[FAISS] Only {n_train} vectors, too few to train PQ{args.pq_nbits}; falling back to ivf-flat")
+            return f"IVF{_auto_nlist(n, args.ivf_nlist, n_train)},Flat"
+        m = _pq_subquantizers(dim, args.pq_m)
+        return f"IVF{_auto_nlist(n, args.ivf_nlist, n_train)},PQ{m}x{args.pq_nbits}"
+    if index_type == "sq":
+        return {"8bit": "SQ8", "4bit": "SQ4", "fp16": "SQfp16"}[args.sq_type]
+    return "Flat"
+
+def build_faiss_index(embeddings: np.ndarray, ids: np.ndarray, args: argparse.Namespace):
+    """
+    Build (train + add_with_ids) the index selected by --index-type.
+    IVF indexes keep ids natively (hashtable direct map, so reconstruct / remove_ids work);
+    the others are wrapped in IndexIDMap2. Search-time defaults (efSearch / nprobe) are
+    stored in the index file.
+    """
+    index = create_faiss_index(embeddings, len(embeddings), args)
+    index.add_with_ids(embeddings, np.asarray(ids, dtype="int64"))
+    return index
+
+def create_faiss_index(embeddings: np.ndarray, n_total: int, args: argparse.Namespace):
+    """Create and (if needed) train an empty index sized for ~n_total vectors, trained on `embeddings`."""
+    n, dim = embeddings.shape
+    spec = index_factory_string(args.index_type, dim, max(n_total, n), args, n_train=n)
+    if not spec.startswith("IVF"):
+        spec = f"IDMap2,{spec}"
+    index = faiss.index_factory(dim, spec, faiss.METRIC_INNER_PRODUCT)
+    base = _base_index(index)
+    if hasattr(base, "hnsw"):
+        base.hnsw.efConstruction = args.hnsw_ef_construction
+        base.hnsw.efSearch = args.hnsw_ef_search
+    if not index.is_trained:
+        rng = np.random.default_rng(0)
+        train = embeddings
+        if n > args.train_size > 0:
+            train = embeddings[rng.choice(n, size=args.train_size, replace=False)]
+        t = time.time()
+        index.train(train)
+        print(f"[FAISS] Trained {spec} on {len(train)} vectors in {time.time() - t:.2f}s")
+    ivf = _extract_ivf(index)
+    if ivf is not None:
+        ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+        ivf.nprobe = min(args.ivf_nprobe, ivf.nlist)
+    return index
+
+def _base_index(index):
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.downcast_index(index.index)
+    return index
+
+def _extract_ivf(index):
+    try:
+        return faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return None
+
+def _sweep_params(index) -> List[Tuple[str, int]]:
+    """Search-time knob values to report recall/latency for (current default first)."""
+    if hasattr(_base_index(index), "hnsw"):
+        cur = int(_base_index(index).hnsw.efSearch)
+        return [("efSearch", v) for v in dict.fromkeys([cur, 16, 32, 64, 128, 256])]
+    ivf = _extract_ivf(index)
+    if ivf is not None:
+        cur = int(ivf.nprobe)
+        vals = [v for v in [cur, 1, 4, 8, 16, 32, 64] if v <= ivf.nlist]
+        return [("nprobe", v) for v in dict.fromkeys(vals)]
+    return [("", 0)]
+
+def _set_param(index, name: str, value: int) -> None:
+    if name == "efSearch":
+        _base_index(index).hnsw.efSearch = value
+    elif name == "nprobe":
+        _extract_ivf(index).nprobe = value
+
+def evaluate_index(index, embeddings: np.ndarray, ids: np.ndarray, k: int, n_queries: int) -> Dict:
+    """
+    Recall@k of `index` against exact flat search plus single-query latency,
+    using a random sample of the indexed vectors as queries.
+    """
+    n, dim = embeddings.shape
+    if n == 0:
+        return {}
+    k = min(k, n)
+    rng = np.random.default_rng(0)
+    queries = embeddings[rng.choice(n, size=min(n_queries, n), replace=False)]
+
+    exact = faiss.IndexFlatIP(dim)
+    exact.add(embeddings)
+    t = time.time()
+    _, gt = exact.search(queries, k)
+    gt = np.asarray(ids, dtype="int64")[gt]  # positions -> FAISS ids
+    flat_ms = (time.time() - t) * 1000.0 / len(queries)
+    return sweep_recall(index, queries, gt, flat_ms)
+
+def sweep_recall(index, queries: np.ndarray, gt: np.ndarray, flat_ms: float) -> Dict:
+    """Recall@k (k = gt width) and latency of `index` for each search-time knob value."""
+    k = gt.shape[1]
+    sweep = []
+    params = _sweep_params(index)
+    for name, value in params:
+        if name:
+            _set_param(index, name, value)
+        lat = []
+        found = np.empty_like(gt)
+        for i in range(len(queries)):
+            t = time.perf_counter()
+            _, I = index.search(queries[i:i + 1], k)
+            lat.append((time.perf_counter() - t) * 1000.0)
+            found[i] = I[0]
+        recall = np.mean([len(set(found[i]) & set(gt[i])) / k for i in range(len(queries))])
+        row = {
+            f"recall@{k}": round(float(recall), 4),
+            "p50_ms": round(float(np.percentile(lat, 50)), 4),
+            "p99_ms": round(float(np.percentile(lat, 99)), 4),
+        }
+        if name:
+            row[name] = value
+        sweep.append(row)
+    # restore the default stored with the index
+    if params[0][0]:
+        _set_param(index, params[0][0], params[0][1])
+
+    return {
+        "ntotal": int(index.ntotal),
+        "queries": int(len(queries)),
+        "k": int(k),
+        "flat_batch_ms_per_query": round(flat_ms, 4),
+        "sweep": sweep,
+    }
 
 def save_metadata(metadata_path: Path, corpus: List[Dict], extra: Dict) -> None:
     with metadata_path.open("w", encoding="utf-8") as f:
@@ -214,17 +625,51 @@ def save_metadata(metadata_path: Path, corpus: List[Dict], extra: Dict) -> None:
             rec.update(extra)
             f.write(json.dumps(rec, ensure_ascii=False) + "\n")
 
+def save_drama_chunk_ranges(path: Path, corpus: List[Dict]) -> None:
+    """
+    Chunks of one drama are emitted contiguously by build_corpus, so each drama
+    maps to a half-open [start, end) range of vector ids in faiss.index.
+    """
+    ranges: Dict[str, List[int]] = {}
+    for i, item in enumerate(corpus):
+        key = str(item["dramaId"])
+        if key in ranges:
+            ranges[key][1] = i + 1
+        else:
+            ranges[key] = [i, i + 1]
+    with path.open("w", encoding="utf-8") as f:
+        json.dump(ranges, f, ensure_ascii=False)
+
 def write_stats(stats_path: Path, stats: Dict) -> None:
     with stats_path.open("w", encoding="utf-8") as f:
         json.dump(stats, f, ensure_ascii=False, indent=2)
 
-def extract_tags_for_items(texts: List[str], topk:int=8) -> List[List[str]]:
+def write_sync_state(out_dir: Path, watermark, rows: Optional[Dict[str, str]] = None) -> None:
+    """rows: digests of the rows at the watermark second (see load_changed_from_mysql)."""
+    if watermark is None or pd.isna(watermark):
+        return
+    state = {
+        "watermark": pd.Timestamp(watermark).strftime("%Y-%m-%d %H:%M:%S"),
+        "watermark_rows": rows or {},
+        "synced_at": datetime.utcnow().isoformat() + "Z",
+    }
+    with (out_dir / "sync_state.json").open("w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+
+def fit_tag_vectorizer(texts: List[str]) -> TfidfVectorizer:
     vec = TfidfVectorizer(
         max_features=5000,
         ngram_range=(1,2),
         stop_words="english"
     )
-    X = vec.fit_transform(texts)
+    vec.fit(texts)
+    return vec
+
+def extract_tags_for_items(texts: List[str], topk:int=8, vec: Optional[TfidfVectorizer] = None) -> List[List[str]]:
+    """TF-IDF top terms per text; pass a fitted `vec` to reuse an existing vocabulary/idf."""
+    if vec is None:
+        vec = fit_tag_vectorizer(texts)
+    X = vec.transform(texts)
     vocab = np.array(vec.get_feature_names_out())
     tags_list: List[List[str]] = []
     for i in range(X.shape[0]):
@@ -237,28 +682,559 @@ def extract_tags_for_items(texts: List[str], topk:int=8) -> List[List[str]]:
         tags_list.append(tags)
     return tags_list
 
-def build_drama_level(df: pd.DataFrame, model: SentenceTransformer, out_dir: Path) -> None:
+def drama_texts(df: pd.DataFrame) -> List[str]:
+    return [(f"{r['title']}. {r.get('description','') or ''}").strip() for _, r in df.iterrows()]
+
+def build_drama_level(df: pd.DataFrame, model: Encoder, out_dir: Path, args: argparse.Namespace,
+                      writer: MetaWriter, cache: Optional[DiskEmbeddingCache] = None) -> Dict:
     print("[DramaIndex] building drama-level index...")
-    texts = [(f"{r['title']}. {r.get('description','') or ''}").strip() for _, r in df.iterrows()]
-    tags_list = extract_tags_for_items(texts, topk=8)
-    embs = model.encode(texts, batch_size=64, show_progress_bar=True, convert_to_numpy=True, normalize_embeddings=True).astype("float32")
+    texts = drama_texts(df)
+    # 分片构建时由 run_sharded 在全量目录上拟合，各分片的 tags 与单机构建一致
+    tag_vec = getattr(args, "tag_vec", None) or fit_tag_vectorizer(texts)
+    joblib.dump(tag_vec, out_dir / "tfidf.joblib")
+    tags_list = extract_tags_for_items(texts, topk=8, vec=tag_vec)
+    embs = embed_texts(model, texts, batch_size=args.batch_size, normalize=True, cache=cache)
 
-    dim = embs.shape[1]
-    index = faiss.IndexFlatIP(dim)
-    index.add(embs)
+    ids = df["id"].to_numpy(dtype="int64")
+    index = build_faiss_index(embs, ids, args)
     faiss.write_index(index, str(out_dir / "drama.faiss"))
+    report = evaluate_index(index, embs, ids, k=args.recall_k, n_queries=args.recall_queries)
+    report["bm25"] = write_bm25(out_dir, "drama", texts)
+    report["knn"] = build_similar_graph(out_dir, index, ids, args)
 
-    meta_path = out_dir / "drama_meta.jsonl"
-    with meta_path.open("w", encoding="utf-8") as f:
-        for i, (_, r) in enumerate(df.iterrows()):
-            rec = {
-                "dramaId": int(r["id"]) if str(r["id"]).isdigit() else r["id"],
-                "title": r["title"],
-                "category": r.get("category","") or "",
-                "tags": tags_list[i],
-            }
-            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+    writer.add_dramas(
+        drama_ids=df["id"].tolist(),
+        titles=df["title"].tolist(),
+        categories=df["category"].tolist(),
+        tags_list=tags_list,
+        texts=texts,
+    )
+    if args.export_jsonl:
+        meta_path = out_dir / "drama_meta.jsonl"
+        with meta_path.open("w", encoding="utf-8") as f:
+            for i, (_, r) in enumerate(df.iterrows()):
+                rec = {
+                    "dramaId": int(r["id"]) if str(r["id"]).isdigit() else r["id"],
+                    "title": r["title"],
+                    "category": r.get("category","") or "",
+                    "tags": tags_list[i],
+                }
+                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
     print("[DramaIndex] saved faiss + metadata.")
+    return report
+
+def build_similar_graph(out_dir: Path, drama_index, drama_ids: np.ndarray, args: argparse.Namespace,
+                        prev: Optional[Tuple[KnnGraph, np.ndarray, np.ndarray]] = None) -> Optional[Dict]:
+    """
+    drama_knn_*.npy over every vector of drama.faiss (rows = drama table rows, sorted by id).
+    `prev` = (graph, its dramaIds, changed dramaIds) patches the previous graph after --incremental.
+    """
+    if args.knn_k <= 0 or len(drama_ids) == 0:
+        return None
+    if args.shards > 1:
+        # 近邻跨分片，单个分片上算不出完整的图
+        print("[KNN] skipped: not built for sharded indexes")
+        return None
+    t = time.time()
+    ids = np.asarray(drama_ids, dtype="int64")
+    # 从索引取向量（PQ / SQ 为量化后的近似值），全量与增量得到同一张图
+    vecs = drama_index.reconstruct_batch(ids)
+    if prev is not None and prev[0].k == args.knn_k:
+        scores, nbrs, recomputed = update_knn(prev[0], prev[1], vecs, ids, prev[2], args.knn_k)
+        mode = "incremental"
+    else:
+        scores, nbrs = build_knn(vecs, ids, args.knn_k)
+        recomputed, mode = len(ids), "full"
+    write_knn(out_dir, scores, nbrs)
+    report = {"k": args.knn_k, "mode": mode, "rows": int(len(ids)), "recomputed_rows": int(recomputed),
+              "sec": round(time.time() - t, 3)}
+    print(f"[KNN] {mode}: {recomputed}/{len(ids)} rows x {args.knn_k} neighbors in {report['sec']:.2f}s")
+    return report
+
+# -----------------------------
+# Incremental sync
+# -----------------------------
+
+def finish_build(root: Path, out_dir: Path, build_id: str, model, dim: int,
+                 index_type: str, keep_versions: int, partition: Optional[Dict] = None) -> None:
+    """Write manifest.json last; in the versioned layout, then switch CURRENT to the new build."""
+    manifest = write_manifest(out_dir, build_id, model.model_name, dim, indexType=index_type,
+                              encoderBackend=model.backend, encoderVariant=model.variant, **(partition or {}))
+    print(f"[Manifest] build {build_id} ({manifest['checksum'][:19]}...)")
+    if out_dir != root:
+        publish_version(root, build_id)
+        prune_versions(root, keep_versions)
+        print(f"[Version] CURRENT -> {build_id}")
+
+def _replace_into(tmp_dir: Path, out_dir: Path) -> None:
+    for p in tmp_dir.iterdir():
+        os.replace(p, out_dir / p.name)
+    tmp_dir.rmdir()
+
+def link_unchanged(src_dir: Path, out_dir: Path) -> None:
+    """
+    Files of the previous version an incremental sync did not rewrite (tfidf.joblib, jsonl exports):
+    hard links instead of copies, since no build writes a file of a published version in place.
+    manifest.json is skipped: finish_build writes a new one.
+    """
+    for p in src_dir.iterdir():
+        dst = out_dir / p.name
+        if p.name == MANIFEST_FILE or p.name.startswith(".") or dst.exists():
+            continue
+        if p.is_dir():
+            shutil.copytree(p, dst)
+            continue
+        try:
+            os.link(p, dst)
+        except OSError:
+            shutil.copy2(p, dst)  # 跨文件系统等
+
+def write_drama_ranges(path: Path, chunk_drama_ids: np.ndarray) -> None:
+    """drama_chunks.json from the (sorted) chunk_drama_ids column; same content as save_drama_chunk_ranges."""
+    ids, starts, counts = np.unique(np.asarray(chunk_drama_ids), return_index=True, return_counts=True)
+    ranges = {str(int(d)): [int(s), int(s + c)] for d, s, c in zip(ids, starts, counts)}
+    with path.open("w", encoding="utf-8") as f:
+        json.dump(ranges, f, ensure_ascii=False)
+
+def update_bm25(tmp_dir: Path, src_dir: Path, prefix: str, plan: Tuple[np.ndarray, np.ndarray],
+                new_texts: List[str], table_texts) -> Dict:
+    """Merge the changed docs into the existing postings; indexes built before tf was stored are rebuilt once."""
+    if can_merge_bm25(src_dir, prefix):
+        return merge_bm25(tmp_dir, src_dir, prefix, plan[0], plan[1], new_texts)
+    print(f"[Sync] {prefix} BM25 has no stored tf; rebuilding it once from the metadata")
+    return write_bm25(tmp_dir, prefix, table_texts())
+
+def run_incremental(args: argparse.Namespace) -> None:
+    """
+    Upsert dramas whose updateTime moved past the watermark and remove offline / deleted
+    ones. Only changed dramas are chunked, embedded and tokenized: the metadata columns are
+    spliced (kept rows copied as runs, see metastore.splice_tables) and the BM25 postings of
+    unchanged docs are re-keyed and merged with the new ones (sparse.merge_bm25).
+    """
+    t0 = time.time()
+    timer = StageTimer()
+    if args.source != "mysql":
+        raise ValueError("--incremental requires --source mysql (updateTime watermark)")
+    root = Path(args.out_dir).resolve()
+    out_dir, _ = resolve_index_dir(root)
+    state_path = out_dir / "sync_state.json"
+    stats_path = out_dir / "stats.json"
+    if not state_path.exists() or not stats_path.exists():
+        raise FileNotFoundError(f"No sync_state.json / stats.json in {out_dir}; run a full build first")
+    with state_path.open("r", encoding="utf-8") as f:
+        state = json.load(f)
+    with stats_path.open("r", encoding="utf-8") as f:
+        stats = json.load(f)
+    if stats.get("index_type") == "hnsw":
+        raise ValueError("HNSW indexes do not support remove_ids; run a full rebuild instead")
+
+    chunk_table, drama_table = load_tables(out_dir)
+    if not getattr(chunk_table, "id_mapped", False):
+        raise ValueError("Index was built without stable ids; run a full rebuild first")
+
+    df_new, changed, new_wm, new_wm_rows = load_changed_from_mysql(args.table, state["watermark"],
+                                                                    state.get("watermark_rows"))
+    if args.shards > 1:
+        # 每个分片各自拉取变更，只保留归属本分片的 dramaId
+        df_new = select_shard(df_new, args)
+        changed = [i for i in changed if shard_of(i, args.shards) == args.shard_index]
+    print(f"[Sync] {len(changed)} changed rows since {state['watermark']} ({len(df_new)} live)")
+    if not changed:
+        return
+    removed = np.asarray(sorted(set(changed)), dtype="int64")
+
+    # 版本化目录：从当前版本读、写入新版本目录，完成后再切换 CURRENT，在线服务不受影响
+    build_id = new_build_id()
+    src_dir = out_dir
+    if active_build_id(root) is not None:
+        out_dir = version_dir(root, build_id)
+        ensure_dir(out_dir)
+
+    with timer("faiss"):
+        index = faiss.read_index(str(src_dir / "faiss.index"))
+        drama_index = faiss.read_index(str(src_dir / "drama.faiss"))
+        old_chunk_ids = np.asarray(chunk_table.vector_ids)[np.isin(np.asarray(chunk_table.drama_ids), removed)]
+        n_rm_chunks = index.remove_ids(faiss.IDSelectorArray(old_chunk_ids)) if len(old_chunk_ids) else 0
+        n_rm_dramas = drama_index.remove_ids(faiss.IDSelectorArray(removed))
+
+    # 只对变更的剧重新切段 + 向量化（沿用全量构建时的切段参数）
+    corpus = build_corpus(
+        df=df_new,
+        min_chunk_chars=stats.get("min_chunk_chars", args.min_chunk_chars),
+        chunk_size=stats.get("chunk_size", args.chunk_size),
+        chunk_overlap=stats.get("chunk_overlap", args.chunk_overlap),
+    ) if len(df_new) else []
+    model_name = stats.get("model", args.model_name)
+    new_texts = drama_texts(df_new) if len(df_new) else []
+    new_tags: List[List[str]] = []
+    if corpus:
+        print(f"[Model] Loading: {model_name}")
+        model = load_encoder(model_name, stats.get("encoder_backend", "st"), stats.get("encoder_variant") or None)
+        cache = open_embed_cache(args, root, model.key)
+        with timer("embed", len(corpus) + len(new_texts)):
+            embs = embed_texts(model, [c["chunk"] for c in corpus], batch_size=args.batch_size, normalize=True,
+                               cache=cache)
+            d_embs = embed_texts(model, new_texts, batch_size=args.batch_size, normalize=True, cache=cache)
+        stats["embed_cache"] = report_embed_cache(cache)
+        with timer("faiss"):
+            index.add_with_ids(embs, np.asarray([chunk_vector_id(c["dramaId"], c["chunk_id"]) for c in corpus],
+                                                dtype="int64"))
+            drama_index.add_with_ids(d_embs, df_new["id"].to_numpy(dtype="int64"))
+        new_tags = extract_tags_for_items(new_texts, topk=8, vec=joblib.load(src_dir / "tfidf.joblib"))
+
+    tmp_dir = out_dir / ".incremental"
+    ensure_dir(tmp_dir)
+    with timer("faiss"):
+        faiss.write_index(index, str(tmp_dir / "faiss.index"))
+        faiss.write_index(drama_index, str(tmp_dir / "drama.faiss"))
+    # build_corpus 按 df_new（dramaId 有序）逐剧产出段落，corpus 已按段落向量 id 有序
+    with timer("metadata", len(corpus) + len(df_new)):
+        plans = splice_tables(tmp_dir, src_dir, removed, chunks={
+            "dramaId": [c["dramaId"] for c in corpus],
+            "chunk_id": [c["chunk_id"] for c in corpus],
+            "title": [c["title"] for c in corpus],
+            "category": [c["category"] for c in corpus],
+            "text": [c["chunk"] for c in corpus],
+        }, dramas={
+            "id": df_new["id"].tolist(),
+            "title": df_new["title"].tolist(),
+            "category": df_new["category"].tolist(),
+            "tags": new_tags,
+            "text": new_texts,
+        })
+        new_chunk_table, new_drama_table = load_tables(tmp_dir)
+        write_drama_ranges(tmp_dir / "drama_chunks.json", new_chunk_table.drama_ids)
+    with timer("bm25", len(corpus) + len(df_new)):
+        bm25_report = {
+            "chunk": update_bm25(tmp_dir, src_dir, "chunk", plans["chunk"], [c["chunk"] for c in corpus],
+                                 lambda: (new_chunk_table.text(i) for i in range(len(new_chunk_table)))),
+            "drama": update_bm25(tmp_dir, src_dir, "drama", plans["drama"], new_texts,
+                                 lambda: (new_drama_table.text(i) for i in range(len(new_drama_table)))),
+        }
+    # 相似剧图：只重算变更剧及其邻居列表受影响的行，其余行与新增向量合并
+    with timer("knn"):
+        prev_graph = KnnGraph.load(src_dir)
+        knn_report = build_similar_graph(
+            tmp_dir, drama_index, new_drama_table.drama_ids, args,
+            prev=(prev_graph, np.asarray(drama_table.drama_ids), removed) if prev_graph is not None else None)
+
+    elapsed = time.time() - t0
+    stats.update({
+        "rows": int(drama_index.ntotal),
+        "chunks": int(index.ntotal),
+        "last_incremental": {
+            "changed_rows": len(changed),
+            "upserted_dramas": int(len(df_new)),
+            "removed_chunks": int(n_rm_chunks),
+            "removed_dramas": int(n_rm_dramas),
+            "added_chunks": len(corpus),
+            "bm25": bm25_report,
+            "knn": knn_report,
+            "stages": timer.report(),
+            "elapsed_sec": round(elapsed, 3),
+            "synced_at": datetime.utcnow().isoformat() + "Z",
+        },
+    })
+    write_stats(tmp_dir / "stats.json", stats)
+    write_sync_state(tmp_dir, new_wm, new_wm_rows)
+    _replace_into(tmp_dir, out_dir)
+    if out_dir != src_dir:
+        link_unchanged(src_dir, out_dir)
+    built_with = argparse.Namespace(model_name=model_name, backend=stats.get("encoder_backend", "st"),
+                                    variant=stats.get("encoder_variant", ""))
+    finish_build(root, out_dir, build_id, built_with, index.d, stats.get("index_type", "flat"), args.keep_versions,
+                 shard_partition(args))
+    print(f"[Sync] chunks={index.ntotal} dramas={drama_index.ntotal}; elapsed {elapsed:.2f}s")
+
+# -----------------------------
+# Streaming build (--stream)
+# -----------------------------
+
+def source_columns(cols: List[str]) -> List[str]:
+    """Only the columns normalize_dataframe needs (instead of SELECT *)."""
+    picked = [pick_first_present(cols, names) for names in COLUMN_ALIASES.values()]
+    return [c for c in dict.fromkeys(picked + STATE_COLUMNS) if c and c in cols]
+
+def iter_mysql_pages(table: str, page_size: int, limit: Optional[int] = None) -> Iterator[pd.DataFrame]:
+    """
+    Keyset pagination (WHERE id > :last ORDER BY id LIMIT n): each page is an index range
+    scan, memory stays at one page, and pages arrive in id order as the metadata requires.
+    """
+    load_dotenv(override=True)
+    host = os.getenv("DB_HOST", "127.0.0.1")
+    port = int(os.getenv("DB_PORT", "3306"))
+    user = os.getenv("DB_USER", "root")
+    password = os.getenv("DB_PASSWORD", "")
+    db = os.getenv("DB_NAME", "short_drama")
+
+    from sqlalchemy import create_engine, text  # lazy import
+    uri = f"mysql+pymysql://{user}:{password}@{host}:{port}/{db}?charset=utf8mb4"
+    engine = create_engine(uri)
+    with engine.connect() as conn:
+        cols = pd.read_sql(text(f"SELECT * FROM {table} LIMIT 0"), conn).columns.tolist()
+        id_col = pick_first_present(cols, COLUMN_ALIASES["id"])
+        if not id_col:
+            raise ValueError(f"Required columns not found. Have: {cols}. Need at least id/title.")
+        select = ", ".join(f"`{c}`" for c in source_columns(cols))
+        last, seen = None, 0
+        while not limit or seen < limit:
+            n = page_size if not limit else min(page_size, limit - seen)
+            where = f"WHERE `{id_col}` > :last " if last is not None else ""
+            sql = f"SELECT {select} FROM {table} {where}ORDER BY `{id_col}` LIMIT {int(n)}"
+            df_raw = pd.read_sql(text(sql), conn, params={"last": last})
+            if df_raw.empty:
+                return
+            last = int(df_raw[id_col].iloc[-1])
+            seen += len(df_raw)
+            yield df_raw
+
+def iter_csv_pages(csv_path: Path, page_size: int, limit: Optional[int] = None) -> Iterator[pd.DataFrame]:
+    cols = pd.read_csv(csv_path, nrows=0).columns.tolist()
+    seen = 0
+    for df_raw in pd.read_csv(csv_path, usecols=source_columns(cols), chunksize=page_size):
+        if limit:
+            df_raw = df_raw.head(limit - seen)
+        if df_raw.empty:
+            return
+        seen += len(df_raw)
+        yield df_raw
+        if limit and seen >= limit:
+            return
+
+class StageTimer:
+    """Accumulated wall time and item counts per pipeline stage."""
+    def __init__(self):
+        self.stages: Dict[str, Dict[str, float]] = {}
+
+    @contextmanager
+    def __call__(self, name: str, items: int = 0):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            st = self.stages.setdefault(name, {"sec": 0.0, "items": 0})
+            st["sec"] += time.perf_counter() - t
+            st["items"] += items
+
+    def report(self) -> Dict[str, Dict]:
+        return {
+            name: {"sec": round(st["sec"], 3), "items": int(st["items"]),
+                   "perSec": round(st["items"] / st["sec"], 1) if st["sec"] > 0 else 0.0}
+            for name, st in self.stages.items()
+        }
+
+class StreamingGroundTruth:
+    """Exact top-k of a fixed query sample, merged batch by batch (recall report without holding all vectors)."""
+    def __init__(self, queries: np.ndarray, k: int):
+        self.queries = queries
+        self.k = k
+        self.scores = np.zeros((len(queries), 0), dtype="float32")
+        self.ids = np.zeros((len(queries), 0), dtype="int64")
+        self.sec = 0.0
+
+    def update(self, vecs: np.ndarray, ids: np.ndarray) -> None:
+        if len(self.queries) == 0 or len(vecs) == 0:
+            return
+        t = time.perf_counter()
+        scores = np.hstack([self.scores, self.queries @ vecs.T])
+        all_ids = np.hstack([self.ids, np.broadcast_to(np.asarray(ids, dtype="int64"), (len(self.queries), len(ids)))])
+        if scores.shape[1] > self.k:
+            top = np.argpartition(-scores, self.k - 1, axis=1)[:, :self.k]
+            scores = np.take_along_axis(scores, top, axis=1)
+            all_ids = np.take_along_axis(all_ids, top, axis=1)
+        self.scores, self.ids = scores, all_ids
+        self.sec += time.perf_counter() - t
+
+    def report(self, index) -> Dict:
+        if self.ids.shape[1] == 0:
+            return {}
+        return sweep_recall(index, self.queries, self.ids, self.sec * 1000.0 / len(self.queries))
+
+def _peak_rss_mb() -> float:
+    import resource  # unix only
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+
+def run_stream(args: argparse.Namespace) -> None:
+    """
+    Page-at-a-time build: read -> chunk -> embed -> index.add -> metadata append per page.
+    For trained index types the first pages (up to --train-size chunk vectors) are held back to
+    train the index; the TF-IDF tag vocabulary is fitted on that same sample (or the first page).
+    After that memory stays at one page plus the small per-row metadata columns.
+    """
+    t0 = time.time()
+    root = Path(args.out_dir).resolve()
+    build_id = new_build_id()
+    out_dir = version_dir(root, build_id) if args.versioned else root
+    ensure_dir(out_dir)
+    limit = args.max_rows if args.max_rows > 0 else None
+    if args.source == "mysql":
+        pages = iter_mysql_pages(args.table, args.page_size, limit)
+        source_name = "mysql"
+    else:
+        if not args.csv_path:
+            raise ValueError("--csv-path is required when source=csv")
+        csv_path = Path(args.csv_path).resolve()
+        if not csv_path.exists():
+            raise FileNotFoundError(f"CSV not found: {csv_path}")
+        pages = iter_csv_pages(csv_path, args.page_size, limit)
+        source_name = f"csv:{csv_path.name}"
+    if args.export_jsonl:
+        print("[Stream] --export-jsonl is not supported with --stream; writing columnar metadata only")
+
+    model = open_encoder(args)
+    cache = open_embed_cache(args, root, model.key)
+    timer = StageTimer()
+    writer = MetaWriter(out_dir)
+    ranges: Dict[str, List[int]] = {}
+    buffer: List[Dict] = []
+    st = {"last_id": None, "rows": 0, "chunks": 0, "chars": 0, "pages": 0, "watermark": None, "watermark_rows": {},
+          "buffered": 0}
+    idx: Dict = {}
+
+    def prepare(df_raw: pd.DataFrame) -> Optional[Dict]:
+        if "updateTime" in df_raw and len(df_raw):
+            wm = pd.to_datetime(df_raw["updateTime"]).max()
+            if st["watermark"] is None or wm.floor("s") > st["watermark"].floor("s"):
+                st["watermark"], st["watermark_rows"] = wm, boundary_rows(df_raw)
+            elif wm.floor("s") == st["watermark"].floor("s"):
+                st["watermark"] = max(wm, st["watermark"])
+                st["watermark_rows"].update(boundary_rows(df_raw))
+        df = select_shard(normalize_dataframe(df_raw, live_only=args.source == "mysql"), args)
+        if df.empty:
+            return None
+        if st["last_id"] is not None and int(df["id"].iloc[0]) <= st["last_id"]:
+            raise ValueError("--stream needs rows ordered by id across pages (sort the CSV by id)")
+        st["last_id"] = int(df["id"].iloc[-1])
+        with timer("chunk", len(df)):
+            corpus = chunk_corpus(df, args, model)
+            texts = drama_texts(df)
+        with timer("embed", len(corpus) + len(texts)):
+            chunk_embs = embed_texts(model, [c["chunk"] for c in corpus], args.batch_size, cache=cache, progress=False)
+            drama_embs = embed_texts(model, texts, args.batch_size, cache=cache, progress=False)
+        return {"df": df, "corpus": corpus, "texts": texts, "chunk_embs": chunk_embs, "drama_embs": drama_embs,
+                "chunk_ids": np.asarray([chunk_vector_id(c["dramaId"], c["chunk_id"]) for c in corpus], dtype="int64")}
+
+    def start_indexes() -> None:
+        chunk_train = np.concatenate([p["chunk_embs"] for p in buffer])
+        drama_train = np.concatenate([p["drama_embs"] for p in buffer])
+        rng = np.random.default_rng(0)
+        for name, train in (("chunk", chunk_train), ("drama", drama_train)):
+            idx[name] = create_faiss_index(train, len(train), args)
+            queries = train[rng.choice(len(train), size=min(args.recall_queries, len(train)), replace=False)]
+            idx[name + "_gt"] = StreamingGroundTruth(queries, args.recall_k)
+        # TF-IDF 词表只在首批样本上拟合（流式模式下无法一次拿到全部文本）
+        idx["tag_vec"] = fit_tag_vectorizer([t for p in buffer for t in p["texts"]])
+        joblib.dump(idx["tag_vec"], out_dir / "tfidf.joblib")
+
+    def flush(page: Dict) -> None:
+        df, corpus = page["df"], page["corpus"]
+        with timer("index", len(corpus) + len(df)):
+            idx["chunk"].add_with_ids(page["chunk_embs"], page["chunk_ids"])
+            idx["drama"].add_with_ids(page["drama_embs"], df["id"].to_numpy(dtype="int64"))
+            idx["chunk_gt"].update(page["chunk_embs"], page["chunk_ids"])
+            idx["drama_gt"].update(page["drama_embs"], df["id"].to_numpy(dtype="int64"))
+        with timer("meta", len(corpus) + len(df)):
+            writer.add_chunks(
+                drama_ids=[c["dramaId"] for c in corpus],
+                chunk_ids=[c["chunk_id"] for c in corpus],
+                titles=[c["title"] for c in corpus],
+                categories=[c["category"] for c in corpus],
+                texts=[c["chunk"] for c in corpus],
+            )
+            writer.add_dramas(
+                drama_ids=df["id"].tolist(),
+                titles=df["title"].tolist(),
+                categories=df["category"].tolist(),
+                tags_list=extract_tags_for_items(page["texts"], topk=8, vec=idx["tag_vec"]),
+                texts=page["texts"],
+            )
+            for i, c in enumerate(corpus, start=st["chunks"]):
+                ranges.setdefault(str(c["dramaId"]), [i, i])[1] = i + 1
+        st["rows"] += len(df)
+        st["chunks"] += len(corpus)
+        st["chars"] += sum(c["text_len"] for c in corpus)
+
+    while True:
+        with timer("read"):
+            df_raw = next(pages, None)
+        if df_raw is None:
+            break
+        timer.stages["read"]["items"] += len(df_raw)
+        page = prepare(df_raw)
+        st["pages"] += 1
+        if page is None:
+            continue
+        if "chunk" not in idx:
+            buffer.append(page)
+            st["buffered"] += len(page["corpus"])
+            # flat / hnsw 无需训练：首页即可开始写入；其余攒够 --train-size 个向量再训练
+            if st["buffered"] >= (args.train_size if args.index_type in TRAINED_INDEX_TYPES else 0):
+                start_indexes()
+        if "chunk" in idx:
+            for p in buffer or [page]:
+                flush(p)
+            buffer.clear()
+        elapsed = time.time() - t0
+        print(f"[Stream] page {st['pages']}: {st['rows']} rows, {st['chunks']} chunks indexed "
+              f"({st['rows'] / max(elapsed, 1e-6):.0f} rows/s, peak RSS {_peak_rss_mb()} MB)")
+    if "chunk" not in idx:
+        if not buffer:
+            raise ValueError("No data loaded. Check source and fields.")
+        start_indexes()
+        for p in buffer:
+            flush(p)
+        buffer.clear()
+
+    writer.close()
+    with timer("write", st["chunks"] + st["rows"]):
+        faiss.write_index(idx["chunk"], str(out_dir / "faiss.index"))
+        faiss.write_index(idx["drama"], str(out_dir / "drama.faiss"))
+        with (out_dir / "drama_chunks.json").open("w", encoding="utf-8") as f:
+            json.dump(ranges, f, ensure_ascii=False)
+    # BM25 从刚写好的列式元数据里按行读取文本，不在内存中保留全部文本
+    with timer("bm25", st["chunks"] + st["rows"]):
+        chunk_table, drama_table = load_tables(out_dir)
+        chunk_report = idx["chunk_gt"].report(idx["chunk"])
+        drama_report = idx["drama_gt"].report(idx["drama"])
+        chunk_report["bm25"] = write_bm25(out_dir, "chunk", (chunk_table.text(i) for i in range(len(chunk_table))))
+        drama_report["bm25"] = write_bm25(out_dir, "drama", (drama_table.text(i) for i in range(len(drama_table))))
+    with timer("knn", st["rows"]):
+        drama_report["knn"] = build_similar_graph(out_dir, idx["drama"], drama_table.drama_ids, args)
+    print(f"[Meta] Columnar metadata written to: {out_dir}")
+
+    elapsed = time.time() - t0
+    dim = int(idx["chunk"].d)
+    stats = {
+        "source": source_name,
+        "rows": st["rows"],
+        "chunks": st["chunks"],
+        "dimension": dim,
+        "model": args.model_name,
+        "encoder_backend": model.backend,
+        "encoder_variant": model.variant,
+        "chunk_size": args.chunk_size,
+        "chunk_overlap": args.chunk_overlap,
+        "min_chunk_chars": args.min_chunk_chars,
+        "batch_size": args.batch_size,
+        "built_at": datetime.utcnow().isoformat() + "Z",
+        "elapsed_sec": round(elapsed, 3),
+        "avg_chars_per_chunk": round(st["chars"] / max(st["chunks"], 1), 2),
+        "index_type": args.index_type,
+        "meta_format": "columnar",
+        "index_report": {"chunk": chunk_report, "drama": drama_report},
+        "embed_cache": report_embed_cache(cache),
+        "stream": {"page_size": args.page_size, "pages": st["pages"], "stages": timer.report(),
+                   "peak_rss_mb": _peak_rss_mb()},
+        "workers": model.report() if isinstance(model, WorkerPool) else None,
+    }
+    if isinstance(model, WorkerPool):
+        model.close()
+    write_stats(out_dir / "stats.json", stats)
+    write_sync_state(out_dir, st["watermark"], st["watermark_rows"])
+    for name, rep_ in stats["stream"]["stages"].items():
+        print(f"[Stage] {name:<6} {rep_['sec']:8.2f}s  {rep_['perSec']:10.1f} items/s")
+    finish_build(root, out_dir, build_id, model, dim, args.index_type, args.keep_versions, shard_partition(args))
+    print(f"[Done] {st['rows']} rows / {st['chunks']} chunks in {elapsed:.2f}s, peak RSS {_peak_rss_mb()} MB")
 
 # -----------------------------
 # CLI
@@ -271,78 +1247,162 @@ def parse_args() -> argparse.Namespace:
     ap.add_argument("--csv-path", type=str, help="CSV path if source=csv")
     ap.add_argument("--out-dir", type=str, default="ai_service/index", help="Output directory")
     ap.add_argument("--model-name", type=str, default="BAAI/bge-small-en-v1.5", help="SentenceTransformer model")
+    ap.add_argument("--encoder-backend", choices=ENCODER_BACKENDS, default=os.getenv("ENCODER_BACKEND", "st").lower(),
+                    help="st (fp32) | int8 (dynamic quantization) | onnx; the service must use the same one")
+    ap.add_argument("--encoder-onnx-file", type=str, default=os.getenv("ENCODER_ONNX_FILE", ""),
+                    help="ONNX backend: file inside the model repo, e.g. onnx/model_qint8_avx512.onnx")
     ap.add_argument("--chunk-size", type=int, default=400, help="Max characters per chunk")
     ap.add_argument("--chunk-overlap", type=int, default=60, help="Approximate overlap characters")
     ap.add_argument("--min-chunk-chars", type=int, default=80, help="Drop chunks shorter than this")
     ap.add_argument("--batch-size", type=int, default=64, help="Embedding batch size")
     ap.add_argument("--max-rows", type=int, default=0, help="Limit rows for quick test (0=all)")
+    ap.add_argument("--index-type", choices=INDEX_TYPES, default="flat", help="FAISS index type for faiss.index and drama.faiss")
+    ap.add_argument("--hnsw-m", type=int, default=32, help="HNSW graph degree (M)")
+    ap.add_argument("--hnsw-ef-construction", type=int, default=200, help="HNSW efConstruction")
+    ap.add_argument("--hnsw-ef-search", type=int, default=64, help="Default HNSW efSearch stored in the index")
+    ap.add_argument("--ivf-nlist", type=int, default=0, help="IVF cluster count (0=auto, ~4*sqrt(n))")
+    ap.add_argument("--ivf-nprobe", type=int, default=8, help="Default IVF nprobe stored in the index")
+    ap.add_argument("--pq-m", type=int, default=16, help="PQ sub-quantizers (adjusted to divide dim)")
+    ap.add_argument("--pq-nbits", type=int, default=8, help="Bits per PQ code")
+    ap.add_argument("--sq-type", choices=["8bit", "4bit", "fp16"], default="8bit", help="Scalar quantizer for --index-type sq")
+    ap.add_argument("--train-size", type=int, default=100000, help="Max vectors sampled for index training")
+    ap.add_argument("--recall-k", type=int, default=10, help="k for the recall@k-vs-flat report")
+    ap.add_argument("--recall-queries", type=int, default=200, help="Sampled queries for the recall/latency report")
+    ap.add_argument("--export-jsonl", action="store_true", help="Also export metadata.jsonl / drama_meta.jsonl")
+    ap.add_argument("--incremental", action="store_true",
+                    help="Sync only rows changed since the updateTime watermark in sync_state.json (mysql)")
+    ap.add_argument("--versioned", action="store_true",
+                    help="Treat --out-dir as a versions root: build into versions/<build_id> and switch CURRENT")
+    ap.add_argument("--keep-versions", type=int, default=3,
+                    help="Versioned layout: keep the newest N builds (0 = keep all)")
+    ap.add_argument("--embed-cache-dir", type=str, default="",
+                    help="On-disk embedding cache (default: <out-dir>/embed_cache); GC with scripts/embed_cache.py")
+    ap.add_argument("--no-embed-cache", action="store_true", help="Always re-encode every text")
+    ap.add_argument("--stream", action="store_true",
+                    help="Bounded-memory build: read, chunk, embed and index page by page")
+    ap.add_argument("--page-size", type=int, default=2000, help="Rows per page with --stream")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="Processes for chunking + encoding (one model replica each); 1 = in-process")
+    ap.add_argument("--torch-threads", type=int, default=0,
+                    help="Intra-op threads per worker (0 = cpu_count // workers)")
+    ap.add_argument("--shards", type=int, default=1,
+                    help="Partition by dramaId %% N into <out-dir>/shard-XX/ (served via SHARD_URLS)")
+    ap.add_argument("--shard-index", type=int, default=-1,
+                    help="With --shards: build only this shard (default: all of them, one after another)")
+    ap.add_argument("--knn-k", type=int, default=20,
+                    help="Neighbors per drama in the \"more like this\" graph (GET /rag/similar; 0 = skip)")
     ap.add_argument("--test-query", type=str, default=None, help="Optional quick retrieval test query")
     return ap.parse_args()
 
-def main():
-    args = parse_args()
+def run_sharded(args: argparse.Namespace) -> None:
+    """Build (or sync) each shard as its own index root; the embedding cache stays shared."""
+    root = Path(args.out_dir).resolve()
+    if args.shard_index >= args.shards:
+        raise ValueError(f"--shard-index must be < --shards ({args.shards})")
+    targets = [args.shard_index] if args.shard_index >= 0 else list(range(args.shards))
+    loaded = None
+    if not args.incremental and not args.stream:
+        # 全量构建：数据只读一次，tag 词表在全量目录上拟合后各分片共用
+        loaded = load_source(args)
+        args.tag_vec = fit_tag_vectorizer(drama_texts(loaded[0]))
+    for i in targets:
+        sub = argparse.Namespace(**vars(args))
+        sub.shard_index = i
+        sub.out_dir = str(shard_dir(root, i))
+        if not sub.embed_cache_dir:
+            sub.embed_cache_dir = str(root / "embed_cache")
+        print(f"\n[Shard] {i + 1}/{args.shards} -> {sub.out_dir}")
+        if loaded is not None:
+            run_full(sub, loaded)
+        else:
+            run_build(sub)
+    write_shard_map(root, args.shards, model=args.model_name, encoderBackend=args.encoder_backend)
+    print(f"[Shard] shards.json written to: {root}")
+
+def run_build(args: argparse.Namespace) -> None:
+    if args.incremental:
+        run_incremental(args)
+    elif args.stream:
+        run_stream(args)
+    else:
+        run_full(args)
+
+def load_source(args: argparse.Namespace) -> Tuple[pd.DataFrame, str]:
+    if args.source == "mysql":
+        df = load_from_mysql(table=args.table, limit=args.max_rows if args.max_rows > 0 else None)
+        return df, "mysql"
+    if not args.csv_path:
+        raise ValueError("--csv-path is required when source=csv")
+    csv_path = Path(args.csv_path).resolve()
+    if not csv_path.exists():
+        raise FileNotFoundError(f"CSV not found: {csv_path}")
+    return load_from_csv(csv_path, limit=args.max_rows if args.max_rows > 0 else None), f"csv:{csv_path.name}"
+
+def run_full(args: argparse.Namespace, loaded: Optional[Tuple[pd.DataFrame, str]] = None) -> None:
     t0 = time.time()
 
-    out_dir = Path(args.out_dir).resolve()
+    root = Path(args.out_dir).resolve()
+    build_id = new_build_id()
+    out_dir = version_dir(root, build_id) if args.versioned else root
     ensure_dir(out_dir)
     index_path = out_dir / "faiss.index"
     meta_path = out_dir / "metadata.jsonl"
     stats_path = out_dir / "stats.json"
 
-    # 1) Load data
-    if args.source == "mysql":
-        df = load_from_mysql(table=args.table, limit=args.max_rows if args.max_rows > 0 else None)
-        source_name = "mysql"
-    else:
-        if not args.csv_path:
-            raise ValueError("--csv-path is required when source=csv")
-        csv_path = Path(args.csv_path).resolve()
-        if not csv_path.exists():
-            raise FileNotFoundError(f"CSV not found: {csv_path}")
-        df = load_from_csv(csv_path, limit=args.max_rows if args.max_rows > 0 else None)
-        source_name = f"csv:{csv_path.name}"
-
+    # 1) Load data (--shards: loaded once by run_sharded, filtered to this shard here)
+    df, source_name = loaded or load_source(args)
+    df = select_shard(df, args)
     if df.empty:
         raise ValueError("No data loaded. Check source and fields.")
     print(f"[Data] Loaded rows: {len(df)} from {source_name}")
 
-    # 2) Build corpus
-    corpus = build_corpus(
-        df=df,
-        min_chunk_chars=args.min_chunk_chars,
-        chunk_size=args.chunk_size,
-        chunk_overlap=args.chunk_overlap,
-    )
+    # 2) Load model (or a pool of replicas with --workers, which also parallelizes chunking)
+    model = open_encoder(args)
+    cache = open_embed_cache(args, root, model.key)
+
+    # 3) Build corpus
+    corpus = chunk_corpus(df, args, model)
     if not corpus:
         raise ValueError("Empty corpus after chunking. Adjust chunk parameters.")
     print(f"[Corpus] Total chunks: {len(corpus)} (avg per item ~ {len(corpus)/max(len(df),1):.2f})")
 
-    # 3) Load model
-    print(f"[Model] Loading: {args.model_name}")
-    model = SentenceTransformer(args.model_name)
-
     # 4) Embeddings
     texts = [c["chunk"] for c in corpus]
-    embeddings = embed_texts(model, texts, batch_size=args.batch_size, normalize=True)
+    embeddings = embed_texts(model, texts, batch_size=args.batch_size, normalize=True, cache=cache)
     dim = embeddings.shape[1]
     print(f"[Embed] Shape: {embeddings.shape}, dim={dim}")
 
-    # 5) FAISS index (cosine via inner product on normalized vectors)
-    index = faiss.IndexFlatIP(dim)
-    index.add(embeddings)
+    # 5) FAISS index (cosine via inner product on normalized vectors), stable chunk ids
+    ids = np.asarray([chunk_vector_id(c["dramaId"], c["chunk_id"]) for c in corpus], dtype="int64")
+    index = build_faiss_index(embeddings, ids, args)
     faiss.write_index(index, str(index_path))
-    print(f"[FAISS] Index written to: {index_path}")
+    print(f"[FAISS] Index ({args.index_type}) written to: {index_path}")
+    chunk_report = evaluate_index(index, embeddings, ids, k=args.recall_k, n_queries=args.recall_queries)
 
     # 6) Metadata + stats
-    extra = {
-        "source": source_name,
-        "model": args.model_name,
-    }
-    save_metadata(meta_path, corpus, extra)
-    print(f"[Meta] Metadata written to: {meta_path}")
+    writer = MetaWriter(out_dir)
+    writer.add_chunks(
+        drama_ids=[c["dramaId"] for c in corpus],
+        chunk_ids=[c["chunk_id"] for c in corpus],
+        titles=[c["title"] for c in corpus],
+        categories=[c["category"] for c in corpus],
+        texts=texts,
+    )
+    if args.export_jsonl:
+        extra = {
+            "source": source_name,
+            "model": args.model_name,
+        }
+        save_metadata(meta_path, corpus, extra)
+        print(f"[Meta] JSONL metadata exported to: {meta_path}")
+    save_drama_chunk_ranges(out_dir / "drama_chunks.json", corpus)
+    chunk_report["bm25"] = write_bm25(out_dir, "chunk", texts)
+    print(f"[BM25] Chunk postings: {chunk_report['bm25']}")
 
     # Build drama-level index + metadata (per-drama, with tags)
-    build_drama_level(df=df, model=model, out_dir=out_dir)
+    drama_report = build_drama_level(df=df, model=model, out_dir=out_dir, args=args, writer=writer, cache=cache)
+    writer.close()
+    print(f"[Meta] Columnar metadata written to: {out_dir}")
 
     elapsed = time.time() - t0
     stats = {
@@ -351,6 +1411,8 @@ def main():
         "chunks": int(len(corpus)),
         "dimension": int(dim),
         "model": args.model_name,
+        "encoder_backend": model.backend,
+        "encoder_variant": model.variant,
         "chunk_size": args.chunk_size,
         "chunk_overlap": args.chunk_overlap,
         "min_chunk_chars": args.min_chunk_chars,
@@ -358,9 +1420,16 @@ def main():
         "built_at": datetime.utcnow().isoformat() + "Z",
         "elapsed_sec": round(elapsed, 3),
         "avg_chars_per_chunk": round(float(np.mean([c["text_len"] for c in corpus])), 2),
+        "index_type": args.index_type,
+        "meta_format": "columnar",
+        "index_report": {"chunk": chunk_report, "drama": drama_report},
+        "embed_cache": report_embed_cache(cache),
+        "workers": model.report() if isinstance(model, WorkerPool) else None,
     }
     write_stats(stats_path, stats)
+    write_sync_state(out_dir, df.attrs.get("watermark"), df.attrs.get("watermark_rows"))
     print(f"[Stats] Stats written to: {stats_path}")
+    finish_build(root, out_dir, build_id, model, dim, args.index_type, args.keep_versions, shard_partition(args))
     print(f"[Done] Elapsed {elapsed:.2f}s")
 
     # 7) Optional quick retrieval test
@@ -369,9 +1438,10 @@ def main():
         q_emb = embed_texts(model, [args.test_query], batch_size=1, normalize=True)
         top_k = min(5, len(corpus))
         D, I = index.search(q_emb, top_k)
+        pos = {int(v): i for i, v in enumerate(ids)}
         results = []
         for rank, (idx, score) in enumerate(zip(I[0], D[0]), start=1):
-            meta = corpus[int(idx)]
+            meta = corpus[pos[int(idx)]]
             snippet = meta["chunk"][:160].replace("\n", " ")
             results.append({
                 "rank": rank,
@@ -383,5 +1453,15 @@ def main():
             })
         print(json.dumps(results, ensure_ascii=False, indent=2))
 
+    if isinstance(model, WorkerPool):
+        model.close()
+
+def main():
+    args = parse_args()
+    if args.shards > 1:
+        run_sharded(args)
+    else:
+        run_build(args)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
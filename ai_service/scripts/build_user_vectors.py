@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Build / update the user taste vectors served by the recommend scene (format: app/userstore.py).
+- Source: watch_history in MySQL (DB_* env, as build_index.py) or a CSV export of it
+  (userId, dramaId, progress, lastWatchTime[, updateTime])
+- Drama vectors: reconstructed from drama.faiss of --index-dir (plain, versioned or sharded root);
+  nothing is re-encoded
+- Full build: aggregate every (userId, dramaId) pair -> new base segment, empty delta
+- --incremental: users with rows whose updateTime >= the watermark in state.json are recomputed from
+  their full history; those whose vector or watched list actually changed are merged into the delta
+  segment, which is folded into a new base once it holds more than --compact-ratio of the base.
+  A run where no user changed publishes no new version (it only moves the watermark forward)
+Run the full build after an index rebuild with a different model (the service ignores a user store
+whose model differs from the index it serves).
+Usage:
+  python scripts/build_user_vectors.py --source mysql --index-dir index --out-dir index/users
+  python scripts/build_user_vectors.py --source mysql --index-dir index --out-dir index/users --incremental
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+try:
+    import faiss  # type: ignore
+except Exception as e:
+    raise RuntimeError("FAISS is required. Please install faiss-cpu.") from e
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from app.metastore import load_tables, rows_for_ids  # noqa: E402
+from app.userstore import Segment, merge_segments, read_state, write_state  # noqa: E402
+from app.versions import SHARDS_FILE, read_manifest, resolve_index_dir, shard_dir  # noqa: E402
+
+HISTORY_COLUMNS = ["userId", "dramaId", "progress", "lastWatchTime", "updateTime"]
+# 每批聚合的 (用户, 剧) 对数，控制 n x dim 临时矩阵的大小
+PAIR_BLOCK = 200_000
+
+
+# -----------------------------
+# watch_history
+# -----------------------------
+
+def _engine():
+    load_dotenv(override=True)
+    host = os.getenv("DB_HOST", "127.0.0.1")
+    port = int(os.getenv("DB_PORT", "3306"))
+    user = os.getenv("DB_USER", "root")
+    password = os.getenv("DB_PASSWORD", "")
+    db = os.getenv("DB_NAME", "short_drama")
+
+    from sqlalchemy import create_engine  # lazy import
+    return create_engine(f"mysql+pymysql://{user}:{password}@{host}:{port}/{db}?charset=utf8mb4")
+
+
+def load_history_mysql(table: str, user_ids: Optional[List[int]] = None) -> pd.DataFrame:
+    from sqlalchemy import bindparam, text  # lazy import
+    cols = ", ".join(HISTORY_COLUMNS)
+    with _engine().connect() as conn:
+        if user_ids is None:
+            return pd.read_sql(text(f"SELECT {cols} FROM {table} WHERE dramaId IS NOT NULL"), conn)
+        sql = text(f"SELECT {cols} FROM {table} WHERE dramaId IS NOT NULL AND userId IN :ids") \
+            .bindparams(bindparam("ids", expanding=True))
+        parts = [pd.read_sql(sql, conn, params={"ids": user_ids[i:i + 1000]}) for i in range(0, len(user_ids), 1000)]
+    return pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=HISTORY_COLUMNS)
+
+
+def changed_users_mysql(table: str, watermark: str) -> Tuple[List[int], Optional[pd.Timestamp]]:
+    from sqlalchemy import text  # lazy import
+    with _engine().connect() as conn:
+        df = pd.read_sql(text(f"SELECT userId, MAX(updateTime) AS t FROM {table} "
+                              f"WHERE updateTime >= :wm GROUP BY userId"), conn, params={"wm": watermark})
+    if df.empty:
+        return [], None
+    return [int(u) for u in df["userId"]], pd.to_datetime(df["t"]).max()
+
+
+def load_history_csv(path: Path) -> pd.DataFrame:
+    df = pd.read_csv(path)
+    if "updateTime" not in df.columns:
+        df["updateTime"] = df["lastWatchTime"]
+    return df[df["dramaId"].notna()][HISTORY_COLUMNS]
+
+
+def changed_users(df: pd.DataFrame, watermark: str) -> Tuple[List[int], Optional[pd.Timestamp]]:
+    t = pd.to_datetime(df["updateTime"])
+    # >=：水位线只到秒，同一秒内上一轮读取之后才提交的行也要捡回来；重算结果不变的用户由 drop_unchanged 过滤
+    hit = df[t >= pd.Timestamp(watermark)]
+    if hit.empty:
+        return [], None
+    return sorted(int(u) for u in hit["userId"].unique()), t[hit.index].max()
+
+
+# -----------------------------
+# Drama vectors
+# -----------------------------
+
+class DramaVectors:
+    """drama.faiss vectors by dramaId across the index (or every shard of a sharded root)."""
+    def __init__(self, root: Path):
+        if (root / SHARDS_FILE).exists():
+            with (root / SHARDS_FILE).open("r", encoding="utf-8") as f:
+                roots = [shard_dir(root, i) for i in range(int(json.load(f)["shards"]))]
+        else:
+            roots = [root]
+        self.parts = []
+        self.versions: List[Optional[str]] = []
+        models = set()
+        for r in roots:
+            index_dir, build_id = resolve_index_dir(r)
+            manifest = read_manifest(index_dir) or {}
+            _, dramas = load_tables(index_dir)
+            if not getattr(dramas, "id_mapped", False):
+                raise ValueError(f"{index_dir} was built without stable ids; rebuild the index first")
+            self.parts.append((np.asarray(dramas.drama_ids), faiss.read_index(str(index_dir / "drama.faiss"))))
+            self.versions.append(build_id)
+            models.add(manifest.get("model"))
+        if len(models) > 1:
+            raise ValueError(f"Index parts use different models: {sorted(map(str, models))}")
+        self.model = models.pop()
+        self.dim = int(self.parts[0][1].d)
+
+    def lookup(self, ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(found mask, float32 vectors) for `ids`; rows of ids not in the index stay zero."""
+        ids = np.asarray(ids, dtype="int64")
+        found = np.zeros(len(ids), dtype=bool)
+        vecs = np.zeros((len(ids), self.dim), dtype="float32")
+        for known, index in self.parts:
+            hit = (rows_for_ids(known, ids) >= 0) & ~found
+            if hit.any():
+                vecs[hit] = index.reconstruct_batch(ids[hit])
+                found |= hit
+        return found, vecs
+
+
+# -----------------------------
+# Aggregation
+# -----------------------------
+
+def aggregate(history: pd.DataFrame, dramas: DramaVectors, half_life_days: float) -> Segment:
+    """One taste vector per user: sum of drama vectors weighted by watch time and recency, normalized."""
+    if history.empty:
+        return Segment.empty(dramas.dim)
+    df = history.assign(lastWatchTime=pd.to_datetime(history["lastWatchTime"]),
+                        progress=pd.to_numeric(history["progress"], errors="coerce").fillna(0).clip(lower=0))
+    # 同一部剧的多集合并：累计观看秒数 + 最近观看时间
+    pairs = (df.groupby(["userId", "dramaId"], sort=True)
+               .agg(progress=("progress", "sum"), last=("lastWatchTime", "max")).reset_index())
+    users = pairs["userId"].to_numpy(dtype="int64")
+    drama_ids = pairs["dramaId"].to_numpy(dtype="int64")
+    latest = pairs.groupby("userId")["last"].transform("max")
+    age_days = ((latest - pairs["last"]).dt.total_seconds() / 86400.0).to_numpy()
+    weights = np.log1p(pairs["progress"].to_numpy(dtype="float64") / 60.0) * 0.5 ** (age_days / half_life_days)
+
+    uniq, starts = np.unique(users, return_index=True)
+    offsets = np.append(starts, len(users)).astype("int64")
+    vectors = np.zeros((len(uniq), dramas.dim), dtype="float32")
+    # 按用户边界分块：每块只查一次向量、做一次 reduceat
+    u0 = 0
+    while u0 < len(uniq):
+        u1 = int(np.searchsorted(offsets, offsets[u0] + PAIR_BLOCK, side="right")) - 1
+        u1 = min(max(u1, u0 + 1), len(uniq))
+        lo, hi = int(offsets[u0]), int(offsets[u1])
+        found, vecs = dramas.lookup(drama_ids[lo:hi])
+        w = np.where(found, weights[lo:hi], 0.0).astype("float32")
+        vectors[u0:u1] = np.add.reduceat(vecs * w[:, None], offsets[u0:u1] - lo, axis=0)
+        u0 = u1
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+    # 已看列表保留所有记录（包括已下线的剧），推荐时一律排除
+    return Segment(uniq, vectors.astype("float16"), offsets, drama_ids)
+
+
+# -----------------------------
+# Store update
+# -----------------------------
+
+def drop_unchanged(changed: Segment, segments: List[Segment]) -> Segment:
+    """Rows of `changed` whose vector or watched list differs from what `segments` (delta first) hold."""
+    keep = np.ones(len(changed), dtype=bool)
+    for i, user_id in enumerate(np.asarray(changed.user_ids)):
+        for seg in segments:
+            row = seg.row(int(user_id))
+            if row < 0:
+                continue
+            old = seg.watched_ids[seg.watched_offsets[row]:seg.watched_offsets[row + 1]]
+            new = changed.watched_ids[changed.watched_offsets[i]:changed.watched_offsets[i + 1]]
+            keep[i] = not (np.array_equal(seg.vectors[row], changed.vectors[i]) and np.array_equal(old, new))
+            break
+    return changed.take(np.flatnonzero(keep))
+
+
+def format_watermark(watermark) -> Optional[str]:
+    return pd.Timestamp(watermark).strftime("%Y-%m-%d %H:%M:%S") if watermark is not None else None
+
+
+def new_segment_name(kind: str) -> str:
+    return f"{kind}-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+
+def publish(root: Path, base: str, delta: Optional[str], n_users: int, watermark, dramas: DramaVectors,
+            args: argparse.Namespace, extra: Dict) -> Dict:
+    """
+    Write state.json (atomic), then delete segments neither it nor the state it replaced names.
+    The previous generation stays on disk until the next publish (as versions.prune_versions keeps
+    old index versions): a service that read the old state.json may still be opening its segments.
+    """
+    previous = read_state(root) or {}
+    state = {
+        "version": new_segment_name("v")[2:],
+        "base": base,
+        "delta": delta,
+        "users": int(n_users),
+        "watermark": format_watermark(watermark),
+        "model": dramas.model,
+        "dim": dramas.dim,
+        "indexVersions": dramas.versions,
+        "halfLifeDays": args.half_life_days,
+        "updatedAt": datetime.utcnow().isoformat() + "Z",
+        **extra,
+    }
+    write_state(root, state)
+    live = {base, delta, previous.get("base"), previous.get("delta")}
+    for p in root.iterdir():
+        if p.is_dir() and p.name not in live:
+            shutil.rmtree(p, ignore_errors=True)
+    return state
+
+
+def run_full(args: argparse.Namespace, root: Path, dramas: DramaVectors) -> Dict:
+    history = load_history_csv(Path(args.csv_path)) if args.source == "csv" else load_history_mysql(args.table)
+    print(f"[History] {len(history)} rows")
+    seg = aggregate(history, dramas, args.half_life_days)
+    base = new_segment_name("base")
+    seg.write(root / base)
+    watermark = pd.to_datetime(history["updateTime"]).max() if len(history) else None
+    return publish(root, base, None, len(seg), watermark, dramas, args, {"lastRun": {"mode": "full", "rows": len(history)}})
+
+
+def run_incremental(args: argparse.Namespace, root: Path, dramas: DramaVectors) -> Optional[Dict]:
+    state = read_state(root)
+    if state is None or not state.get("watermark"):
+        raise FileNotFoundError(f"No usable {root / 'state.json'}; run a full build first")
+    if state.get("model") != dramas.model:
+        raise ValueError(f"User store was built for {state.get('model')}, index serves {dramas.model}; "
+                         f"run a full build")
+    if args.source == "csv":
+        full = load_history_csv(Path(args.csv_path))
+        users, new_wm = changed_users(full, state["watermark"])
+        history = full[full["userId"].isin(users)]
+    else:
+        users, new_wm = changed_users_mysql(args.table, state["watermark"])
+        history = load_history_mysql(args.table, users) if users else None
+    print(f"[Sync] {len(users)} users with new history since {state['watermark']}")
+    if not users:
+        return None
+    base = Segment.open(root / state["base"])
+    old_delta = Segment.open(root / state["delta"]) if state.get("delta") else None
+    changed = drop_unchanged(aggregate(history, dramas, args.half_life_days),
+                             [s for s in (old_delta, base) if s is not None])
+    print(f"[Sync] {len(changed)} of them changed")
+    if len(changed) == 0:
+        # 只有水位线上的边界行：不发布新版本（version 不变，语义缓存分区不失效），仅推进水位线
+        watermark = format_watermark(new_wm)
+        if watermark != state["watermark"]:
+            write_state(root, {**state, "watermark": watermark})
+        return None
+    delta = merge_segments(changed, old_delta) if old_delta is not None else changed
+    n_users = len(delta) + int((~np.isin(np.asarray(base.user_ids), np.asarray(delta.user_ids))).sum())
+    info = {"mode": "incremental", "users": len(changed), "rows": len(history)}
+    if len(delta) > args.compact_ratio * max(len(base), 1):
+        # delta 过大：并入新的 base
+        merged = merge_segments(delta, base)
+        base_name = new_segment_name("base")
+        merged.write(root / base_name)
+        info["compacted"] = True
+        return publish(root, base_name, None, len(merged), new_wm, dramas, args, {"lastRun": info})
+    delta_name = new_segment_name("delta")
+    delta.write(root / delta_name)
+    return publish(root, state["base"], delta_name, n_users, new_wm, dramas, args, {"lastRun": info})
+
+
+def parse_args() -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="Build user taste vectors from watch_history.")
+    ap.add_argument("--source", choices=["mysql", "csv"], required=True, help="watch_history source")
+    ap.add_argument("--table", default="watch_history", help="MySQL table name (default: watch_history)")
+    ap.add_argument("--csv-path", type=str, help="CSV export of watch_history if source=csv")
+    ap.add_argument("--index-dir", type=str, default="ai_service/index",
+                    help="Index dir, versioned root or sharded root (build_index.py --out-dir)")
+    ap.add_argument("--out-dir", type=str, default="ai_service/index/users", help="User store dir (USER_STORE_DIR)")
+    ap.add_argument("--half-life-days", type=float, default=14.0, help="Recency half-life of a watch")
+    ap.add_argument("--incremental", action="store_true",
+                    help="Recompute only users with history rows at or after the watermark in state.json")
+    ap.add_argument("--compact-ratio", type=float, default=0.2,
+                    help="Fold the delta into a new base once it holds more users than this share of the base")
+    return ap.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.source == "csv" and not args.csv_path:
+        raise SystemExit("--csv-path is required with --source csv")
+    t0 = time.time()
+    root = Path(args.out_dir).resolve()
+    root.mkdir(parents=True, exist_ok=True)
+    dramas = DramaVectors(Path(args.index_dir).resolve())
+    state = run_incremental(args, root, dramas) if args.incremental else run_full(args, root, dramas)
+    if state is None:
+        return
+    print(f"[Users] {state['users']} users, version {state['version']} "
+          f"(base={state['base']}, delta={state['delta']}); elapsed {time.time() - t0:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
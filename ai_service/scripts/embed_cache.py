@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Inspect / garbage-collect the on-disk embedding cache used by build_index.py.
+- stats: entries and size per (model, normalize) namespace
+- gc:    keep only vectors whose text is still referenced by the given index dirs
+         (chunk + drama texts from the columnar metadata; a versioned root covers all its versions,
+         a sharded root every shard); refuses to run when the dirs reference no text at all
+Usage:
+  python scripts/embed_cache.py stats --cache-dir index/embed_cache
+  python scripts/embed_cache.py gc --cache-dir index/embed_cache --index-dir index
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import List, Set
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from app.embcache import META_FILE, DiskEmbeddingCache, live_keys  # noqa: E402
+from app.metastore import load_tables  # noqa: E402
+from app.versions import SHARDS_FILE, VERSIONS_DIR, shard_dir  # noqa: E402
+
+
+def namespaces(cache_dir: Path) -> List[Path]:
+    return sorted(p for p in cache_dir.iterdir() if (p / META_FILE).exists()) if cache_dir.exists() else []
+
+
+def open_namespace(ns: Path) -> DiskEmbeddingCache:
+    with (ns / META_FILE).open("r", encoding="utf-8") as f:
+        meta = json.load(f)
+    return DiskEmbeddingCache(ns.parent, meta["model"], bool(meta.get("normalize", True)))
+
+
+def index_dirs(root: Path) -> List[Path]:
+    """Every index dir under a plain dir, versioned root or sharded root (build_index.py --shards)."""
+    if (root / SHARDS_FILE).exists():
+        with (root / SHARDS_FILE).open("r", encoding="utf-8") as f:
+            n_shards = int(json.load(f)["shards"])
+        return [d for i in range(n_shards) for d in index_dirs(shard_dir(root, i))]
+    if (root / VERSIONS_DIR).exists():
+        return sorted(p for p in (root / VERSIONS_DIR).iterdir() if p.is_dir())
+    return [root]
+
+
+def referenced_texts(roots: List[Path]) -> Set[bytes]:
+    live: Set[bytes] = set()
+    for root in roots:
+        for d in index_dirs(root):
+            if not (d / "faiss.index").exists():
+                continue
+            chunks, dramas = load_tables(d)
+            live |= live_keys(chunks.text(i) for i in range(len(chunks)))
+            live |= live_keys(dramas.text(i) for i in range(len(dramas)))
+    return live
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Embedding cache maintenance.")
+    ap.add_argument("command", choices=["stats", "gc"])
+    ap.add_argument("--cache-dir", type=str, default="ai_service/index/embed_cache")
+    ap.add_argument("--index-dir", type=str, action="append", default=[],
+                    help="Index dir (or versioned root) whose texts stay cached; repeatable")
+    args = ap.parse_args()
+
+    cache_dir = Path(args.cache_dir).resolve()
+    if args.command == "stats":
+        out = []
+        for ns in namespaces(cache_dir):
+            cache = open_namespace(ns)
+            size = cache.vectors_path.stat().st_size if cache.vectors_path.exists() else 0
+            out.append({"dir": str(ns), "model": cache.meta["model"], "dim": cache.dim,
+                        "entries": cache.rows, "mb": round(size / 2 ** 20, 2)})
+        print(json.dumps(out, ensure_ascii=False, indent=2))
+        return
+
+    if not args.index_dir:
+        raise SystemExit("gc needs at least one --index-dir (otherwise every entry would be dropped)")
+    live = referenced_texts([Path(p).resolve() for p in args.index_dir])
+    print(f"[GC] {len(live)} referenced texts")
+    if not live:
+        raise SystemExit(f"No index found under {args.index_dir}; refusing to drop every cached vector")
+    for ns in namespaces(cache_dir):
+        print(json.dumps(open_namespace(ns).compact(live), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Shared query encoder process for multi-worker deployments (protocol: app/encoder_service.py).
+Loads the model once; every uvicorn worker started with ENCODER_SOCKET=<path> encodes through it,
+so N workers hold one model instead of N. Concurrent requests are micro-batched.
+Usage:
+  python scripts/encoder_server.py --socket /tmp/rag-encoder.sock
+  ENCODER_SOCKET=/tmp/rag-encoder.sock INDEX_MMAP=1 uvicorn app.main:app --workers 4
+"""
+
+import argparse
+import logging
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from app.admission import configure_threads  # noqa: E402
+from app.config import settings  # noqa: E402
+from app.encoder_service import serve  # noqa: E402
+from app.encoders import ENCODER_BACKENDS, load_encoder  # noqa: E402
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Serve query embeddings over a Unix socket.")
+    ap.add_argument("--socket", type=str, default=settings.encoder_socket or "/tmp/rag-encoder.sock")
+    ap.add_argument("--model-name", type=str, default=settings.embedding_model_name)
+    ap.add_argument("--encoder-backend", type=str, default=settings.encoder_backend, choices=ENCODER_BACKENDS)
+    ap.add_argument("--onnx-file", type=str, default=settings.encoder_onnx_file)
+    ap.add_argument("--model-dir", type=str, default=settings.embedding_model_dir, help="See scripts/export_model.py")
+    ap.add_argument("--window-ms", type=float, default=settings.embed_batch_window_ms, help="Batching window")
+    ap.add_argument("--max-batch", type=int, default=settings.embed_batch_max_size)
+    args = ap.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    # 所有 worker 的编码都在这一个进程里：intra-op 线程用满全部核
+    configure_threads(1)
+    encoder = load_encoder(args.model_name, args.encoder_backend, args.onnx_file or None,
+                           local_dir=args.model_dir or None)
+    logging.info(f"Encoder {encoder.key} (dim={encoder.dim}) serving on {args.socket}, pid={os.getpid()}")
+    serve(args.socket, encoder, window_ms=args.window_ms, max_batch=args.max_batch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Run a sharded index locally: one shard node per <root>/shard-XX (build_index.py --shards N) plus a
+coordinator in front of them, each a separate uvicorn process on 127.0.0.1.
+Other environment (ENCODER_BACKEND, SHARD_TIMEOUT_MS, LLM_*, ...) is passed through.
+To try partial results, pause one node (`kill -STOP <pid>`, pids are printed) and query the
+coordinator: answers keep coming from the other shards with `X-Partial-Results: 1`.
+Usage:
+  python scripts/build_index.py --source csv --csv-path data.csv --out-dir /tmp/sharded --shards 3
+  python scripts/shard_cluster.py --root /tmp/sharded --port 8000
+"""
+
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+import httpx
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+from app.versions import SHARDS_FILE  # noqa: E402
+
+
+def _start(port: int, env: dict) -> subprocess.Popen:
+    cmd = [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+           "--log-level", "warning"]
+    return subprocess.Popen(cmd, cwd=str(ROOT), env=dict(os.environ, **env))
+
+
+def _wait_ready(procs: List[subprocess.Popen], urls: List[str], timeout_sec: float) -> None:
+    deadline = time.time() + timeout_sec
+    pending = list(zip(procs, urls))
+    while pending and time.time() < deadline:
+        for proc, url in list(pending):
+            if proc.poll() is not None:
+                raise RuntimeError(f"{url} exited with {proc.returncode}")
+            try:
+                if httpx.get(f"{url}/readyz", timeout=1.0).status_code == 200:
+                    pending.remove((proc, url))
+            except httpx.HTTPError:
+                pass
+        time.sleep(0.2)
+    if pending:
+        raise RuntimeError(f"not ready: {[u for _, u in pending]}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Start local shard nodes + a coordinator for a sharded index.")
+    ap.add_argument("--root", type=str, required=True, help="--out-dir of build_index.py --shards N")
+    ap.add_argument("--port", type=int, default=8000, help="Coordinator port; shard i listens on port + 1 + i")
+    ap.add_argument("--no-coordinator", action="store_true", help="Only start the shard nodes")
+    ap.add_argument("--ready-timeout", type=float, default=300.0)
+    args = ap.parse_args()
+
+    root = Path(args.root).resolve()
+    with (root / SHARDS_FILE).open("r", encoding="utf-8") as f:
+        shard_map = json.load(f)
+
+    procs: List[subprocess.Popen] = []
+    urls: List[str] = []
+    try:
+        for i, name in enumerate(shard_map["dirs"]):
+            port = args.port + 1 + i
+            # 分片节点不接收原始问题，不需要语义缓存
+            procs.append(_start(port, {"AI_INDEX_DIR": str(root / name), "SHARD_URLS": "",
+                                       "SEMANTIC_CACHE_SIZE": "0"}))
+            urls.append(f"http://127.0.0.1:{port}")
+        _wait_ready(procs, urls, args.ready_timeout)
+        for proc, url in zip(procs, urls):
+            print(f"[Shard] {url} pid={proc.pid}")
+        if not args.no_coordinator:
+            coord = f"http://127.0.0.1:{args.port}"
+            procs.append(_start(args.port, {"SHARD_URLS": ",".join(urls)}))
+            _wait_ready(procs[-1:], [coord], args.ready_timeout)
+            print(f"[Coordinator] {coord} pid={procs[-1].pid}")
+        print(f"SHARD_URLS={','.join(urls)}")
+        # 子进程已启动后再屏蔽信号（屏蔽字会被子进程继承）
+        signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGINT, signal.SIGTERM})
+        signal.sigwait({signal.SIGINT, signal.SIGTERM})
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+if __name__ == "__main__":
+    main()
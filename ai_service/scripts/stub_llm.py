@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Local OpenAI-compatible stub for testing LLM paths without a real provider.
+- POST /v1/chat/completions: streamed (SSE `data:` chunks + `[DONE]`) or plain JSON
+- The answer cites the drama titles found in the prompt, emitted one word per chunk after
+  --ttft-ms, then every --token-ms; --fail-rate makes a fraction of calls return 500
+- GET /stats: started / completed / cancelled (client went away mid-stream) / failed counts and
+  peak concurrent calls (maxActive);
+  `usage` is reported (prompt ~ chars / 4) for plain calls and with stream_options.include_usage
+Usage:
+  python scripts/stub_llm.py --port 9100 --ttft-ms 300 --token-ms 40
+  LLM_PROVIDER=OPENAI OPENAI_API_KEY=stub OPENAI_BASE_URL=http://127.0.0.1:9100/v1 uvicorn app.main:app ...
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI(title="stub-llm")
+stats = {"started": 0, "completed": 0, "cancelled": 0, "failed": 0, "promptChars": 0, "active": 0, "maxActive": 0}
+cfg = argparse.Namespace(ttft_ms=200.0, token_ms=30.0, fail_rate=0.0)
+
+
+def _answer(messages) -> str:
+    prompt = "\n".join(m.get("content") or "" for m in messages)
+    titles = re.findall(r"^\[\d+\] (.+?)(?: \(.*?\))?:", prompt, flags=re.M)[:3]
+    if not titles:
+        return "I could not find a matching drama in the provided list."
+    return (f"You might enjoy {', '.join(titles)}. "
+            f"{titles[0]} matches your request most closely, based on its story and genre.")
+
+
+def _usage(prompt_chars: int, completion_tokens: int):
+    # 粗略按 4 字符 / token 估算提示词长度
+    return {"prompt_tokens": prompt_chars // 4, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_chars // 4 + completion_tokens}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    stats["started"] += 1
+    stats["active"] += 1
+    stats["maxActive"] = max(stats["maxActive"], stats["active"])
+    try:
+        return await _respond(body)
+    except BaseException:
+        stats["active"] -= 1
+        raise
+
+
+async def _respond(body):
+    prompt_chars = sum(len(m.get("content") or "") for m in body.get("messages", []))
+    stats["promptChars"] += prompt_chars
+    await asyncio.sleep(cfg.ttft_ms / 1000.0)
+    if random.random() < cfg.fail_rate:
+        stats["failed"] += 1
+        stats["active"] -= 1
+        return JSONResponse(status_code=500, content={"error": {"message": "stub failure"}})
+    words = re.findall(r"\S+\s*", _answer(body.get("messages", [])))
+    model = body.get("model", "stub")
+    created = int(time.time())
+
+    if not body.get("stream"):
+        await asyncio.sleep(cfg.token_ms * len(words) / 1000.0)
+        stats["completed"] += 1
+        stats["active"] -= 1
+        text = "".join(words)
+        return {"id": "stub", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": _usage(prompt_chars, len(words))}
+
+    async def chunks():
+        done = False
+        try:
+            for i, w in enumerate(words):
+                if i:
+                    await asyncio.sleep(cfg.token_ms / 1000.0)
+                delta = {"choices": [{"index": 0, "delta": {"content": w}, "finish_reason": None}],
+                         "id": "stub", "object": "chat.completion.chunk", "created": created, "model": model}
+                yield f"data: {json.dumps(delta)}\n\n"
+            if (body.get("stream_options") or {}).get("include_usage"):
+                yield f"data: {json.dumps({'choices': [], 'usage': _usage(prompt_chars, len(words))})}\n\n"
+            yield "data: [DONE]\n\n"
+            done = True
+        finally:
+            stats["completed" if done else "cancelled"] += 1
+            stats["active"] -= 1
+
+    return StreamingResponse(chunks(), media_type="text/event-stream")
+
+
+@app.get("/stats")
+def get_stats():
+    return stats
+
+
+def main():
+    ap = argparse.ArgumentParser(description="OpenAI-compatible stub LLM server.")
+    ap.add_argument("--host", type=str, default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=9100)
+    ap.add_argument("--ttft-ms", type=float, default=200.0, help="Delay before the first token")
+    ap.add_argument("--token-ms", type=float, default=30.0, help="Delay between tokens")
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of calls answered with HTTP 500")
+    args = ap.parse_args()
+    cfg.ttft_ms, cfg.token_ms, cfg.fail_rate = args.ttft_ms, args.token_ms, args.fail_rate
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
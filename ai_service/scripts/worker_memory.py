@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Per-process memory of a running service: the given pid and all its descendants (uvicorn master +
+workers, plus the encoder server if passed with --pid too). Sum of PSS is the real combined
+footprint; compare INDEX_MMAP=0 vs 1 (and ENCODER_SOCKET) to verify the sharing.
+Usage:
+  python scripts/worker_memory.py --pid $(pgrep -f "uvicorn app.main:app" | head -1)
+  python scripts/worker_memory.py --pid 1234 --pid 5678 --json
+"""
+
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from app.metrics import process_memory  # noqa: E402
+
+
+def _children() -> Dict[int, List[int]]:
+    out: Dict[int, List[int]] = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat", "r") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        ppid = int(stat.rsplit(")", 1)[1].split()[1])  # comm 可能含空格，从最后一个 ')' 之后取
+        out.setdefault(ppid, []).append(int(name))
+    return out
+
+
+def _cmdline(pid: int) -> str:
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return f.read().replace(b"\0", b" ").decode("utf-8", "replace").strip()[:80]
+    except OSError:
+        return ""
+
+
+def main():
+    ap = argparse.ArgumentParser(description="RSS / PSS / USS of a process tree.")
+    ap.add_argument("--pid", type=int, action="append", required=True, help="Root pid (repeatable)")
+    ap.add_argument("--json", action="store_true")
+    args = ap.parse_args()
+
+    tree = _children()
+    pids: List[int] = []
+    stack = list(args.pid)
+    while stack:
+        pid = stack.pop(0)
+        if pid not in pids:
+            pids.append(pid)
+            stack.extend(sorted(tree.get(pid, [])))
+    rows = []
+    for pid in pids:
+        mem = process_memory(pid)
+        if mem:
+            rows.append({"pid": pid, "cmd": _cmdline(pid), **{k: round(v / 2 ** 20, 1) for k, v in mem.items()}})
+    total = {k: round(sum(r.get(k, 0.0) for r in rows), 1) for k in ("rss", "pss", "uss", "anon", "file")}
+    if args.json:
+        print(json.dumps({"processes": rows, "totalMb": total}, ensure_ascii=False, indent=2))
+        return
+    print(f"{'pid':>8} {'rss':>8} {'pss':>8} {'uss':>8} {'anon':>8} {'file':>8}  cmd (MB)")
+    for r in rows:
+        print(f"{r['pid']:>8} {r.get('rss', 0):>8} {r.get('pss', 0):>8} {r.get('uss', 0):>8} "
+              f"{r.get('anon', 0):>8} {r.get('file', 0):>8}  {r['cmd']}")
+    print(f"{'total':>8} {total['rss']:>8} {total['pss']:>8} {total['uss']:>8} {total['anon']:>8} {total['file']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,9 +7,11 @@ import com.hyx.shortdrama.config.AiServiceProperties;
 import com.hyx.shortdrama.model.dto.ai.AiAskRequest;
 import com.hyx.shortdrama.model.dto.ai.AiAskResponse;
 import com.hyx.shortdrama.model.entity.Drama;
+import com.hyx.shortdrama.model.entity.User;
 import com.hyx.shortdrama.model.vo.DramaVO;
 import com.hyx.shortdrama.service.AiService;
 import com.hyx.shortdrama.service.DramaService;
+import com.hyx.shortdrama.service.UserService;
 import lombok.extern.slf4j.Slf4j;
 import org.springframework.http.*;
 import org.springframework.stereotype.Service;
@@ -33,6 +35,9 @@ public class AiServiceImpl implements AiService {
     @Resource
     private DramaService dramaService;
 
+    @Resource
+    private UserService userService;
+
     private RestTemplate buildRestTemplate() {
         // Simple timeout-based RestTemplate
         java.net.Proxy proxy = java.net.Proxy.NO_PROXY;
@@ -68,6 +73,13 @@ public class AiServiceImpl implements AiService {
             if (req.getDramaId() != null && req.getDramaId() > 0) {
                 body.put("dramaId", req.getDramaId());
             }
+            if ("recommend".equalsIgnoreCase(scene)) {
+                // personalized by the user's watch history (precomputed taste vector) when logged in
+                User loginUser = userService.getLoginUserPermitNull(request);
+                if (loginUser != null) {
+                    body.put("userId", loginUser.getId());
+                }
+            }
 
             HttpHeaders headers = new HttpHeaders();
             headers.setContentType(MediaType.APPLICATION_JSON);